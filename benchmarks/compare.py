@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+
+"""
+Compare two benchmark results files written by `benchmarks/run.py`.
+"""
+
+import argparse
+import json
+import sys
+
+
+def load_timings(results_path):
+    with open(results_path, 'r') as f:
+        report = json.load(f)
+
+    timings = {}
+    for result in report['results']:
+        if result['seconds'] is not None:
+            timings[(result['backend'], result['scale'], result['function'])] = result['seconds']
+
+    return report.get('commit'), timings
+
+
+def main(args):
+    baseline_commit, baseline = load_timings(args.baseline)
+    current_commit, current = load_timings(args.current)
+
+    print('\t'.join(['backend', 'scale', 'function', 'baseline_s', 'current_s', 'ratio', 'status']))
+    num_regressions = 0
+    for key in sorted(set(baseline) & set(current)):
+        backend, scale, function = key
+        ratio = current[key] / baseline[key] if baseline[key] > 0 else float('inf')
+        status = ''
+        if current[key] >= args.min_seconds and ratio > args.threshold:
+            status = 'REGRESSION'
+            num_regressions += 1
+        elif baseline[key] >= args.min_seconds and ratio < 1 / args.threshold:
+            status = 'improvement'
+        print('\t'.join([backend, str(scale), function, '{:.3f}'.format(baseline[key]), '{:.3f}'.format(current[key]), '{:.2f}'.format(ratio), status]))
+
+    print(str(num_regressions) + " regression(s) between " + str(baseline_commit) + " and " + str(current_commit), file=sys.stderr)
+    if args.fail_on_regression and num_regressions > 0:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('baseline')
+    parser.add_argument('current')
+    parser.add_argument('--threshold', type=float, default=1.2, help="slowdown ratio reported as a regression")
+    parser.add_argument('--min-seconds', type=float, default=0.05, help="ignore timings shorter than this")
+    parser.add_argument('--fail-on-regression', action='store_true')
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,243 @@
+#!/usr/bin/env python
+
+"""
+Generate synthetic TB input files for benchmarking the parsers and loaders.
+
+Every file is written in the format its `tb_db.parsers` function expects, and all
+files for one scale describe the same set of samples, all sequenced on a handful
+of sequencing runs.
+"""
+
+import argparse
+import csv
+import datetime
+import json
+import os
+import random
+
+# Number of loci in the Ridom cgMLST.org M. tuberculosis scheme.
+CGMLST_NUM_LOCI = 2891
+
+MIRU_FIELDNAMES = [
+    'Key', 'Cluster', 'Acc#', 'Source', 'Collection Date', 'Year Tested',
+    'MIRU 02', 'MIRU 04', 'MIRU 10', 'MIRU 16', 'MIRU 20', 'MIRU 23', 'MIRU 24', 'MIRU 26',
+    'MIRU 27', 'MIRU 31', 'MIRU 39', 'MIRU 40', '424', '577', '1955', '2163', '2165', '2347',
+    '2401', '2461', '3171', '3690', '4052', '4156', 'MIRU Pattern',
+]
+
+SPECIES = [
+    ('Mycobacterium tuberculosis', 1773),
+    ('Mycobacterium canettii', 78331),
+    ('Mycobacterium bovis', 1765),
+    ('Mycobacterium africanum', 33894),
+    ('Mycobacterium orygis', 1305738),
+    ('Homo sapiens', 9606),
+    ('Mycobacterium avium', 1764),
+]
+
+DRUGS = ['rifampicin', 'isoniazid', 'ethambutol', 'pyrazinamide', 'streptomycin', 'moxifloxacin']
+GENES = ['rpoB', 'katG', 'embB', 'pncA', 'rpsL', 'gyrA']
+
+QUARTER_NAMES = ['1st', '2nd', '3rd', '4th']
+
+SAMPLES_PER_RUN = 96
+
+
+def sample_ids(num_samples: int):
+    """
+    Six-character sample IDs, matching the `[:6]` truncation done by the parsers.
+    """
+    if num_samples > 100000:
+        raise ValueError('at most 100000 synthetic samples are supported')
+
+    return ['B{:05d}'.format(i) for i in range(num_samples)]
+
+
+def run_id(sample_index: int):
+    return '230101_M00001_{:04d}_000000000-AAAAA'.format(sample_index // SAMPLES_PER_RUN)
+
+
+def collection_date(rng: random.Random):
+    return datetime.date(2005, 1, 1) + datetime.timedelta(days=rng.randrange(365 * 18))
+
+
+def write_samples(path, ids, rng):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sample_id', 'collection_date'])
+        for sample_id in ids:
+            writer.writerow([sample_id, collection_date(rng).isoformat()])
+
+
+def write_locations(path, ids):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['ID', 'R1', 'R2'])
+        for i, sample_id in enumerate(ids):
+            run_dir = '/data/sequencing/illumina/runs/fastq/' + run_id(i)
+            writer.writerow([
+                sample_id,
+                run_dir + '/' + sample_id + '_R1.fastq.gz',
+                run_dir + '/' + sample_id + '_R2.fastq.gz',
+            ])
+
+
+def write_qc(path, ids, rng):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow([
+            'sample_id', 'most_abundant_species_name', 'most_abundant_species_fraction_total_reads',
+            'estimated_genome_size_bp', 'estimated_depth_coverage', 'total_bases',
+            'average_base_quality', 'percent_bases_above_q30', 'percent_gc',
+        ])
+        for sample_id in ids:
+            writer.writerow([
+                sample_id, 'Mycobacterium tuberculosis', round(rng.uniform(0.8, 1.0), 4),
+                rng.randrange(4300000, 4500000), round(rng.uniform(20, 200), 2), rng.randrange(10 ** 8, 10 ** 9),
+                round(rng.uniform(30, 38), 2), round(rng.uniform(80, 98), 2), round(rng.uniform(64, 66), 2),
+            ])
+
+
+def write_cgmlst(path, ids, rng, num_loci=CGMLST_NUM_LOCI, num_founders=50, missing_rate=0.01):
+    """
+    Allele profiles derived from a small number of founder profiles with a few
+    random allele changes each, so distances look like a real collection.
+    """
+    founders = [[rng.randrange(1, 40) for _ in range(num_loci)] for _ in range(num_founders)]
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sample_id'] + ['Rv{:04d}'.format(i + 1) for i in range(num_loci)])
+        for sample_id in ids:
+            profile = list(rng.choice(founders))
+            for _ in range(rng.randrange(0, 30)):
+                profile[rng.randrange(num_loci)] = rng.randrange(1, 400)
+            row = ['-' if rng.random() < missing_rate else str(allele) for allele in profile]
+            writer.writerow([sample_id] + row)
+
+
+def write_cgmlst_clusters(path, ids, rng):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sample_id', 'clusters_cgmlst'])
+        for sample_id in ids:
+            writer.writerow([sample_id, 'BC{:04d}'.format(rng.randrange(max(1, len(ids) // 20)))])
+
+
+def write_miru(path, ids, rng):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(MIRU_FIELDNAMES)
+        for sample_id in ids:
+            date = collection_date(rng)
+            copy_numbers = [str(rng.randrange(1, 8)) for _ in range(24)]
+            writer.writerow(
+                [sample_id, 'CLUST{:04d}'.format(rng.randrange(max(1, len(ids) // 20))),
+                 'AX' + sample_id[1:], 'SPUTUM', date.strftime('%Y-%b-%d'),
+                 '{} {} QTR'.format(date.year, QUARTER_NAMES[(date.month - 1) // 3])] +
+                copy_numbers + [''.join(copy_numbers)]
+            )
+
+
+def write_species(path, ids, rng, rows_per_sample=7):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sample_id', 'taxonomy_lvl', 'name', 'taxonomy_id', 'fraction_total_reads', 'kraken_assigned_reads'])
+        for sample_id in ids:
+            remaining = 1.0
+            for name, taxonomy_id in SPECIES[:rows_per_sample]:
+                fraction = round(remaining * rng.uniform(0.5, 0.95), 5)
+                remaining -= fraction
+                writer.writerow([sample_id + '_S1', 'S', name, taxonomy_id, fraction, int(fraction * 10 ** 6)])
+
+
+def write_complex(path, ids, rng):
+    with open(path, 'w', newline='') as f:
+        writer = csv.writer(f)
+        writer.writerow(['sample_id', 'MTBC', 'NTM', 'non-mycobacterium', 'unclassified', 'complex', 'reason', 'flag'])
+        for sample_id in ids:
+            mtbc = round(rng.uniform(0.8, 1.0), 4)
+            writer.writerow([sample_id, mtbc, round((1 - mtbc) / 2, 4), round((1 - mtbc) / 2, 4), 0, 'MTBC', '', 'PASS'])
+
+
+def write_amr(directory, ids, rng):
+    os.makedirs(directory, exist_ok=True)
+    for sample_id in ids:
+        dr_variants = []
+        for _ in range(rng.randrange(0, 4)):
+            gene_index = rng.randrange(len(GENES))
+            dr_variants.append({
+                'gene': GENES[gene_index],
+                'nucleotide_change': 'c.{}C>T'.format(rng.randrange(1, 3000)),
+                'freq': round(rng.uniform(0.1, 1.0), 2),
+                'drugs': [{'drug': DRUGS[gene_index]}],
+            })
+        report = {
+            'id': sample_id,
+            'timestamp': '01-01-2023 12:00:00',
+            'drtype': 'RR-TB' if dr_variants else 'Sensitive',
+            'qc': {'median_coverage': rng.randrange(20, 200)},
+            'db_version': {'name': 'tbdb', 'commit': 'abc123'},
+            'dr_variants': dr_variants,
+        }
+        with open(os.path.join(directory, sample_id + '.results.json'), 'w') as f:
+            json.dump(report, f)
+
+
+def generate(output_dir: str, num_samples: int, seed: int = 1, num_loci: int = CGMLST_NUM_LOCI):
+    """
+    Write a full set of synthetic inputs for `num_samples` samples.
+
+    :param output_dir: Directory to write to. Created if it doesn't exist.
+    :type output_dir: str
+    :param num_samples: Number of samples.
+    :type num_samples: int
+    :param seed: Random seed, so that a scale can be regenerated identically.
+    :type seed: int
+    :param num_loci: Number of cgMLST loci.
+    :type num_loci: int
+    :return: Paths of the generated inputs, indexed by input type.
+    :rtype: dict[str, str]
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    rng = random.Random(seed)
+    ids = sample_ids(num_samples)
+
+    paths = {
+        'samples': os.path.join(output_dir, 'samples.csv'),
+        'locations': os.path.join(output_dir, 'locations.csv'),
+        'qc': os.path.join(output_dir, 'qc.csv'),
+        'cgmlst': os.path.join(output_dir, 'cgmlst.csv'),
+        'cgmlst_clusters': os.path.join(output_dir, 'cgmlst_clusters.csv'),
+        'miru': os.path.join(output_dir, 'miru.csv'),
+        'species': os.path.join(output_dir, 'species.csv'),
+        'complex': os.path.join(output_dir, 'complex.csv'),
+        'amr': os.path.join(output_dir, 'amr'),
+    }
+    write_samples(paths['samples'], ids, rng)
+    write_locations(paths['locations'], ids)
+    write_qc(paths['qc'], ids, rng)
+    write_cgmlst(paths['cgmlst'], ids, rng, num_loci=num_loci)
+    write_cgmlst_clusters(paths['cgmlst_clusters'], ids, rng)
+    write_miru(paths['miru'], ids, rng)
+    write_species(paths['species'], ids, rng)
+    write_complex(paths['complex'], ids, rng)
+    write_amr(paths['amr'], ids, rng)
+
+    return paths
+
+
+def main(args):
+    for num_samples in args.scales:
+        output_dir = os.path.join(args.output_dir, str(num_samples))
+        generate(output_dir, num_samples, seed=args.seed, num_loci=args.num_loci)
+        print("Generated " + str(num_samples) + " samples in: " + output_dir)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-o', '--output-dir', default='benchmarks/data')
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--num-loci', type=int, default=CGMLST_NUM_LOCI)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,211 @@
+#!/usr/bin/env python
+
+"""
+Time every `tb_db.parsers` function and every `tb_db.crud.create_*` loader on
+synthetic inputs at several scales, against SQLite and optionally PostgreSQL.
+
+Results are written as JSON, one file per run, so that runs on different
+commits can be compared with `benchmarks/compare.py`.
+"""
+
+import argparse
+import contextlib
+import datetime
+import glob
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+import sqlalchemy
+from sqlalchemy.orm import Session
+
+import tb_db.bulk_load as bulk_load
+import tb_db.crud as crud
+import tb_db.db as db
+import tb_db.models as models
+import tb_db.parsers as parsers
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import generate
+
+CGMLST_SCHEME = {'name': 'Ridom cgMLST.org', 'version': '2.1', 'num_loci': generate.CGMLST_NUM_LOCI}
+
+
+def _parse_amr_reports(paths):
+    return [parsers.parse_amr_summary(path) for path in paths]
+
+
+def _create_amr_summaries(session, amr_reports, runs):
+    created_amr_profiles = []
+    for amr_report in amr_reports:
+        created_amr_profiles.extend(crud.create_amr_summary(session, amr_report, runs))
+
+    return created_amr_profiles
+
+
+def parser_benchmarks(paths):
+    """
+    Parser benchmarks, in the order they run. Each returns its parsed output.
+    """
+    amr_paths = sorted(glob.glob(os.path.join(paths['amr'], '*.json')))
+
+    return [
+        ('parsers.parse_samples', lambda: parsers.parse_samples(paths['samples'])),
+        ('parsers.parse_run_ids', lambda: parsers.parse_run_ids(paths['locations'])),
+        ('parsers.parse_libraries', lambda: parsers.parse_libraries(paths['qc'], paths['locations'])),
+        ('parsers.parse_cgmlst', lambda: parsers.parse_cgmlst(paths['cgmlst'])),
+        ('parsers.parse_cgmlst_cluster', lambda: parsers.parse_cgmlst_cluster(paths['cgmlst_clusters'])),
+        ('parsers.parse_miru', lambda: parsers.parse_miru(paths['miru'])),
+        ('parsers.parse_complex', lambda: parsers.parse_complex(paths['complex'])),
+        ('parsers.parse_species', lambda: parsers.parse_species(paths['species'])),
+        ('parsers.parse_amr_summary', lambda: _parse_amr_reports(amr_paths)),
+    ]
+
+
+def loader_benchmarks(session, parsed):
+    """
+    Loader benchmarks, in dependency order (samples and libraries first).
+    """
+    runs = parsed['parsers.parse_run_ids']
+    cgmlst_profiles = list(parsed['parsers.parse_cgmlst'].values())
+
+    return [
+        ('crud.create_samples', lambda: crud.create_samples(session, parsed['parsers.parse_samples'])),
+        ('crud.create_libraries', lambda: crud.create_libraries(session, parsed['parsers.parse_libraries'])),
+        ('crud.create_cgmlst_allele_profiles', lambda: crud.create_cgmlst_allele_profiles(session, CGMLST_SCHEME, cgmlst_profiles, runs)),
+        ('crud.create_miru_profiles', lambda: crud.create_miru_profiles(session, parsed['parsers.parse_miru'])),
+        ('crud.add_samples_to_cgmlst_clusters', lambda: crud.add_samples_to_cgmlst_clusters(session, parsed['parsers.parse_cgmlst_cluster'], runs)),
+        ('crud.create_complexes', lambda: crud.create_complexes(session, parsed['parsers.parse_complex'], runs)),
+        ('crud.create_species', lambda: crud.create_species(session, parsed['parsers.parse_species'], runs)),
+        ('crud.create_amr_summary', lambda: _create_amr_summaries(session, parsed['parsers.parse_amr_summary'], runs)),
+        ('bulk_load.load_cgmlst_allele_profiles', lambda: bulk_load.load_cgmlst_allele_profiles(session, CGMLST_SCHEME, cgmlst_profiles, runs)),
+        ('bulk_load.load_miru_profiles', lambda: bulk_load.load_miru_profiles(session, parsed['parsers.parse_miru'])),
+        ('bulk_load.load_species', lambda: bulk_load.load_species(session, parsed['parsers.parse_species'], runs)),
+    ]
+
+
+def _time(function):
+    """
+    Run a function with stdout discarded (the AMR parser and loader print as they go).
+
+    :return: Elapsed wall-clock seconds, and the function's return value.
+    :rtype: tuple[float, object]
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+
+    return elapsed, result
+
+
+def _num_rows(result):
+    if isinstance(result, (list, dict)):
+        return len(result)
+
+    return None
+
+
+def run_benchmarks(backend, engine, scale, paths, functions=None):
+    """
+    Run all benchmarks for one scale on an empty database.
+
+    :return: One result per benchmark.
+    :rtype: list[dict[str, object]]
+    """
+    models.Base.metadata.drop_all(engine)
+    models.Base.metadata.create_all(engine)
+
+    results = []
+
+    def record(name, function):
+        recorded = functions is None or name in functions
+        elapsed, result = _time(function)
+        if recorded:
+            results.append({'backend': backend, 'scale': scale, 'function': name, 'seconds': elapsed, 'rows': _num_rows(result)})
+            print(backend + ' ' + str(scale) + ' ' + name + ': ' + '{:.3f}'.format(elapsed) + 's', file=sys.stderr)
+
+        return result
+
+    parsed = {}
+    for name, function in parser_benchmarks(paths):
+        parsed[name] = record(name, function)
+
+    with Session(engine) as session:
+        for name, function in loader_benchmarks(session, parsed):
+            record(name, function)
+
+    models.Base.metadata.drop_all(engine)
+
+    return results
+
+
+def _git_commit():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return commit
+
+
+def main(args):
+    commit = _git_commit()
+    report = {
+        'commit': commit,
+        'timestamp': datetime.datetime.now().isoformat(timespec='seconds'),
+        'python_version': platform.python_version(),
+        'sqlalchemy_version': sqlalchemy.__version__,
+        'platform': platform.platform(),
+        'results': [],
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        backends = [('sqlite', {'connection_uri': 'sqlite:///' + os.path.join(tmp_dir, 'benchmark.db')})]
+        if args.postgres_uri:
+            backends.append(('postgresql', {'connection_uri': args.postgres_uri}))
+
+        for scale in args.scales:
+            data_dir = os.path.join(args.data_dir, str(scale))
+            if not os.path.exists(os.path.join(data_dir, 'amr')):
+                generate.generate(data_dir, scale, num_loci=args.num_loci)
+            paths = {
+                'samples': os.path.join(data_dir, 'samples.csv'),
+                'locations': os.path.join(data_dir, 'locations.csv'),
+                'qc': os.path.join(data_dir, 'qc.csv'),
+                'cgmlst': os.path.join(data_dir, 'cgmlst.csv'),
+                'cgmlst_clusters': os.path.join(data_dir, 'cgmlst_clusters.csv'),
+                'miru': os.path.join(data_dir, 'miru.csv'),
+                'species': os.path.join(data_dir, 'species.csv'),
+                'complex': os.path.join(data_dir, 'complex.csv'),
+                'amr': os.path.join(data_dir, 'amr'),
+            }
+            for backend, config in backends:
+                engine = db.create_engine_from_config(config)
+                report['results'].extend(run_benchmarks(backend, engine, scale, paths, args.functions))
+                engine.dispose()
+
+    output_path = args.output
+    if output_path is None:
+        os.makedirs(args.results_dir, exist_ok=True)
+        output_path = os.path.join(args.results_dir, (commit or 'unknown')[:12] + '.json')
+    with open(output_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print("Wrote results to: " + output_path)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--scales', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--num-loci', type=int, default=generate.CGMLST_NUM_LOCI)
+    parser.add_argument('--data-dir', default='benchmarks/data', help="synthetic inputs, generated here if missing")
+    parser.add_argument('--results-dir', default='benchmarks/results')
+    parser.add_argument('-o', '--output', help="results file (default: <results-dir>/<commit>.json)")
+    parser.add_argument('--postgres-uri', help="also benchmark against this PostgreSQL database. ALL TABLES IN IT ARE DROPPED.")
+    parser.add_argument('--functions', nargs='+', help="only record these benchmarks, e.g. crud.create_species")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import argparse
+import sys
+
+import tb_db.allele_matrix as allele_matrix
+import tb_db.db as db
+import tb_db.mst as mst
+
+
+def main(args):
+    config = db.load_config(args.config)
+    allele_matrix.configure(config.get('allele_matrix_dir'))
+    with db.session_scope(config) as session:
+        if args.cluster is not None:
+            sample_ids, edges = mst.build_cluster_mst(session, args.cluster, scheme_id=args.scheme_id, scale_missing=args.scale_missing)
+        else:
+            with open(args.samples, 'r') as f:
+                requested_sample_ids = [line.strip() for line in f if line.strip()]
+            sample_ids, edges = mst.build_mst(session, requested_sample_ids, scheme_id=args.scheme_id, scale_missing=args.scale_missing)
+
+    output = mst.FORMATS[args.format](sample_ids, edges)
+    if args.output is None:
+        sys.stdout.write(output if output.endswith('\n') else output + '\n')
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    selection = parser.add_mutually_exclusive_group(required=True)
+    selection.add_argument('--cluster', help="cgMLST cluster code")
+    selection.add_argument('--samples', help="file with one sample ID per line")
+    parser.add_argument('-c', '--config', help="config file (JSON format))")
+    parser.add_argument('--scheme-id', type=int, help="cgMLST scheme database ID, if samples have profiles from more than one scheme")
+    parser.add_argument('--scale-missing', action='store_true', help="scale allele distances up for loci missing from either profile")
+    parser.add_argument('-f', '--format', choices=sorted(mst.FORMATS), default='newick')
+    parser.add_argument('-o', '--output', help="output file (default: stdout)")
+    args = parser.parse_args()
+    main(args)
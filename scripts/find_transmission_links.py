@@ -0,0 +1,41 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import sys
+
+import tb_db.allele_matrix as allele_matrix
+import tb_db.db as db
+import tb_db.transmission as transmission
+
+
+def main(args):
+    config = db.load_config(args.config)
+    allele_matrix.configure(config.get('allele_matrix_dir'))
+    with db.session_scope(config) as session:
+        links = transmission.find_transmission_links(
+            session,
+            max_distance=args.max_distance,
+            max_days=args.max_days,
+            scheme_id=args.scheme_id,
+        )
+
+    output = sys.stdout if args.output is None else open(args.output, 'w', newline='')
+    try:
+        writer = csv.DictWriter(output, fieldnames=['sample_id', 'linked_sample_id', 'distance', 'days_apart'])
+        writer.writeheader()
+        writer.writerows(links)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', help="config file (JSON format))")
+    parser.add_argument('--max-distance', type=int, default=transmission.DEFAULT_MAX_DISTANCE, help="largest allele distance of a link")
+    parser.add_argument('--max-days', type=int, default=transmission.DEFAULT_MAX_DAYS, help="largest number of days between collection dates of a link")
+    parser.add_argument('--scheme-id', type=int, help="cgMLST scheme database ID, if profiles from more than one scheme are stored")
+    parser.add_argument('-o', '--output', help="output CSV file (default: stdout)")
+    args = parser.parse_args()
+    main(args)
@@ -3,12 +3,18 @@
 import argparse
 import csv
 import json
+import sys
 
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import select
 
 import tb_db.parsers as parsers
 import tb_db.crud as crud
+import tb_db.db as db
+import tb_db.profiling as profiling
+import tb_db.metrics as metrics
+import tb_db.ingest as ingest
+import tb_db.bulk_load as bulk_load
+import tb_db.allele_matrix as allele_matrix
 
 from tb_db.models import Sample
 from tb_db.models import Library
@@ -17,30 +23,51 @@ from tb_db.models import CgmlstScheme
 
 
 def main(args):
-    with open(args.config, 'r') as f:
-        config = json.load(f)
-    connection_uri = config['connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    cgmlst_by_sample_id = parsers.parse_cgmlst(args.input)
-    cgmlst_profiles = list(cgmlst_by_sample_id.values())
-    cgmlst_scheme = {'name':'Ridom cgMLST.org','version':'2.1','num_loci':2891} 
-
-    sample_run = parsers.parse_run_ids(args.locations)
-
-    #print(sample_run)
-
-
-
-    created_profiles = crud.create_cgmlst_allele_profiles(session, cgmlst_scheme, cgmlst_profiles, sample_run)
-
-    for profile in created_profiles:
-        stmt = select(Library).where(Library.id == profile.library_id)
-        library = session.scalars(stmt).one()
-        print("Created profile for sample: " + library.samples.sample_id)
-
+    config = db.load_config(args.config)
+    engine = db.get_engine(config)
+    allele_matrix.configure(config.get('allele_matrix_dir'))
+    with metrics.loader_run('load_cgmlst', args.metrics_textfile, args.run_report) as run_metrics, \
+         db.session_scope(config) as session, \
+         profiling.profile_queries(engine, enabled=args.profile, report_file=sys.stderr), \
+         ingest.ingest_run(session, 'load_cgmlst', args.input, auxiliary_paths=[args.locations], force=args.force) as run:
+        if run.unchanged:
+            print("Input unchanged since last load, skipping: " + args.input)
+            return
+
+        run_metrics.add_input(args.input)
+        run_metrics.add_input(args.locations)
+        with run_metrics.stage('parse'):
+            cgmlst_by_sample_id = parsers.parse_cgmlst(args.input, processes=args.parse_processes)
+            sample_run = parsers.parse_run_ids(args.locations)
+        run_metrics.inc('rows_parsed', len(cgmlst_by_sample_id))
+        cgmlst_profiles = list(run.changed_rows(cgmlst_by_sample_id).values())
+
+        cgmlst_scheme = {'name':'Ridom cgMLST.org','version':'2.1','num_loci':2891} 
+        cluster_thresholds = None
+        if args.cluster_thresholds is not None:
+            import tb_db.cluster_codes as cluster_codes
+            cluster_thresholds = [int(threshold) for threshold in args.cluster_thresholds.split(',')]
+
+        if args.copy:
+            with run_metrics.stage('write'):
+                counts = bulk_load.load_cgmlst_allele_profiles(session, cgmlst_scheme, cgmlst_profiles, sample_run)
+            run_metrics.inc('rows_written', counts['inserted'] + counts['updated'])
+            if cluster_thresholds is not None:
+                scheme_id = session.scalars(select(CgmlstScheme.id).where(CgmlstScheme.name == cgmlst_scheme['name'])).first()
+                cluster_codes.assign_cluster_codes(session, scheme_id, thresholds=cluster_thresholds)
+            print("Loaded cgMLST profiles: " + json.dumps(counts))
+            return
+
+        with run_metrics.stage('write'):
+            counts = {}
+            created_profiles = crud.create_cgmlst_allele_profiles(session, cgmlst_scheme, cgmlst_profiles, sample_run, counts=counts, cluster_thresholds=cluster_thresholds)
+        run_metrics.inc('rows_written', counts['new'] + counts['updated'])
+
+        for profile in created_profiles:
+            stmt = select(Library).where(Library.id == profile.library_id)
+            library = session.scalars(stmt).one()
+            print("Created profile for sample: " + library.samples.sample_id)
+        print("Loaded cgMLST profiles: " + json.dumps(counts))
 
 
 if __name__ == '__main__':
@@ -48,5 +75,12 @@ if __name__ == '__main__':
     parser.add_argument('input')
     parser.add_argument('--locations')
     parser.add_argument('-c', '--config', help="config file (JSON format))")
+    parser.add_argument('--profile', action='store_true', help="print query counts and timings per tb_db function")
+    parser.add_argument('--metrics-textfile', help="write run metrics to this file in Prometheus text format")
+    parser.add_argument('--run-report', help="write run metrics to this file as JSON")
+    parser.add_argument('--force', action='store_true', help="load the input even if it is unchanged since the last load")
+    parser.add_argument('--cluster-thresholds', help="assign hierarchical cluster codes at these comma-separated allele distance thresholds, e.g. 0,2,5,10,25,50")
+    parser.add_argument('--copy', action='store_true', help="bulk load through staging tables (COPY on PostgreSQL)")
+    parser.add_argument('--parse-processes', type=int, help="parse the input in chunks with this many worker processes (uncompressed inputs only; from the first quoted field with a line break, the rest of the input is parsed in one process)")
     args = parser.parse_args()
     main(args)
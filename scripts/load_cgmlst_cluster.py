@@ -3,12 +3,16 @@
 import argparse
 import csv
 import json
+import sys
 
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import select
 
 import tb_db.parsers as parsers
 import tb_db.crud as crud
+import tb_db.db as db
+import tb_db.profiling as profiling
+import tb_db.metrics as metrics
+import tb_db.ingest as ingest
 
 from tb_db.models import Sample
 from tb_db.models import Library
@@ -17,23 +21,42 @@ from tb_db.models import MiruProfile
 
 
 def main(args):
-    with open(args.config, 'r') as f:
-        config = json.load(f)
-    connection_uri = config['connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    config = db.load_config(args.config)
+    engine = db.get_engine(config)
+    # Snapshots are recorded per label, so an unchanged input is still loaded under a new label.
+    loader = 'load_cgmlst_cluster' if args.snapshot is None else 'load_cgmlst_cluster:' + args.snapshot
+    with metrics.loader_run('load_cgmlst_cluster', args.metrics_textfile, args.run_report) as run_metrics, \
+         db.session_scope(config) as session, \
+         profiling.profile_queries(engine, enabled=args.profile, report_file=sys.stderr), \
+         ingest.ingest_run(session, loader, args.input, auxiliary_paths=[args.locations], force=args.force) as run:
+        if run.unchanged:
+            print("Input unchanged since last load, skipping: " + args.input)
+            return
 
-    cgmlst_cluster_by_sample = parsers.parse_cgmlst_cluster(args.input)
+        run_metrics.add_input(args.input)
+        run_metrics.add_input(args.locations)
+        with run_metrics.stage('parse'):
+            cgmlst_cluster_by_sample = parsers.parse_cgmlst_cluster(args.input)
+            sample_run = parsers.parse_run_ids(args.locations)
+        run_metrics.inc('rows_parsed', len(cgmlst_cluster_by_sample))
 
-    sample_run = parsers.parse_run_ids(args.locations)
+        if args.snapshot is not None:
+            # A snapshot is a full clustering, so every row is loaded, changed or not.
+            run.changed_rows(cgmlst_cluster_by_sample)
+            with run_metrics.stage('write'):
+                counts = crud.create_cgmlst_cluster_snapshot(session, args.snapshot, cgmlst_cluster_by_sample, sample_run)
+            run_metrics.inc('rows_written', counts['assigned'])
+            print("Loaded cgMLST cluster snapshot " + args.snapshot + ": " + json.dumps(counts))
+            return
 
-    created_cgmlst_clusters = crud.add_samples_to_cgmlst_clusters(session, cgmlst_cluster_by_sample,sample_run)
-
-    for sample in created_cgmlst_clusters:
-        print("added cluster to sample: " + sample.samples.sample_id)
+        cgmlst_cluster_by_sample = run.changed_rows(cgmlst_cluster_by_sample)
 
+        with run_metrics.stage('write'):
+            created_cgmlst_clusters = crud.add_samples_to_cgmlst_clusters(session, cgmlst_cluster_by_sample,sample_run)
+        run_metrics.inc('rows_written', len(created_cgmlst_clusters or []))
 
+        for sample in created_cgmlst_clusters:
+            print("added cluster to sample: " + sample.samples.sample_id)
 
 
 if __name__ == '__main__':
@@ -41,5 +64,10 @@ if __name__ == '__main__':
     parser.add_argument('input')
     parser.add_argument('--locations')
     parser.add_argument('-c', '--config', help="config file (JSON format))")
+    parser.add_argument('--profile', action='store_true', help="print query counts and timings per tb_db function")
+    parser.add_argument('--metrics-textfile', help="write run metrics to this file in Prometheus text format")
+    parser.add_argument('--run-report', help="write run metrics to this file as JSON")
+    parser.add_argument('--snapshot', help="record the input as a full clustering snapshot with this label (e.g. run ID or date), replacing the current clusters of its samples")
+    parser.add_argument('--force', action='store_true', help="load the input even if it is unchanged since the last load")
     args = parser.parse_args()
     main(args)
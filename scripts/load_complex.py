@@ -3,39 +3,48 @@
 import argparse
 import csv
 import json
+import sys
 
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import select
 
 import tb_db.parsers as parsers
 import tb_db.crud as crud
+import tb_db.db as db
+import tb_db.profiling as profiling
+import tb_db.metrics as metrics
+import tb_db.ingest as ingest
 
 from tb_db.models import Sample
 from tb_db.models import Library
 
 def main(args):
-    with open(args.config, 'r') as f:
-        config = json.load(f)
-    connection_uri = config['connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-
-    parsed_complex = parsers.parse_complex(args.input)
-
-    sample_run = parsers.parse_run_ids(args.locations)
-    created_complexes = crud.create_complexes(session, parsed_complex,sample_run)
-
-    #created_species = crud.create_species(session,)
-
-    for created_complex in created_complexes:
-        stmt = select(Library).where(Library.id == created_complex.library_id)
-        sample = session.scalars(stmt).one()
-        print("Created complex for: " + sample.samples.sample_id)
-
-
-
+    config = db.load_config(args.config)
+    engine = db.get_engine(config)
+    with metrics.loader_run('load_complex', args.metrics_textfile, args.run_report) as run_metrics, \
+         db.session_scope(config) as session, \
+         profiling.profile_queries(engine, enabled=args.profile, report_file=sys.stderr), \
+         ingest.ingest_run(session, 'load_complex', args.input, auxiliary_paths=[args.locations], force=args.force) as run:
+        if run.unchanged:
+            print("Input unchanged since last load, skipping: " + args.input)
+            return
+
+        run_metrics.add_input(args.input)
+        run_metrics.add_input(args.locations)
+        with run_metrics.stage('parse'):
+            parsed_complex = parsers.parse_complex(args.input)
+            sample_run = parsers.parse_run_ids(args.locations)
+        run_metrics.inc('rows_parsed', len(parsed_complex))
+        parsed_complex = run.changed_rows(parsed_complex)
+
+        with run_metrics.stage('write'):
+            created_complexes = crud.create_complexes(session, parsed_complex,sample_run)
+        run_metrics.inc('rows_written', len([c for c in created_complexes if c['outcome'] in ('created', 'updated')]))
+
+        for created_complex in created_complexes:
+            if created_complex['outcome'] == 'created':
+                print("Created complex for: " + created_complex['sample_id'])
+            elif created_complex['outcome'] == 'updated':
+                print("Updated complex for: " + created_complex['sample_id'])
 
 
 if __name__ == '__main__':
@@ -43,6 +52,10 @@ if __name__ == '__main__':
     parser.add_argument('input')
     parser.add_argument('--locations')
     parser.add_argument('-c', '--config', help="config file (JSON format))")
+    parser.add_argument('--profile', action='store_true', help="print query counts and timings per tb_db function")
+    parser.add_argument('--metrics-textfile', help="write run metrics to this file in Prometheus text format")
+    parser.add_argument('--run-report', help="write run metrics to this file as JSON")
+    parser.add_argument('--force', action='store_true', help="load the input even if it is unchanged since the last load")
     args = parser.parse_args()
     main(args)
 
@@ -2,39 +2,64 @@
 
 import argparse
 import json
+import sys
 
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import select
 
 import tb_db.parsers as parsers
 import tb_db.crud as crud
+import tb_db.db as db
+import tb_db.profiling as profiling
+import tb_db.metrics as metrics
+import tb_db.ingest as ingest
+import tb_db.bulk_load as bulk_load
 
 from tb_db.models import Sample
 from tb_db.models import CgmlstAlleleProfile
     
 def main(args):
+    config = db.load_config(args.config)
+    engine = db.get_engine(config)
+    with metrics.loader_run('load_miru', args.metrics_textfile, args.run_report) as run_metrics, \
+         db.session_scope(config) as session, \
+         profiling.profile_queries(engine, enabled=args.profile, report_file=sys.stderr), \
+         ingest.ingest_run(session, 'load_miru', args.input, force=args.force) as run:
+        if run.unchanged:
+            print("Input unchanged since last load, skipping: " + args.input)
+            return
 
-    with open(args.config, 'r') as f:
-        config = json.load(f)
-    connection_uri = config['connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+        run_metrics.add_input(args.input)
+        with run_metrics.stage('parse'):
+            miru_profiles_by_sample_id = parsers.parse_miru(args.input, processes=args.parse_processes)
+        run_metrics.inc('rows_parsed', len(miru_profiles_by_sample_id))
+        miru_profiles_by_sample_id = run.changed_rows(miru_profiles_by_sample_id)
 
-    miru_profiles_by_sample_id = parsers.parse_miru(args.input)
-    
-    created_profiles = crud.create_miru_profiles(session, miru_profiles_by_sample_id)
-    
+        if args.copy:
+            with run_metrics.stage('write'):
+                counts = bulk_load.load_miru_profiles(session, miru_profiles_by_sample_id)
+            run_metrics.inc('rows_written', counts['inserted'] + counts['updated'])
+            print("Loaded MIRU profiles: " + json.dumps(counts))
+            return
+
+        with run_metrics.stage('write'):
+            created_profiles = crud.create_miru_profiles(session, miru_profiles_by_sample_id)
+        run_metrics.inc('rows_written', len(created_profiles))
 
-    for profile in created_profiles:
-        stmt = select(Sample).where(Sample.id == profile.sample_id)
-        sample = session.scalars(stmt).one()
-        print("Created profile for sample: " + sample.sample_id)
+        for profile in created_profiles:
+            stmt = select(Sample).where(Sample.id == profile.sample_id)
+            sample = session.scalars(stmt).one()
+            print("Created profile for sample: " + sample.sample_id)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('input')
     parser.add_argument('-c', '--config', help="config file (JSON format))")
+    parser.add_argument('--profile', action='store_true', help="print query counts and timings per tb_db function")
+    parser.add_argument('--metrics-textfile', help="write run metrics to this file in Prometheus text format")
+    parser.add_argument('--run-report', help="write run metrics to this file as JSON")
+    parser.add_argument('--force', action='store_true', help="load the input even if it is unchanged since the last load")
+    parser.add_argument('--copy', action='store_true', help="bulk load through staging tables (COPY on PostgreSQL)")
+    parser.add_argument('--parse-processes', type=int, help="parse the input in chunks with this many worker processes (uncompressed inputs only; from the first quoted field with a line break, the rest of the input is parsed in one process)")
     args = parser.parse_args()
     main(args)
@@ -3,33 +3,48 @@
 import argparse
 import csv
 import json
-
-from sqlalchemy.orm import Session, sessionmaker
-from sqlalchemy import create_engine
+import sys
 
 import tb_db.parsers as parsers
 import tb_db.crud as crud
+import tb_db.db as db
+import tb_db.profiling as profiling
+import tb_db.metrics as metrics
+import tb_db.ingest as ingest
 
 
 def main(args):
-    with open(args.config, 'r') as f:
-        config = json.load(f)
-    connection_uri = config['connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
-
-    samples = parsers.parse_samples(args.input)
-    
-    created_samples = crud.create_samples(session, samples)
-
-    for sample in created_samples:
-        print("Created sample: " + sample.sample_id)
+    config = db.load_config(args.config)
+    engine = db.get_engine(config)
+    with metrics.loader_run('load_samples', args.metrics_textfile, args.run_report) as run_metrics, \
+         db.session_scope(config) as session, \
+         profiling.profile_queries(engine, enabled=args.profile, report_file=sys.stderr), \
+         ingest.ingest_run(session, 'load_samples', args.input, force=args.force) as run:
+        if run.unchanged:
+            print("Input unchanged since last load, skipping: " + args.input)
+            return
+
+        run_metrics.add_input(args.input)
+        with run_metrics.stage('parse'):
+            samples = parsers.parse_samples(args.input)
+        run_metrics.inc('rows_parsed', len(samples))
+        samples = run.changed_rows(samples)
+
+        with run_metrics.stage('write'):
+            created_samples = crud.create_samples(session, samples)
+        run_metrics.inc('rows_written', len(created_samples))
+
+        for sample in created_samples:
+            print("Created sample: " + sample.sample_id)
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser()
     parser.add_argument('input')
     parser.add_argument('-c', '--config', help="config file (JSON format))")
+    parser.add_argument('--profile', action='store_true', help="print query counts and timings per tb_db function")
+    parser.add_argument('--metrics-textfile', help="write run metrics to this file in Prometheus text format")
+    parser.add_argument('--run-report', help="write run metrics to this file as JSON")
+    parser.add_argument('--force', action='store_true', help="load the input even if it is unchanged since the last load")
     args = parser.parse_args()
     main(args)
@@ -3,38 +3,60 @@
 import argparse
 import csv
 import json
+import sys
 
-from sqlalchemy import create_engine, select
-from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy import select
 
 import tb_db.parsers as parsers
 import tb_db.crud as crud
+import tb_db.db as db
+import tb_db.profiling as profiling
+import tb_db.metrics as metrics
+import tb_db.ingest as ingest
+import tb_db.bulk_load as bulk_load
 
 from tb_db.models import Sample
 from tb_db.models import Library
 
 def main(args):
-    with open(args.config, 'r') as f:
-        config = json.load(f)
-    connection_uri = config['connection_uri']
-    engine = create_engine(connection_uri)
-    Session = sessionmaker(bind=engine)
-    session = Session()
+    config = db.load_config(args.config)
+    engine = db.get_engine(config)
+    with metrics.loader_run('load_taxon', args.metrics_textfile, args.run_report) as run_metrics, \
+         db.session_scope(config) as session, \
+         profiling.profile_queries(engine, enabled=args.profile, report_file=sys.stderr), \
+         ingest.ingest_run(session, 'load_taxon', args.input, auxiliary_paths=[args.locations], force=args.force) as run:
+        if run.unchanged:
+            print("Input unchanged since last load, skipping: " + args.input)
+            return
 
+        run_metrics.add_input(args.input)
+        run_metrics.add_input(args.locations)
+        with run_metrics.stage('parse'):
+            sample_run = parsers.parse_run_ids(args.locations)
 
-    parsed_species = parsers.parse_species(args.input)
-
-   
-    sample_run = parsers.parse_run_ids(args.locations)
-    created_species = crud.create_species(session, parsed_species,sample_run)
-
-    for created_speci in created_species:
-        stmt = select(Library).where(Library.id == created_speci.library_id)
-        sample = session.scalars(stmt).one()
-        print("Created species for: " + sample.samples.sample_id)
+        # Species are replaced per library, so a library's rows are always
+        # loaded together and only unchanged files are skipped.
+        if args.copy:
+            # Parsing is streamed into the load, so both happen in the write stage.
+            with run_metrics.stage('write'):
+                counts = bulk_load.load_species(session, parsers.iter_species(args.input), sample_run)
+            run_metrics.inc('rows_parsed', counts['staged'])
+            run_metrics.inc('rows_written', counts['inserted'])
+            print("Loaded species: " + json.dumps(counts))
+            return
 
+        with run_metrics.stage('parse'):
+            parsed_species = parsers.parse_species(args.input)
+        run_metrics.inc('rows_parsed', len(parsed_species))
 
+        with run_metrics.stage('write'):
+            created_species = crud.create_species(session, parsed_species,sample_run)
+        run_metrics.inc('rows_written', len(created_species))
 
+        library_ids = set([created_speci.library_id for created_speci in created_species])
+        stmt = select(Library).where(Library.id.in_(library_ids))
+        for library in session.scalars(stmt):
+            print("Created species for: " + library.samples.sample_id)
 
 
 if __name__ == '__main__':
@@ -42,5 +64,10 @@ if __name__ == '__main__':
     parser.add_argument('input')
     parser.add_argument('--locations')
     parser.add_argument('-c', '--config', help="config file (JSON format))")
+    parser.add_argument('--profile', action='store_true', help="print query counts and timings per tb_db function")
+    parser.add_argument('--metrics-textfile', help="write run metrics to this file in Prometheus text format")
+    parser.add_argument('--run-report', help="write run metrics to this file as JSON")
+    parser.add_argument('--force', action='store_true', help="load the input even if it is unchanged since the last load")
+    parser.add_argument('--copy', action='store_true', help="bulk load through staging tables (COPY on PostgreSQL)")
     args = parser.parse_args()
     main(args)
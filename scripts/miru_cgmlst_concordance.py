@@ -0,0 +1,40 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import json
+import sys
+
+import tb_db.concordance as concordance
+import tb_db.db as db
+
+
+def main(args):
+    config = db.load_config(args.config)
+    with db.session_scope(config) as session:
+        result = concordance.get_concordance(session)
+
+    summary = {k: v for k, v in result.items() if k not in ['contingency', 'discordant_samples']}
+    summary['num_discordant_samples'] = len(result['discordant_samples'])
+    print(json.dumps(summary, indent=2))
+
+    if args.contingency is not None:
+        with open(args.contingency, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['miru_cluster_id', 'cgmlst_cluster_id', 'num_samples'])
+            writer.writeheader()
+            writer.writerows(result['contingency'])
+
+    if args.discordant is not None:
+        with open(args.discordant, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=['sample_id', 'miru_cluster_id', 'cgmlst_cluster_id', 'num_miru_only', 'num_cgmlst_only'])
+            writer.writeheader()
+            writer.writerows(result['discordant_samples'])
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', help="config file (JSON format))")
+    parser.add_argument('--contingency', help="output CSV file for the MIRU x cgMLST contingency table")
+    parser.add_argument('--discordant', help="output CSV file for the discordant samples")
+    args = parser.parse_args()
+    main(args)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+
+import argparse
+import csv
+import datetime
+import sys
+
+import tb_db.crud as crud
+import tb_db.db as db
+
+
+def main(args):
+    config = db.load_config(args.config)
+    first_date = datetime.date.fromisoformat(args.start) if args.start is not None else None
+    last_date = datetime.date.fromisoformat(args.end) if args.end is not None else None
+    with db.session_scope(config) as session:
+        resistance_matrix = crud.get_resistance_matrix(session, date_range=(first_date, last_date))
+    prevalence = crud.resistance_prevalence_by_quarter(resistance_matrix)
+
+    output = sys.stdout if args.output is None else open(args.output, 'w', newline='')
+    try:
+        writer = csv.DictWriter(output, fieldnames=['quarter', 'drug', 'num_samples', 'num_resistant', 'prevalence'])
+        writer.writeheader()
+        writer.writerows(prevalence)
+    finally:
+        if output is not sys.stdout:
+            output.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-c', '--config', help="config file (JSON format))")
+    parser.add_argument('--start', help="first collection date (YYYY-MM-DD)")
+    parser.add_argument('--end', help="last collection date (YYYY-MM-DD)")
+    parser.add_argument('-o', '--output', help="output CSV file (default: stdout)")
+    args = parser.parse_args()
+    main(args)
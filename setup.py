@@ -19,12 +19,23 @@ setup(
     include_package_data=True,
     keywords=[],
     zip_safe=False,
-    extra_requires={
+    extras_require={
         "dev": [
             "pytest>=7.1.2",
             "hypothesis==6.61.0",
             "sphinx==5.3.0",
             "sphinx-rtd-theme==1.1.1",
-        ]
+        ],
+        "async": [
+            "sqlalchemy[asyncio]==1.4.40",
+            "asyncpg",
+            "aiosqlite",
+        ],
+        "analysis": [
+            "numpy",
+        ],
+        "compression": [
+            "zstandard",
+        ],
     },
 )
@@ -0,0 +1,285 @@
+import contextlib
+
+from sqlalchemy import select
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.ext.asyncio import create_async_engine
+from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import sessionmaker
+
+from .models import *
+
+import tb_db.db as db
+
+# Async driver used for each backend when the connection URI names a sync driver (or none).
+ASYNC_DRIVERS = {
+    'postgresql': 'asyncpg',
+    'sqlite': 'aiosqlite',
+}
+
+_async_engines_by_connection_uri = {}
+
+
+def async_connection_uri(connection_uri: str):
+    """
+    Rewrite a connection URI to use the async driver for its backend, so that the
+    same config file can be used by the sync and async APIs.
+
+    :param connection_uri: Connection URI, e.g. `postgresql://tb:tb@localhost/tb`.
+    :type connection_uri: str
+    :return: Connection URI with an async driver, e.g. `postgresql+asyncpg://tb:tb@localhost/tb`.
+    :rtype: str
+    """
+    url = make_url(connection_uri)
+    backend = url.get_backend_name()
+    if backend in ASYNC_DRIVERS and url.get_driver_name() != ASYNC_DRIVERS[backend]:
+        url = url.set(drivername=backend + '+' + ASYNC_DRIVERS[backend])
+
+    return url.render_as_string(hide_password=False)
+
+
+def create_async_engine_from_config(config: dict[str, object]):
+    """
+    Create an async engine from a config, with the same pool settings as `db.create_engine_from_config`.
+
+    :param config: Config, as loaded by `db.load_config`.
+    :type config: dict[str, object]
+    :return: Async engine.
+    :rtype: sqlalchemy.ext.asyncio.AsyncEngine
+    """
+    async_config = dict(config, connection_uri=async_connection_uri(config['connection_uri']))
+    options = db._engine_options(async_config)
+
+    statement_timeout_ms = config.get('statement_timeout_ms')
+    url = make_url(async_config['connection_uri'])
+    if statement_timeout_ms is not None and url.get_driver_name() == 'asyncpg' and not config.get('pgbouncer', False):
+        options['connect_args'] = {'server_settings': {'statement_timeout': str(int(statement_timeout_ms))}}
+
+    engine = create_async_engine(async_config['connection_uri'], **options)
+
+    return engine
+
+
+def get_async_engine(config: dict[str, object]):
+    """
+    Get the async engine shared by everything in this process that uses the same connection URI.
+
+    :param config: Config, as loaded by `db.load_config`.
+    :type config: dict[str, object]
+    :return: Async engine.
+    :rtype: sqlalchemy.ext.asyncio.AsyncEngine
+    """
+    connection_uri = config['connection_uri']
+    if connection_uri not in _async_engines_by_connection_uri:
+        _async_engines_by_connection_uri[connection_uri] = create_async_engine_from_config(config)
+
+    return _async_engines_by_connection_uri[connection_uri]
+
+
+def async_sessionmaker(engine):
+    """
+    Session factory for an async engine.
+
+    A session must not be shared between concurrently running tasks; give each
+    request (or each task passed to `asyncio.gather`) its own session.
+    Objects are not expired on commit, since they can't be lazily refreshed.
+
+    :param engine: Async engine.
+    :type engine: sqlalchemy.ext.asyncio.AsyncEngine
+    :return: Session factory.
+    :rtype: sqlalchemy.orm.sessionmaker
+    """
+    return sessionmaker(bind=engine, class_=AsyncSession, expire_on_commit=False)
+
+
+@contextlib.asynccontextmanager
+async def async_session_scope(config: dict[str, object]):
+    """
+    Provide an async session on the shared async engine, closed when the block exits.
+
+    :param config: Config, as loaded by `db.load_config`.
+    :type config: dict[str, object]
+    :return: Async database session.
+    :rtype: AsyncIterator[sqlalchemy.ext.asyncio.AsyncSession]
+    """
+    async with async_sessionmaker(get_async_engine(config))() as session:
+        yield session
+
+
+### Samples
+async def get_sample(db: AsyncSession, sample_id: str):
+    """
+    Get current valid database record for a sample.
+
+    Relationships are not loaded; use the other lookup functions in this module
+    to fetch libraries, profiles and clusters.
+
+    :param db: Async database session
+    :type db: sqlalchemy.ext.asyncio.AsyncSession
+    :param sample_id: Sample ID
+    :type sample_id: str
+    :return: Current valid database record for the sample.
+    :rtype: models.Sample|NoneType
+    """
+    stmt = select(Sample).where(Sample.sample_id == sample_id)
+    result = await db.scalars(stmt)
+
+    return result.one_or_none()
+
+
+async def get_samples(db: AsyncSession, sample_ids: list[str]):
+    """
+    Get database records for multiple samples, in one query.
+
+    :param db: Async database session
+    :type db: sqlalchemy.ext.asyncio.AsyncSession
+    :param sample_ids: Sample IDs
+    :type sample_ids: list[str]
+    :return: Sample records, indexed by Sample ID. Unknown samples are omitted.
+    :rtype: dict[str, models.Sample]
+    """
+    stmt = select(Sample).where(Sample.sample_id.in_(set(sample_ids)))
+    result = await db.scalars(stmt)
+
+    return {sample.sample_id: sample for sample in result}
+
+
+async def get_libraries_by_sample_id(db: AsyncSession, sample_id: str):
+    """
+    Get all libraries (QC records) for a sample.
+
+    :param db: Async database session
+    :type db: sqlalchemy.ext.asyncio.AsyncSession
+    :param sample_id: Sample ID
+    :type sample_id: str
+    :return: Libraries for the sample, oldest first.
+    :rtype: list[models.Library]
+    """
+    stmt = (
+        select(Library)
+        .join(Sample, Library.sample_id == Sample.id)
+        .where(Sample.sample_id == sample_id)
+        .order_by(Library.id)
+    )
+    result = await db.scalars(stmt)
+
+    return result.all()
+
+
+### cgMLST
+async def get_cgmlst_cluster_by_sample_id(db: AsyncSession, sample_id: str):
+    """
+    Get cgmlst cluster(s) for sample specified by `sample_id`.
+
+    :param db: Async database session.
+    :type db: sqlalchemy.ext.asyncio.AsyncSession
+    :param sample_id: Sample ID
+    :type sample_id: str
+    :return: Cluster codes of the cgMLST clusters the sample's libraries belong to. Empty if the sample doesn't exist.
+    :rtype: list[str]
+    """
+    stmt = (
+        select(CgmlstCluster.cluster_id)
+        .join(association_table_cgmlst, association_table_cgmlst.c.cgmlst_cluster_id == CgmlstCluster.id)
+        .join(Library, Library.id == association_table_cgmlst.c.library_id)
+        .join(Sample, Sample.id == Library.sample_id)
+        .where(Sample.sample_id == sample_id)
+        .order_by(Library.id, CgmlstCluster.id)
+    )
+    result = await db.scalars(stmt)
+
+    return result.all()
+
+
+async def get_cgmlst_allele_profiles_by_sample_id(db: AsyncSession, sample_id: str):
+    """
+    Get the cgMLST allele profiles of all libraries for a sample.
+
+    :param db: Async database session.
+    :type db: sqlalchemy.ext.asyncio.AsyncSession
+    :param sample_id: Sample ID
+    :type sample_id: str
+    :return: cgMLST allele profiles, oldest library first.
+    :rtype: list[models.CgmlstAlleleProfile]
+    """
+    stmt = (
+        select(CgmlstAlleleProfile)
+        .join(Library, Library.id == CgmlstAlleleProfile.library_id)
+        .join(Sample, Sample.id == Library.sample_id)
+        .where(Sample.sample_id == sample_id)
+        .order_by(Library.id)
+    )
+    result = await db.scalars(stmt)
+
+    return result.all()
+
+
+### MIRU
+async def get_miru_cluster_by_sample_id(db: AsyncSession, sample_id: str):
+    """
+    Get miru cluster for a given sample.
+
+    :param db: Async database session
+    :type db: sqlalchemy.ext.asyncio.AsyncSession
+    :param sample_id: Sample ID
+    :type sample_id: str
+    :return: Miru Cluster names for the sample. Empty if the sample doesn't exist.
+    :rtype: list[str]
+    """
+    stmt = (
+        select(MiruCluster.cluster_id)
+        .join(association_table_miru, association_table_miru.c.miru_cluster_id == MiruCluster.id)
+        .join(Sample, Sample.id == association_table_miru.c.sample_id)
+        .where(Sample.sample_id == sample_id)
+        .order_by(MiruCluster.id)
+    )
+    result = await db.scalars(stmt)
+
+    return result.all()
+
+
+async def get_miru_profiles_by_sample_id(db: AsyncSession, sample_id: str):
+    """
+    Get the MIRU profiles for a sample.
+
+    :param db: Async database session
+    :type db: sqlalchemy.ext.asyncio.AsyncSession
+    :param sample_id: Sample ID
+    :type sample_id: str
+    :return: MIRU profiles.
+    :rtype: list[models.MiruProfile]
+    """
+    stmt = (
+        select(MiruProfile)
+        .join(Sample, Sample.id == MiruProfile.sample_id)
+        .where(Sample.sample_id == sample_id)
+        .order_by(MiruProfile.id)
+    )
+    result = await db.scalars(stmt)
+
+    return result.all()
+
+
+### AMR
+async def get_amr_profiles_by_sample_id(db: AsyncSession, sample_id: str):
+    """
+    Get the AMR profiles of all libraries for a sample, with their drug mutations loaded.
+
+    :param db: Async database session
+    :type db: sqlalchemy.ext.asyncio.AsyncSession
+    :param sample_id: Sample ID
+    :type sample_id: str
+    :return: AMR profiles, oldest library first.
+    :rtype: list[models.AmrProfile]
+    """
+    stmt = (
+        select(AmrProfile)
+        .join(Library, Library.id == AmrProfile.library_id)
+        .join(Sample, Sample.id == Library.sample_id)
+        .where(Sample.sample_id == sample_id)
+        .order_by(Library.id, AmrProfile.id)
+        .options(selectinload(AmrProfile.drug_mutation_profile))
+    )
+    result = await db.scalars(stmt)
+
+    return result.all()
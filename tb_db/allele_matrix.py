@@ -0,0 +1,400 @@
+import contextlib
+import glob
+import json
+import logging
+import os
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# File locking: fcntl on POSIX, msvcrt on Windows.
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    import msvcrt
+except ImportError:
+    msvcrt = None
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import *
+
+# Allele number stored for loci that are uncalled (e.g. `-` or `LNF`) or absent from a profile.
+# Allele numbers assigned by cgMLST schemes start at 1.
+MISSING_ALLELE = 0
+
+# Profiles fetched per query by `AlleleMatrix.sync`.
+SYNC_BATCH_SIZE = 1000
+
+_directory = None
+
+
+def configure(directory):
+    """
+    Set the directory where allele matrices are kept. Once set, `tb_db.crud` and
+    `tb_db.bulk_load` keep the matrices up to date as profiles are written or deleted.
+
+    :param directory: Directory for the matrix files. If None, matrices are not maintained.
+    :type directory: str|NoneType
+    """
+    global _directory
+    if directory is not None and np is None:
+        raise ImportError('numpy is required for allele matrices; install with `pip install -e .[analysis]`')
+    _directory = directory
+
+
+def is_configured():
+    """
+    :return: True if an allele matrix directory has been configured.
+    :rtype: bool
+    """
+    return _directory is not None
+
+
+def encode_allele(allele):
+    """
+    Convert an allele call to the integer stored in the matrix.
+
+    Inferred alleles (`INF-12`) are stored as their allele number; anything
+    that isn't an allele number is stored as `MISSING_ALLELE`.
+
+    :param allele: Allele call, as found in a parsed profile.
+    :type allele: str|int|NoneType
+    :return: Allele number.
+    :rtype: int
+    """
+    if allele is None:
+        return MISSING_ALLELE
+    allele = str(allele)
+    if allele.startswith('INF-'):
+        allele = allele[4:]
+    if not allele.isdigit():
+        return MISSING_ALLELE
+
+    return int(allele)
+
+
+def encode_profiles(profiles, loci):
+    """
+    Encode profiles as rows of an allele matrix.
+
+    :param profiles: Allele calls indexed by locus, one dict per profile.
+    :type profiles: list[dict[str, str]]
+    :param loci: Locus of each matrix column.
+    :type loci: list[str]
+    :return: Matrix with one row per profile and one column per locus.
+    :rtype: numpy.ndarray
+    """
+    rows = [[encode_allele(profile.get(locus)) for locus in loci] for profile in profiles]
+
+    return np.array(rows, dtype=np.int32).reshape(len(profiles), len(loci))
+
+
+class AlleleMatrix:
+    """
+    The allele numbers of every stored cgMLST profile of one scheme, kept on
+    disk as a raw int32 matrix (one row per library, one column per locus) with
+    a JSON sidecar index of the loci, and of the library and profile hash stored
+    in each row.
+
+    `matrix` is a read-only memory map, so analyses read allele numbers without
+    a database round trip, JSON decoding or copying, and processes that map the
+    same file share its pages. New profiles are appended, changed profiles are
+    overwritten in place, and `remove` compacts the file. Writers hold a lock
+    file; the matrix is written before the index, so readers never see rows
+    that aren't there yet.
+    """
+
+    def __init__(self, directory: str, scheme_id: int):
+        self.directory = directory
+        self.scheme_id = scheme_id
+        base_path = os.path.join(directory, 'cgmlst_scheme_' + str(scheme_id))
+        self.matrix_path = base_path + '.i32'
+        self.index_path = base_path + '.index.json'
+        self.lock_path = base_path + '.lock'
+        self.reload()
+
+    def reload(self):
+        """
+        Re-read the index, to see rows written by other processes since this object was created.
+        """
+        index = self._read_index()
+        self.loci = index['loci']
+        self.library_ids = index['library_ids']
+        self.profile_hashes = index['profile_hashes']
+        self.row_offsets = {library_id: row for row, library_id in enumerate(self.library_ids)}
+        self._matrix = None
+
+    @property
+    def num_rows(self):
+        return len(self.library_ids)
+
+    @property
+    def matrix(self):
+        """
+        :return: Read-only matrix with one row per library (in the order of `library_ids`) and one column per locus.
+        :rtype: numpy.ndarray
+        """
+        if self._matrix is None:
+            shape = (self.num_rows, len(self.loci))
+            if self.num_rows == 0 or not self.loci:
+                self._matrix = np.zeros(shape, dtype=np.int32)
+            else:
+                self._matrix = np.memmap(self.matrix_path, dtype=np.int32, mode='r', shape=shape)
+
+        return self._matrix
+
+    def rows(self, library_ids):
+        """
+        Get the matrix rows of some libraries.
+
+        :param library_ids: Library database IDs. Libraries without a row are skipped.
+        :type library_ids: Iterable[int]
+        :return: Library IDs found, and their rows (a copy) in the same order.
+        :rtype: tuple[list[int], numpy.ndarray]
+        """
+        found_library_ids = [library_id for library_id in library_ids if library_id in self.row_offsets]
+        row_offsets = [self.row_offsets[library_id] for library_id in found_library_ids]
+
+        return found_library_ids, self.matrix[row_offsets]
+
+    def _read_index(self):
+        if not os.path.exists(self.index_path):
+            return {'scheme_id': self.scheme_id, 'loci': [], 'library_ids': [], 'profile_hashes': []}
+        with open(self.index_path, 'r') as f:
+            return json.load(f)
+
+    def _write_index(self, index):
+        tmp_path = self.index_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self.index_path)
+
+    @contextlib.contextmanager
+    def _lock(self):
+        os.makedirs(self.directory, exist_ok=True)
+        with open(self.lock_path, 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            elif msvcrt is not None:
+                # Locks the first byte of the file, retrying for about 10 seconds before raising OSError.
+                lock_file.seek(0)
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+                elif msvcrt is not None:
+                    lock_file.seek(0)
+                    msvcrt.locking(lock_file.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def upsert(self, profiles_by_library_id: dict[int, dict[str, str]], profile_hashes: dict[int, str] = None):
+        """
+        Write profiles: append rows for new libraries, overwrite rows of existing ones.
+
+        The matrix's loci are taken from the first profile ever written; loci
+        that are missing from a profile are stored as `MISSING_ALLELE`.
+
+        :param profiles_by_library_id: Allele calls indexed by locus, indexed by library database ID.
+        :type profiles_by_library_id: dict[int, dict[str, str]]
+        :param profile_hashes: Profile hashes (see `crud.cgmlst_allele_profile_hash`) indexed by library database ID, used by `sync`.
+        :type profile_hashes: dict[int, str]
+        :return: Number of rows written.
+        :rtype: int
+        """
+        if not profiles_by_library_id:
+            return 0
+        profile_hashes = profile_hashes or {}
+
+        with self._lock():
+            index = self._read_index()
+            if not index['loci']:
+                index['loci'] = list(next(iter(profiles_by_library_id.values())))
+            loci = index['loci']
+            num_rows = len(index['library_ids'])
+            row_offsets = {library_id: row for row, library_id in enumerate(index['library_ids'])}
+
+            library_ids = list(profiles_by_library_id)
+            encoded = encode_profiles([profiles_by_library_id[library_id] for library_id in library_ids], loci)
+            existing = [i for i, library_id in enumerate(library_ids) if library_id in row_offsets]
+            new = [i for i, library_id in enumerate(library_ids) if library_id not in row_offsets]
+
+            if existing:
+                matrix = np.memmap(self.matrix_path, dtype=np.int32, mode='r+', shape=(num_rows, len(loci)))
+                matrix[[row_offsets[library_ids[i]] for i in existing]] = encoded[existing]
+                matrix.flush()
+                del matrix
+                for i in existing:
+                    index['profile_hashes'][row_offsets[library_ids[i]]] = profile_hashes.get(library_ids[i])
+            if new:
+                with open(self.matrix_path, 'ab') as f:
+                    # Drop anything left over from an interrupted write before appending.
+                    f.truncate(num_rows * len(loci) * np.dtype(np.int32).itemsize)
+                    f.write(encoded[new].tobytes())
+                index['library_ids'].extend(library_ids[i] for i in new)
+                index['profile_hashes'].extend(profile_hashes.get(library_ids[i]) for i in new)
+            self._write_index(index)
+
+        self.reload()
+
+        return len(library_ids)
+
+    def remove(self, library_ids):
+        """
+        Remove the rows of some libraries and compact the matrix file.
+
+        The compacted matrix is written to a new file that replaces the old one,
+        so processes that have the old file mapped keep a consistent view.
+
+        :param library_ids: Library database IDs.
+        :type library_ids: Iterable[int]
+        :return: Number of rows removed.
+        :rtype: int
+        """
+        library_ids = set(library_ids)
+
+        with self._lock():
+            index = self._read_index()
+            keep = [row for row, library_id in enumerate(index['library_ids']) if library_id not in library_ids]
+            num_removed = len(index['library_ids']) - len(keep)
+            if num_removed == 0:
+                return 0
+
+            shape = (len(index['library_ids']), len(index['loci']))
+            matrix = np.memmap(self.matrix_path, dtype=np.int32, mode='r', shape=shape)
+            tmp_path = self.matrix_path + '.tmp'
+            with open(tmp_path, 'wb') as f:
+                for start in range(0, len(keep), SYNC_BATCH_SIZE):
+                    f.write(np.ascontiguousarray(matrix[keep[start:start + SYNC_BATCH_SIZE]]).tobytes())
+            del matrix
+            os.replace(tmp_path, self.matrix_path)
+
+            index['library_ids'] = [index['library_ids'][row] for row in keep]
+            index['profile_hashes'] = [index['profile_hashes'][row] for row in keep]
+            self._write_index(index)
+
+        self.reload()
+
+        return num_removed
+
+    def sync(self, db: Session):
+        """
+        Bring the matrix up to date with the database: write profiles that are
+        new or whose hash has changed, and remove libraries whose profile is gone.
+
+        Only library IDs and profile hashes are read for unchanged profiles.
+
+        :param db: Database session.
+        :type db: sqlalchemy.orm.Session
+        :return: Number of rows `written` and `removed`.
+        :rtype: dict[str, int]
+        """
+        stmt = (
+            select(CgmlstAlleleProfile.library_id, CgmlstAlleleProfile.profile_hash)
+            .where(CgmlstAlleleProfile.cgmlst_scheme_id == self.scheme_id)
+        )
+        stored_hashes = dict(db.execute(stmt).all())
+
+        self.reload()
+        indexed_hashes = dict(zip(self.library_ids, self.profile_hashes))
+        stale_library_ids = [library_id for library_id in indexed_hashes if library_id not in stored_hashes]
+        changed_library_ids = sorted(
+            library_id for library_id, profile_hash in stored_hashes.items()
+            if library_id not in indexed_hashes or indexed_hashes[library_id] != profile_hash
+        )
+
+        num_removed = self.remove(stale_library_ids)
+        num_written = 0
+        for start in range(0, len(changed_library_ids), SYNC_BATCH_SIZE):
+            batch = changed_library_ids[start:start + SYNC_BATCH_SIZE]
+            stmt = (
+                select(CgmlstAlleleProfile.library_id, CgmlstAlleleProfile.profile, CgmlstAlleleProfile.profile_hash)
+                .where(CgmlstAlleleProfile.library_id.in_(batch))
+            )
+            profiles_by_library_id = {}
+            profile_hashes = {}
+            for library_id, profile, profile_hash in db.execute(stmt):
+                if isinstance(profile, str):
+                    profile = json.loads(profile)
+                profiles_by_library_id[library_id] = profile
+                profile_hashes[library_id] = profile_hash
+            num_written += self.upsert(profiles_by_library_id, profile_hashes)
+
+        return {'written': num_written, 'removed': num_removed}
+
+
+def get_allele_matrix(scheme_id: int, directory: str = None):
+    """
+    Open the allele matrix of a cgMLST scheme.
+
+    :param scheme_id: Database ID of the cgMLST scheme.
+    :type scheme_id: int
+    :param directory: Matrix directory. Defaults to the directory set with `configure`.
+    :type directory: str
+    :return: Allele matrix. Empty if nothing has been written for the scheme yet.
+    :rtype: AlleleMatrix
+    """
+    directory = directory or _directory
+    if directory is None:
+        raise ValueError('no allele matrix directory configured')
+    if np is None:
+        raise ImportError('numpy is required for allele matrices; install with `pip install -e .[analysis]`')
+
+    return AlleleMatrix(directory, scheme_id)
+
+
+def update_profiles(scheme_id: int, profiles_by_library_id: dict[int, dict[str, str]], profile_hashes: dict[int, str] = None):
+    """
+    Write profiles to the scheme's matrix, if a matrix directory is configured.
+
+    Called by `tb_db.crud` after profiles are committed. Errors are logged
+    rather than raised, since the database is already up to date; `sync`
+    repairs the matrix later.
+    """
+    if _directory is None or not profiles_by_library_id:
+        return
+    try:
+        get_allele_matrix(scheme_id).upsert(profiles_by_library_id, profile_hashes)
+    except OSError as e:
+        logging.warning('cannot update allele matrix for cgMLST scheme ' + str(scheme_id) + ': ' + str(e))
+
+
+def remove_libraries(library_ids):
+    """
+    Remove libraries from every matrix, if a matrix directory is configured.
+
+    Called by `tb_db.crud` after samples are deleted.
+    """
+    library_ids = list(library_ids)
+    if _directory is None or not library_ids:
+        return
+    for index_path in glob.glob(os.path.join(_directory, 'cgmlst_scheme_*.index.json')):
+        scheme_id = int(os.path.basename(index_path)[len('cgmlst_scheme_'):-len('.index.json')])
+        try:
+            get_allele_matrix(scheme_id).remove(library_ids)
+        except OSError as e:
+            logging.warning('cannot update allele matrix for cgMLST scheme ' + str(scheme_id) + ': ' + str(e))
+
+
+def sync(db: Session, scheme_id: int):
+    """
+    Bring the scheme's matrix up to date with the database, if a matrix directory is configured.
+
+    Called by `tb_db.bulk_load`, whose set-based statements don't report which profiles they changed.
+
+    :return: Number of rows `written` and `removed`, or None if no directory is configured.
+    :rtype: dict[str, int]|NoneType
+    """
+    if _directory is None:
+        return None
+    try:
+        return get_allele_matrix(scheme_id).sync(db)
+    except OSError as e:
+        logging.warning('cannot update allele matrix for cgMLST scheme ' + str(scheme_id) + ': ' + str(e))
+        return None
@@ -0,0 +1,421 @@
+import csv
+import io
+import json
+
+from sqlalchemy import select
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+from .models import *
+
+import tb_db.allele_matrix as allele_matrix
+import tb_db.cache as cache
+import tb_db.crud as crud
+import tb_db.records as records
+import tb_db.utils as utils
+
+# Number of staged rows sent per COPY (PostgreSQL) or executemany (other databases).
+STAGE_BATCH_SIZE = 50000
+
+
+def _uses_copy(db: Session):
+    """
+    Check whether the session's database supports COPY FROM STDIN through its driver.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :return: True for PostgreSQL over psycopg2.
+    :rtype: bool
+    """
+    dialect = db.get_bind().dialect
+
+    return dialect.name == 'postgresql' and dialect.driver == 'psycopg2'
+
+
+def _json_cast(db: Session, column: str):
+    """
+    SQL expression that turns a staged JSON text column into a value for a JSON column.
+    """
+    if db.get_bind().dialect.name == 'postgresql':
+        return 'CAST(' + column + ' AS JSON)'
+
+    return column
+
+
+def _stage(db: Session, table_name: str, columns: list[tuple[str, str]], rows):
+    """
+    Create a temporary staging table and fill it with rows.
+
+    On PostgreSQL the rows are sent with `COPY ... FROM STDIN` (CSV format), so
+    empty strings and None are both loaded as NULL. Other databases fall back to
+    batched inserts.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param table_name: Name of the staging table. Any existing table with this name is dropped.
+    :type table_name: str
+    :param columns: Column names and SQL types.
+    :type columns: list[tuple[str, str]]
+    :param rows: Rows to stage, as tuples in the same order as `columns`.
+    :type rows: Iterable[tuple]
+    :return: Number of rows staged.
+    :rtype: int
+    """
+    column_names = [column_name for column_name, column_type in columns]
+    db.execute(text('DROP TABLE IF EXISTS ' + table_name))
+    db.execute(text(
+        'CREATE TEMPORARY TABLE ' + table_name + ' (' +
+        ', '.join([column_name + ' ' + column_type for column_name, column_type in columns]) +
+        ')'
+    ))
+
+    num_rows_staged = 0
+    if _uses_copy(db):
+        copy_sql = 'COPY ' + table_name + ' (' + ', '.join(column_names) + ') FROM STDIN WITH (FORMAT csv)'
+        cursor = db.connection().connection.cursor()
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        num_rows_buffered = 0
+        for row in rows:
+            writer.writerow(row)
+            num_rows_buffered += 1
+            if num_rows_buffered == STAGE_BATCH_SIZE:
+                buffer.seek(0)
+                cursor.copy_expert(copy_sql, buffer)
+                num_rows_staged += num_rows_buffered
+                buffer = io.StringIO()
+                writer = csv.writer(buffer, lineterminator='\n')
+                num_rows_buffered = 0
+        if num_rows_buffered > 0:
+            buffer.seek(0)
+            cursor.copy_expert(copy_sql, buffer)
+            num_rows_staged += num_rows_buffered
+        cursor.close()
+    else:
+        insert_stmt = text(
+            'INSERT INTO ' + table_name + ' (' + ', '.join(column_names) + ') VALUES (' +
+            ', '.join([':' + column_name for column_name in column_names]) + ')'
+        )
+        batch = []
+        for row in rows:
+            batch.append(dict(zip(column_names, row)))
+            if len(batch) == STAGE_BATCH_SIZE:
+                db.execute(insert_stmt, batch)
+                num_rows_staged += len(batch)
+                batch = []
+        if batch:
+            db.execute(insert_stmt, batch)
+            num_rows_staged += len(batch)
+
+    return num_rows_staged
+
+
+def _resolve_sample_ids(db: Session, table_name: str):
+    """
+    Fill the `sample_pk` column of a staging table with the database ID of each sample.
+
+    On PostgreSQL this is one join against `sample`. Other databases look each
+    staged row up through the index on `sample.sample_id`.
+    """
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(text(
+            'UPDATE ' + table_name + ' SET sample_pk = s.sample_pk '
+            'FROM (SELECT sample.sample_id, MIN(sample.id) AS sample_pk FROM sample '
+            'WHERE sample.sample_id IN (SELECT sample_id FROM ' + table_name + ') '
+            'GROUP BY sample.sample_id) s '
+            'WHERE s.sample_id = ' + table_name + '.sample_id'
+        ))
+    else:
+        db.execute(text(
+            'UPDATE ' + table_name + ' SET sample_pk = '
+            '(SELECT MIN(sample.id) FROM sample WHERE sample.sample_id = ' + table_name + '.sample_id)'
+        ))
+
+
+def _resolve_library_ids(db: Session, table_name: str):
+    """
+    Fill the `library_pk` column of a staging table with the library of each sample on its sequencing run.
+
+    On PostgreSQL this is one join against `library` and `sample`. Other
+    databases look each staged row up through the index on `sample.sample_id`.
+    """
+    if db.get_bind().dialect.name == 'postgresql':
+        db.execute(text(
+            'UPDATE ' + table_name + ' SET library_pk = l.library_pk '
+            'FROM (SELECT sample.sample_id, library.sequencing_run_id, MIN(library.id) AS library_pk '
+            'FROM library JOIN sample ON sample.id = library.sample_id '
+            'WHERE sample.sample_id IN (SELECT sample_id FROM ' + table_name + ') '
+            'GROUP BY sample.sample_id, library.sequencing_run_id) l '
+            'WHERE l.sample_id = ' + table_name + '.sample_id '
+            'AND l.sequencing_run_id = ' + table_name + '.sequencing_run_id'
+        ))
+    else:
+        db.execute(text(
+            'UPDATE ' + table_name + ' SET library_pk = '
+            '(SELECT MIN(library.id) FROM library JOIN sample ON sample.id = library.sample_id '
+            'WHERE sample.sample_id = ' + table_name + '.sample_id '
+            'AND library.sequencing_run_id = ' + table_name + '.sequencing_run_id)'
+        ))
+    db.execute(text('CREATE INDEX ix_' + table_name + '_library_pk ON ' + table_name + ' (library_pk)'))
+
+
+def _count_unresolved(db: Session, table_name: str, column: str):
+    return db.execute(text('SELECT COUNT(*) FROM ' + table_name + ' WHERE ' + column + ' IS NULL')).scalar()
+
+
+def _present(value):
+    """
+    Value of an optional record field, staged as NULL if it is `records.ABSENT`.
+    """
+    return None if value is records.ABSENT else value
+
+
+def load_cgmlst_allele_profiles(db: Session, scheme: dict, cgmlst_allele_profiles, runs: dict[str, str]):
+    """
+    Load cgMLST allele profiles through a staging table, then merge them into
+    `cgmlst_allele_profile` with set-based statements.
+
+    Profiles are stored exactly as `crud.create_cgmlst_allele_profiles` stores them,
+    and existing profiles are only rewritten if their profile hash has changed.
+    Profiles for samples without a library on their sequencing run are skipped.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param scheme: Dict representing the cgMLST scheme. Must include keys `name`, `version` and `num_loci`.
+    :type scheme: dict
+    :param cgmlst_allele_profiles: cgMLST allele profiles, as produced by `parsers.parse_cgmlst`.
+    :type cgmlst_allele_profiles: Iterable[records.CgmlstProfileRecord|dict[str, object]]
+    :param runs: Dict with sample ids and their run ids
+    :type runs: dict[str,str]
+    :return: Counts of `staged`, `inserted`, `updated`, `unchanged` and `skipped` profiles.
+    :rtype: dict[str, int]
+    """
+    stmt = select(CgmlstScheme).where(CgmlstScheme.name == scheme['name'])
+    db_scheme = db.scalars(stmt).first()
+    if db_scheme is None:
+        db_scheme = CgmlstScheme(
+            name = scheme['name'],
+            version = scheme['version'],
+            num_loci = scheme['num_loci']
+        )
+        db.add(db_scheme)
+        db.flush()
+
+    table_name = 'tb_db_stage_cgmlst'
+    columns = [
+        ('sample_id', 'TEXT'),
+        ('sequencing_run_id', 'TEXT'),
+        ('percent_called', 'DOUBLE PRECISION'),
+        ('profile', 'TEXT'),
+        ('profile_hash', 'TEXT'),
+        ('library_pk', 'INTEGER'),
+    ]
+    rows = (
+        (
+            profile.sample_id,
+            runs.get(profile.sample_id),
+            profile.percent_called,
+            json.dumps(json.dumps(profile.profile)),
+            # Same as `crud.cgmlst_allele_profile_hash`.
+            utils.content_hash(profile.profile),
+            None,
+        )
+        for profile in records.iter_records(cgmlst_allele_profiles, records.CgmlstProfileRecord)
+    )
+    num_staged = _stage(db, table_name, columns, rows)
+    _resolve_library_ids(db, table_name)
+    num_skipped = _count_unresolved(db, table_name, 'library_pk')
+
+    params = {'cgmlst_scheme_id': db_scheme.id}
+    updated = db.execute(text(
+        'UPDATE cgmlst_allele_profile SET '
+        'percent_called = st.percent_called, '
+        'profile = ' + _json_cast(db, 'st.profile') + ', '
+        'profile_hash = st.profile_hash, '
+        'cgmlst_scheme_id = :cgmlst_scheme_id '
+        'FROM ' + table_name + ' st '
+        'WHERE cgmlst_allele_profile.library_id = st.library_pk '
+        'AND (cgmlst_allele_profile.profile_hash IS NULL '
+        'OR cgmlst_allele_profile.profile_hash <> st.profile_hash '
+        'OR cgmlst_allele_profile.cgmlst_scheme_id IS NULL '
+        'OR cgmlst_allele_profile.cgmlst_scheme_id <> :cgmlst_scheme_id)'
+    ), params)
+    inserted = db.execute(text(
+        'INSERT INTO cgmlst_allele_profile (library_id, cgmlst_scheme_id, percent_called, profile, profile_hash) '
+        'SELECT st.library_pk, :cgmlst_scheme_id, st.percent_called, ' + _json_cast(db, 'st.profile') + ', st.profile_hash '
+        'FROM ' + table_name + ' st '
+        'WHERE st.library_pk IS NOT NULL AND NOT EXISTS '
+        '(SELECT 1 FROM cgmlst_allele_profile p WHERE p.library_id = st.library_pk)'
+    ), params)
+    db.execute(text('DROP TABLE ' + table_name))
+    db.commit()
+    allele_matrix.sync(db, db_scheme.id)
+
+    counts = {
+        'staged': num_staged,
+        'inserted': inserted.rowcount,
+        'updated': updated.rowcount,
+        'unchanged': num_staged - num_skipped - inserted.rowcount - updated.rowcount,
+        'skipped': num_skipped,
+    }
+
+    return counts
+
+
+def load_miru_profiles(db: Session, miru_profiles_by_sample_id: dict[str, object]):
+    """
+    Load MIRU profiles through a staging table, then merge samples, MIRU clusters,
+    cluster membership and profiles with set-based statements.
+
+    Missing samples and clusters are created, as in `crud.create_miru_profiles`.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param miru_profiles_by_sample_id: MIRU profiles indexed by Sample ID, as produced by `parsers.parse_miru`.
+    :type miru_profiles_by_sample_id: dict[str, records.MiruRecord|dict[str, object]]
+    :return: Counts of `staged` profiles, and `inserted` and `updated` profiles.
+    :rtype: dict[str, int]
+    """
+    table_name = 'tb_db_stage_miru'
+    columns = [
+        ('sample_id', 'TEXT'),
+        ('accession', 'TEXT'),
+        ('collection_date', 'DATE'),
+        ('cluster_id', 'TEXT'),
+        ('percent_called', 'DOUBLE PRECISION'),
+        ('profile_by_position', 'TEXT'),
+        ('miru_pattern', 'TEXT'),
+        ('sample_pk', 'INTEGER'),
+    ]
+
+    miru_profiles = records.as_records(miru_profiles_by_sample_id.values(), records.MiruRecord)
+
+    def rows():
+        for sample_id, miru_profile in zip(miru_profiles_by_sample_id, miru_profiles):
+            percent_called, profile_by_position = crud.miru_vntr_summary(miru_profile)
+            yield (
+                sample_id,
+                _present(miru_profile.accession),
+                _present(miru_profile.collection_date),
+                _present(miru_profile.cluster),
+                percent_called,
+                json.dumps(json.dumps(profile_by_position)),
+                _present(miru_profile.miru_pattern),
+                None,
+            )
+
+    num_staged = _stage(db, table_name, columns, rows())
+
+    db.execute(text(
+        'INSERT INTO sample (sample_id, accession, collection_date) '
+        'SELECT st.sample_id, MIN(st.accession), MIN(st.collection_date) FROM ' + table_name + ' st '
+        'WHERE NOT EXISTS (SELECT 1 FROM sample WHERE sample.sample_id = st.sample_id) '
+        'GROUP BY st.sample_id'
+    ))
+    _resolve_sample_ids(db, table_name)
+    db.execute(text(
+        'INSERT INTO miru_cluster (cluster_id) '
+        'SELECT DISTINCT st.cluster_id FROM ' + table_name + ' st '
+        'WHERE st.cluster_id IS NOT NULL AND NOT EXISTS '
+        '(SELECT 1 FROM miru_cluster WHERE miru_cluster.cluster_id = st.cluster_id)'
+    ))
+    db.execute(text(
+        'INSERT INTO association_table_miru (sample_id, miru_cluster_id) '
+        'SELECT DISTINCT st.sample_pk, miru_cluster.id FROM ' + table_name + ' st '
+        'JOIN miru_cluster ON miru_cluster.cluster_id = st.cluster_id '
+        'WHERE NOT EXISTS (SELECT 1 FROM association_table_miru a '
+        'WHERE a.sample_id = st.sample_pk AND a.miru_cluster_id = miru_cluster.id)'
+    ))
+    updated = db.execute(text(
+        'UPDATE miru_profile SET '
+        'percent_called = st.percent_called, '
+        'profile_by_position = ' + _json_cast(db, 'st.profile_by_position') + ', '
+        'miru_pattern = st.miru_pattern '
+        'FROM ' + table_name + ' st '
+        'WHERE miru_profile.sample_id = st.sample_pk'
+    ))
+    inserted = db.execute(text(
+        'INSERT INTO miru_profile (sample_id, percent_called, profile_by_position, miru_pattern) '
+        'SELECT st.sample_pk, st.percent_called, ' + _json_cast(db, 'st.profile_by_position') + ', st.miru_pattern '
+        'FROM ' + table_name + ' st '
+        'WHERE NOT EXISTS (SELECT 1 FROM miru_profile p WHERE p.sample_id = st.sample_pk)'
+    ))
+    db.execute(text('DROP TABLE ' + table_name))
+    db.commit()
+    cache.invalidate(db, [cache.MIRU_CLUSTER], miru_profiles_by_sample_id.keys())
+    miru_cluster_ids = [_present(miru_profile.cluster) for miru_profile in miru_profiles]
+    crud.refresh_cluster_summaries(db, crud.CLUSTER_TYPE_MIRU, [cluster_id for cluster_id in miru_cluster_ids if cluster_id is not None])
+
+    counts = {
+        'staged': num_staged,
+        'inserted': inserted.rowcount,
+        'updated': updated.rowcount,
+    }
+
+    return counts
+
+
+def load_species(db: Session, species, runs: dict[str, str]):
+    """
+    Load species assignments through a staging table, replacing the species of
+    every library in the input with set-based statements.
+
+    Rows for samples without a library on their sequencing run are skipped.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param species: Species assignments, as produced by `parsers.iter_species`.
+    :type species: Iterable[records.SpeciesRecord|dict[str, object]]
+    :param runs: Dict with sample ids and their run ids
+    :type runs: dict[str,str]
+    :return: Counts of `staged`, `deleted`, `inserted` and `skipped` rows.
+    :rtype: dict[str, int]
+    """
+    table_name = 'tb_db_stage_species'
+    columns = [
+        ('sample_id', 'TEXT'),
+        ('sequencing_run_id', 'TEXT'),
+        ('taxonomy_level', 'TEXT'),
+        ('species_name', 'TEXT'),
+        ('ncbi_taxonomy_id', 'DOUBLE PRECISION'),
+        ('fraction_total_reads', 'DOUBLE PRECISION'),
+        ('num_assigned_reads', 'DOUBLE PRECISION'),
+        ('library_pk', 'INTEGER'),
+    ]
+    rows = (
+        (
+            speci.sample_id,
+            runs.get(speci.sample_id),
+            speci.taxonomy_level,
+            speci.name,
+            speci.ncbi_taxonomy_id,
+            speci.fraction_total_reads,
+            speci.num_assigned_reads,
+            None,
+        )
+        for speci in records.iter_records(species, records.SpeciesRecord)
+    )
+    num_staged = _stage(db, table_name, columns, rows)
+    _resolve_library_ids(db, table_name)
+    num_skipped = _count_unresolved(db, table_name, 'library_pk')
+
+    deleted = db.execute(text(
+        'DELETE FROM tb_species WHERE library_id IN '
+        '(SELECT library_pk FROM ' + table_name + ' WHERE library_pk IS NOT NULL)'
+    ))
+    inserted = db.execute(text(
+        'INSERT INTO tb_species (library_id, taxonomy_level, species_name, ncbi_taxonomy_id, fraction_total_reads, num_assigned_reads) '
+        'SELECT st.library_pk, st.taxonomy_level, st.species_name, st.ncbi_taxonomy_id, st.fraction_total_reads, st.num_assigned_reads '
+        'FROM ' + table_name + ' st WHERE st.library_pk IS NOT NULL'
+    ))
+    db.execute(text('DROP TABLE ' + table_name))
+    db.commit()
+
+    counts = {
+        'staged': num_staged,
+        'deleted': deleted.rowcount,
+        'inserted': inserted.rowcount,
+        'skipped': num_skipped,
+    }
+
+    return counts
@@ -0,0 +1,242 @@
+import collections
+import json
+import os
+import pickle
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+
+# Defaults for the in-process cache that is active unless `configure` is called.
+DEFAULT_MAX_ENTRIES = 10000
+DEFAULT_TTL_SECONDS = 300
+
+# Returned by cache backends on a miss, since None is a valid cached value.
+MISSING = object()
+
+# Names of the cached lookups in `tb_db.crud`.
+SAMPLE = 'sample'
+CGMLST_CLUSTER = 'cgmlst_cluster'
+MIRU_CLUSTER = 'miru_cluster'
+NAMESPACES = [SAMPLE, CGMLST_CLUSTER, MIRU_CLUSTER]
+
+_engine_tokens = weakref.WeakKeyDictionary()
+
+
+class LRUCache:
+    """
+    In-process least-recently-used cache with a time-to-live for each entry.
+
+    Entries are only invalidated by writes made through `tb_db` in the same
+    process. Another process (e.g. a long-lived reader, while a loader runs
+    elsewhere) keeps returning the old value until the entry's time-to-live
+    has passed.
+    """
+
+    def __init__(self, max_entries: int = DEFAULT_MAX_ENTRIES, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return MISSING
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return MISSING
+            self._entries.move_to_end(key)
+
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+class DiskCache:
+    """
+    Cache stored in a local SQLite file, so that it is shared by the processes
+    on one host and survives restarts. Values are pickled.
+
+    Entries are invalidated by the process that changes the data; other
+    processes only see the change once the entry's time-to-live has passed.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = DEFAULT_TTL_SECONDS):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS cache (key TEXT PRIMARY KEY, expires_at REAL, value BLOB)')
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def _key(self, key):
+        return json.dumps(key, default=str)
+
+    def get(self, key):
+        with self._lock, self._connect() as conn:
+            row = conn.execute('SELECT expires_at, value FROM cache WHERE key = ?', (self._key(key),)).fetchone()
+        if row is None or row[0] < time.time():
+            return MISSING
+
+        return pickle.loads(row[1])
+
+    def set(self, key, value):
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO cache (key, expires_at, value) VALUES (?, ?, ?)',
+                (self._key(key), time.time() + self.ttl_seconds, pickle.dumps(value)),
+            )
+
+    def delete(self, key):
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM cache WHERE key = ?', (self._key(key),))
+
+    def clear(self):
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM cache')
+
+    def prune(self):
+        """
+        Remove expired entries from the file.
+        """
+        with self._lock, self._connect() as conn:
+            conn.execute('DELETE FROM cache WHERE expires_at < ?', (time.time(),))
+
+
+_backend = LRUCache()
+_invalidation_listeners = []
+
+
+def configure(backend):
+    """
+    Set the cache used by the cached `tb_db.crud` lookups.
+
+    Caches are only coherent within the processes that share them: writes
+    invalidate entries in the process that makes them (and, for a `DiskCache`,
+    in the file it shares with other processes on the host). Processes that
+    must never see stale cluster assignments after another process writes
+    should use a short time-to-live, or pass None to disable caching.
+
+    :param backend: Cache backend, e.g. `LRUCache()` or `DiskCache(path)`. If None, lookups are not cached.
+    :type backend: LRUCache|DiskCache|NoneType
+    """
+    global _backend
+    _backend = backend
+
+
+def add_invalidation_listener(listener):
+    """
+    Register a function to be called as `listener(namespace, sample_ids)` whenever
+    cached lookups are invalidated, e.g. to clear an application-level cache as well.
+
+    :param listener: Function to call.
+    :type listener: Callable[[str, list[str]], None]
+    """
+    _invalidation_listeners.append(listener)
+
+
+def database_key(db):
+    """
+    Key that identifies the database a session is bound to, so that entries for
+    different databases don't collide. In-memory SQLite databases get a key per engine.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :return: Database key.
+    :rtype: str
+    """
+    engine = db.get_bind()
+    url = engine.url
+    if url.get_backend_name() == 'sqlite' and url.database in (None, '', ':memory:'):
+        if engine not in _engine_tokens:
+            _engine_tokens[engine] = uuid.uuid4().hex
+        return 'sqlite-memory:' + _engine_tokens[engine]
+
+    return url.render_as_string(hide_password=True)
+
+
+def lookup(db, namespace: str, sample_id: str):
+    """
+    Look up a cached value.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param namespace: Name of the cached lookup, e.g. `cgmlst_cluster`.
+    :type namespace: str
+    :param sample_id: Sample ID the value was looked up for.
+    :type sample_id: str
+    :return: Cached value, or `MISSING`.
+    :rtype: object
+    """
+    if _backend is None:
+        return MISSING
+
+    return _backend.get((namespace, database_key(db), sample_id))
+
+
+def store(db, namespace: str, sample_id: str, value):
+    """
+    Cache a value.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param namespace: Name of the cached lookup, e.g. `cgmlst_cluster`.
+    :type namespace: str
+    :param sample_id: Sample ID the value was looked up for.
+    :type sample_id: str
+    :param value: Value to cache. Must be picklable if a `DiskCache` is used.
+    :type value: object
+    """
+    if _backend is not None:
+        _backend.set((namespace, database_key(db), sample_id), value)
+
+
+def invalidate(db, namespaces, sample_ids):
+    """
+    Drop cached values for samples whose data has changed.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param namespaces: Names of the cached lookups to invalidate.
+    :type namespaces: list[str]
+    :param sample_ids: Sample IDs to invalidate.
+    :type sample_ids: Iterable[str]
+    """
+    sample_ids = list(sample_ids)
+    if _backend is not None:
+        key = database_key(db)
+        for namespace in namespaces:
+            for sample_id in sample_ids:
+                _backend.delete((namespace, key, sample_id))
+    for listener in _invalidation_listeners:
+        for namespace in namespaces:
+            listener(namespace, sample_ids)
+
+
+def clear():
+    """
+    Drop all cached values.
+    """
+    if _backend is not None:
+        _backend.clear()
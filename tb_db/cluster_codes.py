@@ -0,0 +1,227 @@
+import numpy as np
+
+from sqlalchemy import select, delete, insert, update, and_
+from sqlalchemy.orm import Session
+
+from .models import *
+
+import tb_db.distance as distance
+
+# Allele distance thresholds of the default nomenclature levels, finest first.
+DEFAULT_THRESHOLDS = [0, 2, 5, 10, 25, 50]
+
+# New libraries whose distances to the collection are computed at once.
+ASSIGN_BATCH_SIZE = 256
+
+
+class _UnionFind:
+    """
+    Union-find over cluster numbers, where the root of every set is its
+    smallest (i.e. oldest) cluster number, so merged clusters keep the oldest code.
+    """
+
+    def __init__(self):
+        self.parent = {}
+
+    def find(self, cluster_number):
+        root = cluster_number
+        while self.parent.get(root, root) != root:
+            root = self.parent[root]
+        while cluster_number != root:
+            self.parent[cluster_number], cluster_number = root, self.parent.get(cluster_number, cluster_number)
+
+        return root
+
+    def union(self, cluster_numbers):
+        roots = set(self.find(cluster_number) for cluster_number in cluster_numbers)
+        root = min(roots)
+        for other in roots:
+            self.parent[other] = root
+
+        return root
+
+
+def _unassigned_library_ids(db: Session, scheme_id: int, thresholds):
+    stmt = (
+        select(CgmlstAlleleProfile.library_id)
+        .where(CgmlstAlleleProfile.cgmlst_scheme_id == scheme_id)
+        .where(
+            ~select(CgmlstClusterCode.id)
+            .where(and_(
+                CgmlstClusterCode.library_id == CgmlstAlleleProfile.library_id,
+                CgmlstClusterCode.cgmlst_scheme_id == scheme_id,
+                CgmlstClusterCode.threshold.in_(thresholds),
+            ))
+            .exists()
+        )
+        .order_by(CgmlstAlleleProfile.library_id)
+    )
+
+    return db.scalars(stmt).all()
+
+
+def assign_cluster_codes(db: Session, scheme_id: int, library_ids=None, thresholds=DEFAULT_THRESHOLDS):
+    """
+    Assign hierarchical cluster codes to new libraries, against the libraries
+    that already have codes, without re-clustering the collection.
+
+    At each threshold, clusters are single-linkage: a library joins the
+    cluster of every coded library within the threshold's allele distance. A
+    library with no such neighbour starts a new cluster. A library that links
+    several clusters merges them, and the merged cluster keeps the smallest
+    (oldest) cluster number, so existing codes only change on merges. Clusters
+    are never split, so libraries whose profile changed keep being linked by
+    their old codes until the collection is re-coded from scratch.
+
+    Libraries are assigned in ID order, so the result doesn't depend on how
+    loads are batched.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param scheme_id: Database ID of the cgMLST scheme.
+    :type scheme_id: int
+    :param library_ids: Libraries to (re-)assign. If None, every library with a profile in the scheme that has no code yet.
+    :type library_ids: Iterable[int]|NoneType
+    :param thresholds: Allele distance thresholds, one per nomenclature level.
+    :type thresholds: list[int]
+    :return: Cluster number at each threshold, indexed by library ID, for the assigned libraries.
+    :rtype: dict[int, dict[int, int]]
+    """
+    thresholds = sorted(set(int(threshold) for threshold in thresholds))
+    if library_ids is None:
+        library_ids = _unassigned_library_ids(db, scheme_id, thresholds)
+    new_library_ids = sorted(set(library_ids))
+    if not new_library_ids:
+        return {}
+
+    for start in range(0, len(new_library_ids), distance.LOOKUP_BATCH_SIZE):
+        batch = new_library_ids[start:start + distance.LOOKUP_BATCH_SIZE]
+        db.execute(delete(CgmlstClusterCode).where(and_(
+            CgmlstClusterCode.cgmlst_scheme_id == scheme_id,
+            CgmlstClusterCode.threshold.in_(thresholds),
+            CgmlstClusterCode.library_id.in_(batch),
+        )).execution_options(synchronize_session=False))
+
+    cluster_number_by_library_id = {threshold: {} for threshold in thresholds}
+    stmt = (
+        select(CgmlstClusterCode.threshold, CgmlstClusterCode.library_id, CgmlstClusterCode.cluster_number)
+        .where(and_(CgmlstClusterCode.cgmlst_scheme_id == scheme_id, CgmlstClusterCode.threshold.in_(thresholds)))
+    )
+    for threshold, library_id, cluster_number in db.execute(stmt):
+        cluster_number_by_library_id[threshold][library_id] = cluster_number
+
+    # All coded and new libraries are loaded together, so their loci line up.
+    coded_library_ids = set()
+    for cluster_numbers in cluster_number_by_library_id.values():
+        coded_library_ids.update(cluster_numbers)
+    all_library_ids, loci, profiles = distance.load_library_profiles(db, scheme_id, sorted(coded_library_ids | set(new_library_ids)))
+    column_by_library_id = {library_id: column for column, library_id in enumerate(all_library_ids)}
+    new_library_ids = [library_id for library_id in new_library_ids if library_id in column_by_library_id]
+
+    # Cluster number of the library in each column at each threshold, -1 if it has none yet.
+    cluster_of_column = {}
+    next_cluster_number = {}
+    union_find = {}
+    for threshold in thresholds:
+        cluster_numbers = cluster_number_by_library_id[threshold]
+        cluster_of_column[threshold] = np.array([cluster_numbers.get(library_id, -1) for library_id in all_library_ids], dtype=np.int64)
+        next_cluster_number[threshold] = max(cluster_numbers.values(), default=0) + 1
+        union_find[threshold] = _UnionFind()
+
+    for start in range(0, len(new_library_ids), ASSIGN_BATCH_SIZE):
+        batch = new_library_ids[start:start + ASSIGN_BATCH_SIZE]
+        distances = distance.pairwise_distances(profiles[[column_by_library_id[library_id] for library_id in batch]], profiles)
+        for row, library_id in enumerate(batch):
+            column = column_by_library_id[library_id]
+            for threshold in thresholds:
+                neighbour_clusters = cluster_of_column[threshold][distances[row] <= threshold]
+                neighbour_clusters = np.unique(neighbour_clusters[neighbour_clusters >= 0])
+                if len(neighbour_clusters) == 0:
+                    cluster_number = next_cluster_number[threshold]
+                    next_cluster_number[threshold] += 1
+                else:
+                    cluster_number = union_find[threshold].union(int(c) for c in neighbour_clusters)
+                cluster_of_column[threshold][column] = cluster_number
+
+    # Resolve merges: rename merged clusters in the database, and give new libraries their final numbers.
+    codes_by_library_id = {library_id: {} for library_id in new_library_ids}
+    db_cluster_codes = []
+    for threshold in thresholds:
+        find = union_find[threshold].find
+        for merged_cluster_number in list(union_find[threshold].parent):
+            root = find(merged_cluster_number)
+            if root != merged_cluster_number:
+                db.execute(
+                    update(CgmlstClusterCode)
+                    .where(and_(
+                        CgmlstClusterCode.cgmlst_scheme_id == scheme_id,
+                        CgmlstClusterCode.threshold == threshold,
+                        CgmlstClusterCode.cluster_number == merged_cluster_number,
+                    ))
+                    .values(cluster_number=root)
+                    .execution_options(synchronize_session=False)
+                )
+        for library_id in new_library_ids:
+            cluster_number = find(int(cluster_of_column[threshold][column_by_library_id[library_id]]))
+            codes_by_library_id[library_id][threshold] = cluster_number
+            db_cluster_codes.append({
+                'library_id': library_id,
+                'cgmlst_scheme_id': scheme_id,
+                'threshold': threshold,
+                'cluster_number': cluster_number,
+            })
+
+    for start in range(0, len(db_cluster_codes), distance.LOOKUP_BATCH_SIZE):
+        db.execute(insert(CgmlstClusterCode), db_cluster_codes[start:start + distance.LOOKUP_BATCH_SIZE])
+    db.commit()
+
+    return codes_by_library_id
+
+
+def get_cluster_codes(db: Session, sample_ids, scheme_id: int = None):
+    """
+    Get the hierarchical cluster codes of some samples, from each sample's most recent coded library.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param sample_ids: Sample IDs.
+    :type sample_ids: Iterable[str]
+    :param scheme_id: Only return codes for this cgMLST scheme.
+    :type scheme_id: int
+    :return: Cluster number at each threshold, indexed by Sample ID. Samples without codes are omitted.
+    :rtype: dict[str, dict[int, int]]
+    """
+    sample_ids = sorted(set(sample_ids))
+
+    codes_by_sample_id = {}
+    for start in range(0, len(sample_ids), distance.LOOKUP_BATCH_SIZE):
+        batch = sample_ids[start:start + distance.LOOKUP_BATCH_SIZE]
+        stmt = (
+            select(Sample.sample_id, Library.id, CgmlstClusterCode.threshold, CgmlstClusterCode.cluster_number)
+            .join(Library, Library.sample_id == Sample.id)
+            .join(CgmlstClusterCode, CgmlstClusterCode.library_id == Library.id)
+            .where(Sample.sample_id.in_(batch))
+            .order_by(Library.id)
+        )
+        if scheme_id is not None:
+            stmt = stmt.where(CgmlstClusterCode.cgmlst_scheme_id == scheme_id)
+        library_id_by_sample_id = {}
+        for sample_id, library_id, threshold, cluster_number in db.execute(stmt):
+            if library_id_by_sample_id.get(sample_id) != library_id:
+                library_id_by_sample_id[sample_id] = library_id
+                codes_by_sample_id[sample_id] = {}
+            codes_by_sample_id[sample_id][threshold] = cluster_number
+
+    return codes_by_sample_id
+
+
+def format_cluster_code(codes_by_threshold: dict[int, int]):
+    """
+    Format cluster numbers as a hierarchical code, coarsest level first, e.g. `1.4.4.9.12.12`.
+
+    :param codes_by_threshold: Cluster number at each threshold, as returned by `get_cluster_codes`.
+    :type codes_by_threshold: dict[int, int]
+    :return: Cluster code.
+    :rtype: str
+    """
+    return '.'.join(str(codes_by_threshold[threshold]) for threshold in sorted(codes_by_threshold, reverse=True))
@@ -0,0 +1,224 @@
+import numpy as np
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import *
+
+import tb_db.cache as cache
+import tb_db.crud as crud
+import tb_db.distance as distance
+
+# Per-database state of `get_concordance`: cluster summary versions, cluster
+# assignment of every sample, and the last result.
+_state_by_database_key = {}
+
+
+def _pairs(counts):
+    counts = np.asarray(counts, dtype=np.float64)
+
+    return counts * (counts - 1) / 2
+
+
+def compute_concordance(sample_ids, miru_cluster_ids, cgmlst_cluster_ids):
+    """
+    Concordance between the MIRU and cgMLST clusterings of the same samples.
+
+    - `contingency`: number of samples in each MIRU cluster and cgMLST cluster
+      combination that occurs (the table is sparse, so empty cells are left out).
+    - `adjusted_rand_index`: agreement of the two clusterings over all pairs of
+      samples, corrected for chance: 1 if they're identical, about 0 if they agree
+      no more than random clusterings of the same cluster sizes would. None if
+      there are fewer than 2 samples.
+    - `wallace_miru_cgmlst`: fraction of the pairs of samples clustered together
+      by MIRU that are also clustered together by cgMLST, and `wallace_cgmlst_miru`
+      the other way around. None if no pairs are clustered together.
+    - `discordant_samples`: samples whose MIRU cluster and cgMLST cluster don't
+      have the same members, with the number of samples that share only their
+      MIRU cluster (`num_miru_only`) or only their cgMLST cluster (`num_cgmlst_only`).
+
+    :param sample_ids: Sample IDs.
+    :type sample_ids: list[str]
+    :param miru_cluster_ids: MIRU cluster code of each sample.
+    :type miru_cluster_ids: list[str]
+    :param cgmlst_cluster_ids: cgMLST cluster code of each sample.
+    :type cgmlst_cluster_ids: list[str]
+    :return: Concordance, with keys `num_samples`, `contingency`, `adjusted_rand_index`, `wallace_miru_cgmlst`, `wallace_cgmlst_miru` and `discordant_samples`.
+    :rtype: dict[str, object]
+    """
+    num_samples = len(sample_ids)
+    if num_samples == 0:
+        return {
+            'num_samples': 0,
+            'contingency': [],
+            'adjusted_rand_index': None,
+            'wallace_miru_cgmlst': None,
+            'wallace_cgmlst_miru': None,
+            'discordant_samples': [],
+        }
+
+    miru_codes, miru_labels = np.unique(np.array(miru_cluster_ids, dtype=str), return_inverse=True)
+    cgmlst_codes, cgmlst_labels = np.unique(np.array(cgmlst_cluster_ids, dtype=str), return_inverse=True)
+
+    # The contingency table as (cell, count) pairs, since most cells are empty.
+    cells, cell_labels, cell_counts = np.unique(miru_labels * len(cgmlst_codes) + cgmlst_labels, return_inverse=True, return_counts=True)
+    miru_counts = np.bincount(miru_labels, minlength=len(miru_codes))
+    cgmlst_counts = np.bincount(cgmlst_labels, minlength=len(cgmlst_codes))
+
+    pairs_together = _pairs(cell_counts).sum()
+    miru_pairs = _pairs(miru_counts).sum()
+    cgmlst_pairs = _pairs(cgmlst_counts).sum()
+    max_pairs = (miru_pairs + cgmlst_pairs) / 2
+    if num_samples < 2:
+        # No pairs of samples to agree or disagree on.
+        adjusted_rand_index = None
+    else:
+        expected_pairs = miru_pairs * cgmlst_pairs / _pairs(num_samples)
+        if max_pairs == expected_pairs:
+            adjusted_rand_index = 1.0
+        else:
+            adjusted_rand_index = float((pairs_together - expected_pairs) / (max_pairs - expected_pairs))
+
+    num_together = cell_counts[cell_labels]
+    num_miru_only = miru_counts[miru_labels] - num_together
+    num_cgmlst_only = cgmlst_counts[cgmlst_labels] - num_together
+    discordant_samples = [
+        {
+            'sample_id': sample_ids[i],
+            'miru_cluster_id': str(miru_codes[miru_labels[i]]),
+            'cgmlst_cluster_id': str(cgmlst_codes[cgmlst_labels[i]]),
+            'num_miru_only': int(num_miru_only[i]),
+            'num_cgmlst_only': int(num_cgmlst_only[i]),
+        }
+        for i in np.nonzero((num_miru_only > 0) | (num_cgmlst_only > 0))[0]
+    ]
+    discordant_samples.sort(key=lambda row: row['sample_id'])
+
+    contingency = [
+        {
+            'miru_cluster_id': str(miru_codes[cell // len(cgmlst_codes)]),
+            'cgmlst_cluster_id': str(cgmlst_codes[cell % len(cgmlst_codes)]),
+            'num_samples': int(count),
+        }
+        for cell, count in zip(cells, cell_counts)
+    ]
+
+    concordance = {
+        'num_samples': num_samples,
+        'contingency': contingency,
+        'adjusted_rand_index': adjusted_rand_index,
+        'wallace_miru_cgmlst': float(pairs_together / miru_pairs) if miru_pairs else None,
+        'wallace_cgmlst_miru': float(pairs_together / cgmlst_pairs) if cgmlst_pairs else None,
+        'discordant_samples': discordant_samples,
+    }
+
+    return concordance
+
+
+def _cluster_assignments(db: Session, sample_ids=None):
+    """
+    MIRU and cgMLST cluster codes of the samples that have both. A sample in
+    more than one cluster of a type gets its most recently assigned one
+    (for cgMLST, from its most recent library).
+
+    :return: MIRU and cgMLST cluster code, indexed by sample ID.
+    :rtype: dict[str, tuple[str, str]]
+    """
+    stmt = (
+        select(Sample.sample_id, MiruCluster.cluster_id, CgmlstCluster.cluster_id)
+        .join(association_table_miru, association_table_miru.c.sample_id == Sample.id)
+        .join(MiruCluster, MiruCluster.id == association_table_miru.c.miru_cluster_id)
+        .join(Library, Library.sample_id == Sample.id)
+        .join(association_table_cgmlst, association_table_cgmlst.c.library_id == Library.id)
+        .join(CgmlstCluster, CgmlstCluster.id == association_table_cgmlst.c.cgmlst_cluster_id)
+        .order_by(Sample.id, MiruCluster.id, Library.id, CgmlstCluster.id)
+    )
+    if sample_ids is None:
+        batches = [None]
+    else:
+        sample_ids = sorted(set(sample_ids))
+        batches = [sample_ids[start:start + distance.LOOKUP_BATCH_SIZE] for start in range(0, len(sample_ids), distance.LOOKUP_BATCH_SIZE)]
+
+    assignments = {}
+    for batch in batches:
+        batch_stmt = stmt if batch is None else stmt.where(Sample.sample_id.in_(batch))
+        for sample_id, miru_cluster_id, cgmlst_cluster_id in db.execute(batch_stmt):
+            assignments[sample_id] = (miru_cluster_id, cgmlst_cluster_id)
+
+    return assignments
+
+
+def _changed_cluster_sample_ids(db: Session, changed_clusters):
+    """
+    Current members of clusters, from their summaries.
+    """
+    sample_ids = set()
+    for cluster_type in [crud.CLUSTER_TYPE_MIRU, crud.CLUSTER_TYPE_CGMLST]:
+        cluster_ids = sorted(cluster_id for changed_type, cluster_id in changed_clusters if changed_type == cluster_type)
+        for start in range(0, len(cluster_ids), distance.LOOKUP_BATCH_SIZE):
+            batch = cluster_ids[start:start + distance.LOOKUP_BATCH_SIZE]
+            stmt = (
+                select(ClusterSummary.sample_ids)
+                .where(ClusterSummary.cluster_type == cluster_type)
+                .where(ClusterSummary.cluster_id.in_(batch))
+            )
+            for members in db.scalars(stmt):
+                sample_ids.update(members or [])
+
+    return sample_ids
+
+
+def get_concordance(db: Session):
+    """
+    Concordance between the current MIRU and cgMLST clusters of all samples
+    that have both (see `compute_concordance`).
+
+    The cluster assignments are kept in-process. After the first call, only
+    the samples of clusters whose summaries changed since the last call are
+    queried again, so the result is recomputed incrementally when assignments
+    change through `tb_db.crud` or `tb_db.bulk_load`, which keep the cluster
+    summaries up to date.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :return: Concordance.
+    :rtype: dict[str, object]
+    """
+    key = cache.database_key(db)
+    stmt = select(ClusterSummary.cluster_type, ClusterSummary.cluster_id, ClusterSummary.updated_at)
+    versions = {(cluster_type, cluster_id): updated_at for cluster_type, cluster_id, updated_at in db.execute(stmt)}
+
+    state = _state_by_database_key.get(key)
+    if state is None:
+        assignments = _cluster_assignments(db)
+    elif state['versions'] == versions:
+        return state['concordance']
+    else:
+        assignments = state['assignments']
+        changed_clusters = set(
+            cluster for cluster in versions.keys() | state['versions'].keys()
+            if versions.get(cluster) != state['versions'].get(cluster)
+        )
+        # Both the previous members (which may have left or been deleted) and the current members of each changed cluster.
+        sample_ids = _changed_cluster_sample_ids(db, changed_clusters)
+        sample_ids.update(
+            sample_id for sample_id, (miru_cluster_id, cgmlst_cluster_id) in assignments.items()
+            if (crud.CLUSTER_TYPE_MIRU, miru_cluster_id) in changed_clusters or (crud.CLUSTER_TYPE_CGMLST, cgmlst_cluster_id) in changed_clusters
+        )
+        for sample_id in sample_ids:
+            assignments.pop(sample_id, None)
+        assignments.update(_cluster_assignments(db, sample_ids))
+
+    sample_ids = sorted(assignments)
+    concordance = compute_concordance(
+        sample_ids,
+        [assignments[sample_id][0] for sample_id in sample_ids],
+        [assignments[sample_id][1] for sample_id in sample_ids],
+    )
+    _state_by_database_key[key] = {
+        'versions': versions,
+        'assignments': assignments,
+        'concordance': concordance,
+    }
+
+    return concordance
@@ -1,13 +1,65 @@
+import datetime
 import json
+import operator
 
-from sqlalchemy import select, delete, and_, update
-from sqlalchemy.orm import Session
+from sqlalchemy import select, delete, insert, and_, update, bindparam, func
+from sqlalchemy.orm import Session, aliased
 
 from .models import *
 
+import tb_db.allele_matrix as allele_matrix
+import tb_db.cache as cache
+import tb_db.records as records
 import tb_db.utils as utils
 import logging
 
+# Number of rows written per statement by the bulk create_* functions.
+BULK_BATCH_SIZE = 500
+
+
+def _batched(items, batch_size=BULK_BATCH_SIZE):
+    """
+    Split a list into consecutive batches of at most `batch_size` items.
+
+    :param items: Items to split.
+    :type items: list
+    :param batch_size: Maximum number of items per batch.
+    :type batch_size: int
+    :return: Iterator of batches.
+    :rtype: Iterator[list]
+    """
+    for start in range(0, len(items), batch_size):
+        yield items[start:start + batch_size]
+
+
+def _get_library_ids_by_sample_id(db: Session, runs: dict[str, str], sample_ids):
+    """
+    Resolve the library for each sample on its sequencing run, in one query per batch.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param runs: Dict with sample ids and their run ids
+    :type runs: dict[str,str]
+    :param sample_ids: Sample IDs to resolve.
+    :type sample_ids: Iterable[str]
+    :return: Library database IDs, indexed by Sample ID. Samples without a library on their run are omitted.
+    :rtype: dict[str, int]
+    """
+    sample_ids = sorted(set(sample_id for sample_id in sample_ids if sample_id in runs))
+
+    library_ids_by_sample_id = {}
+    for batch in _batched(sample_ids):
+        stmt = (
+            select(Sample.sample_id, Library.sequencing_run_id, Library.id)
+            .join(Library, Library.sample_id == Sample.id)
+            .where(Sample.sample_id.in_(batch))
+        )
+        for sample_id, sequencing_run_id, library_id in db.execute(stmt):
+            if sequencing_run_id == runs[sample_id]:
+                library_ids_by_sample_id[sample_id] = library_id
+
+    return library_ids_by_sample_id
+
 ### Samples
 def create_sample(db: Session, sample: dict[str, object]):
     """
@@ -53,20 +105,21 @@ def create_samples(db: Session, samples: list[dict[str, object]]):
 
     :param db: Database session.
     :type db: sqlalchemy.orm.Session
-    :param samples: List of dictionaries representing samples. Must include keys `sample_id` and `collection_date`
+    :param samples: Samples, as dicts or `records.SampleRecord`. Must include keys `sample_id` and `collection_date`
     :type samples: list[dict[str, object]]
     :return: Created samples
     :rtype: list[models.Sample]
     """
+    samples = records.as_records(samples, records.SampleRecord)
     existing_samples = db.query(Sample).all()
     existing_sample_ids = set([sample.sample_id for sample in existing_samples])
 
     db_samples = []
     for sample in samples:
-        if sample['sample_id'] not in existing_sample_ids:
+        if sample.sample_id not in existing_sample_ids:
             db_sample = Sample(
-                sample_id = sample['sample_id'],
-                collection_date = sample['collection_date'],
+                sample_id = sample.sample_id,
+                collection_date = sample.collection_date,
             )
             db_samples.append(db_sample)
 
@@ -82,6 +135,9 @@ def get_sample(db: Session, sample_id: str):
     """
     Get current valid database record for a sample.
 
+    The sample's database ID is cached (see `tb_db.cache`), so repeated lookups
+    are served from the session's identity map or by primary key.
+
     :param db: Database session
     :type db: sqlalchemy.orm.Session
     :param sample_id: Sample ID
@@ -89,7 +145,15 @@ def get_sample(db: Session, sample_id: str):
     :return: Current valid database record for the sample.
     :rtype: models.Sample|NoneType
     """
+    sample_pk = cache.lookup(db, cache.SAMPLE, sample_id)
+    if sample_pk is not cache.MISSING:
+        sample_record = db.get(Sample, sample_pk)
+        if sample_record is not None and sample_record.sample_id == sample_id:
+            return sample_record
+
     sample_record = db.query(Sample).where(Sample.sample_id == sample_id).one_or_none()
+    if sample_record is not None:
+        cache.store(db, cache.SAMPLE, sample_id, sample_record.id)
 
     return sample_record
 
@@ -106,15 +170,91 @@ def delete_sample(db: Session, sample_id: str):
     :rtype: list[models.Sample]
     """
     sample_records = db.query(Sample).where(Sample.sample_id == sample_id).all()
-
     for sample_record in sample_records:
-        db.delete(sample_record)
-    db.commit()
+        db.expunge(sample_record)
+
+    delete_samples(db, [sample_id])
 
     return sample_records
 
 
+def delete_samples(db: Session, sample_ids: list[str]):
+    """
+    Delete all database records for multiple samples, and everything that belongs
+    to them (libraries, profiles, QC, species, AMR and cluster memberships), in one transaction.
+
+    Rows are deleted child tables first, with one statement per table per batch
+    of samples, so this does not rely on the database enforcing `ON DELETE CASCADE`.
+    Clusters themselves are kept, since other samples may belong to them, and
+    their summaries are refreshed.
+
+    The ingest run ledger doesn't record which samples its row hashes belong
+    to, so all successful runs are marked `invalidated` (see `invalidate_ingest_runs`).
+    The next run of each loader then reloads its whole input, including the
+    rows of the deleted samples.
+
+    :param db: Database session
+    :type db: sqlalchemy.orm.Session
+    :param sample_ids: Sample IDs
+    :type sample_ids: list[str]
+    :return: Number of deleted rows, indexed by table name.
+    :rtype: dict[str, int]
+    """
+    sample_ids = sorted(set(sample_ids))
+    sample_pks = []
+    for batch in _batched(sample_ids):
+        stmt = select(Sample.id).where(Sample.sample_id.in_(batch))
+        sample_pks.extend(db.scalars(stmt).all())
+    cluster_ids_by_type = _clusters_for_samples(db, sample_ids)
+    library_ids = []
+    for batch in _batched(sample_pks):
+        stmt = select(Library.id).where(Library.sample_id.in_(batch))
+        library_ids.extend(db.scalars(stmt).all())
+
+    deleted_counts = {}
+
+    def _delete(table, where_clause):
+        result = db.execute(delete(table).where(where_clause))
+        deleted_counts[table.name] = deleted_counts.get(table.name, 0) + result.rowcount
+
+    for batch in _batched(sample_pks):
+        library_ids_stmt = select(Library.id).where(Library.sample_id.in_(batch))
+        amr_ids = select(AmrProfile.id).where(AmrProfile.library_id.in_(library_ids_stmt))
+        _delete(DrugMutationProfile.__table__, DrugMutationProfile.amr_id.in_(amr_ids))
+        for model in [AmrProfile, TbSpecies, TbComplex, CgmlstAlleleProfile]:
+            _delete(model.__table__, model.library_id.in_(library_ids_stmt))
+        _delete(association_table_cgmlst, association_table_cgmlst.c.library_id.in_(library_ids_stmt))
+        _delete(CgmlstClusterAssignment.__table__, CgmlstClusterAssignment.library_id.in_(library_ids_stmt))
+        _delete(CgmlstClusterCode.__table__, CgmlstClusterCode.library_id.in_(library_ids_stmt))
+        _delete(Library.__table__, Library.sample_id.in_(batch))
+        _delete(MiruProfile.__table__, MiruProfile.sample_id.in_(batch))
+        _delete(association_table_miru, association_table_miru.c.sample_id.in_(batch))
+        _delete(Sample.__table__, Sample.id.in_(batch))
+    if sample_pks:
+        invalidate_ingest_runs(db, 'samples deleted')
+    db.commit()
+    cache.invalidate(db, cache.NAMESPACES, sample_ids)
+    allele_matrix.remove_libraries(library_ids)
+    for cluster_type, cluster_ids in cluster_ids_by_type.items():
+        if cluster_ids:
+            refresh_cluster_summaries(db, cluster_type, cluster_ids)
+
+    return deleted_counts
+
+
 ### cgMLST
+def cgmlst_allele_profile_hash(cgmlst_allele_profile: dict[str, object]):
+    """
+    Content hash of a parsed cgMLST allele profile, used to detect changed profiles on re-import.
+
+    :param cgmlst_allele_profile: Dictionary representing a cgMLST allele profile. Must include key `profile`.
+    :type cgmlst_allele_profile: dict[str, object]
+    :return: Hex digest.
+    :rtype: str
+    """
+    return utils.content_hash(cgmlst_allele_profile['profile'])
+
+
 def create_cgmlst_allele_profile(db: Session, scheme: dict, cgmlst_allele_profile: dict[str, object],runid:str):
     """
     Create a single cgMLST allele profile record.
@@ -157,6 +297,7 @@ def create_cgmlst_allele_profile(db: Session, scheme: dict, cgmlst_allele_profil
         library_id = library.id,
         profile = json.dumps(cgmlst_allele_profile['profile']),
         percent_called = cgmlst_allele_profile['percent_called'],
+        profile_hash = cgmlst_allele_profile_hash(cgmlst_allele_profile),
         cgmlst_scheme_id = scheme_ins.id
     )
 
@@ -165,10 +306,12 @@ def create_cgmlst_allele_profile(db: Session, scheme: dict, cgmlst_allele_profil
 
     if existing_profile_for_sample is not None:
 
-        existing_profile_for_sample.percent_called = db_cgmlst_allele_profile.percent_called
-        existing_profile_for_sample.profile = db_cgmlst_allele_profile.profile
-        db.commit()
-        db.refresh(existing_profile_for_sample)
+        if existing_profile_for_sample.profile_hash != db_cgmlst_allele_profile.profile_hash:
+            existing_profile_for_sample.percent_called = db_cgmlst_allele_profile.percent_called
+            existing_profile_for_sample.profile = db_cgmlst_allele_profile.profile
+            existing_profile_for_sample.profile_hash = db_cgmlst_allele_profile.profile_hash
+            db.commit()
+            db.refresh(existing_profile_for_sample)
 
     else:
         db.add(db_cgmlst_allele_profile)
@@ -176,83 +319,175 @@ def create_cgmlst_allele_profile(db: Session, scheme: dict, cgmlst_allele_profil
     
     db.commit()
     db.refresh(db_cgmlst_allele_profile)
+    allele_matrix.update_profiles(
+        scheme_ins.id,
+        {library.id: cgmlst_allele_profile['profile']},
+        {library.id: db_cgmlst_allele_profile.profile_hash},
+    )
 
     return db_cgmlst_allele_profile
 
 
-def create_cgmlst_allele_profiles(db: Session, scheme: dict, cgmlst_allele_profiles: list[dict[str, object]], runs: list[dict[str, str]]):
+def create_cgmlst_allele_profiles(db: Session, scheme: dict, cgmlst_allele_profiles: list[dict[str, object]], runs: list[dict[str, str]], counts: dict = None, cluster_thresholds: list[int] = None):
     """
     Create multiple cgMLST allele profile records.
 
+    Existing profiles are compared by profile hash, fetched in one query per
+    batch of libraries, and only profiles whose hash differs are rewritten.
+    Profiles for samples without a library on their sequencing run are skipped.
+
     :param db: Database session.
     :type db: sqlalchemy.orm.Session
-    :param cgmlst_allele_profiles: List of dictionaries representing cgMLST allele profiles.
+    :param cgmlst_allele_profiles: cgMLST allele profiles, as dicts or `records.CgmlstProfileRecord`.
     :param runs: a list of samples with theirs Sequencing Run ID
     :type runid: list[dict[str,str]], keys: sample ids, value: sequencing run ids
     :type cgmlst_allele_profiles: list[dict[str, object]]
+    :param counts: If given, updated with the numbers of `new`, `updated`, `unchanged` and `skipped` profiles.
+    :type counts: dict
+    :param cluster_thresholds: If given, assign hierarchical cluster codes at these allele distance thresholds to the new and updated profiles (see `tb_db.cluster_codes`).
+    :type cluster_thresholds: list[int]
     :return: Created cgMLST allele profiles.
     :rtype: list[models.CgmlstAlleleProfile]
     """
-    existing_samples = db.query(Sample).all()
-    existing_sample_ids = set([sample.sample_id for sample in existing_samples])
-    existing_schemes = db.query(CgmlstScheme).all()
-    existing_schemes_names = set([s.name for s in existing_schemes])
-
-    if scheme['name'] not in existing_schemes_names:
-        db_scheme = CgmlstScheme(
+    stmt = select(CgmlstScheme).where(CgmlstScheme.name == scheme['name'])
+    scheme_ins = db.scalars(stmt).first()
+    if scheme_ins is None:
+        scheme_ins = CgmlstScheme(
             name = scheme['name'],
             version = scheme['version'],
             num_loci = scheme['num_loci']
         )
-        db.add(db_scheme)
+        db.add(scheme_ins)
         db.commit()
-    stmt = select(CgmlstScheme).where(CgmlstScheme.name == scheme['name'])
-    scheme_ins = db.scalars(stmt).one()
-    db_cgmlst_allele_profiles = []
-    for cgmlst_allele_profile in cgmlst_allele_profiles:
-        sample_id = cgmlst_allele_profile['sample_id']
-        if sample_id not in existing_sample_ids:
-            db_sample = Sample(
-                sample_id = sample_id
-            )
-            db.add(db_sample)
-            db.commit()
-        stmt = select(Sample).where(Sample.sample_id == sample_id)
-        sample = db.scalars(stmt).one()
 
-        library = [lib for lib in sample.library if lib.sequencing_run_id == runs[sample_id]][0]
+    cgmlst_allele_profiles = records.as_records(cgmlst_allele_profiles, records.CgmlstProfileRecord)
+    library_ids_by_sample_id = _get_library_ids_by_sample_id(db, runs, [profile.sample_id for profile in cgmlst_allele_profiles])
 
-        db_cgmlst_allele_profile = CgmlstAlleleProfile(
-            library_id = library.id,
-            profile = json.dumps(cgmlst_allele_profile['profile']),
-            percent_called = cgmlst_allele_profile['percent_called'],
-            cgmlst_scheme_id = scheme_ins.id
+    profiles_by_library_id = {}
+    num_skipped = 0
+    for cgmlst_allele_profile in cgmlst_allele_profiles:
+        sample_id = cgmlst_allele_profile.sample_id
+        library_id = library_ids_by_sample_id.get(sample_id)
+        if library_id is None:
+            logging.warning('cannot add cgMLST profile for sample ' + sample_id + ' without a library on its run...')
+            num_skipped += 1
+            continue
+        profiles_by_library_id[library_id] = cgmlst_allele_profile
+
+    existing_by_library_id = {}
+    for batch in _batched(list(profiles_by_library_id)):
+        stmt = (
+            select(CgmlstAlleleProfile.library_id, CgmlstAlleleProfile.profile_hash, CgmlstAlleleProfile.cgmlst_scheme_id)
+            .where(CgmlstAlleleProfile.library_id.in_(batch))
         )
-        
+        for library_id, profile_hash, cgmlst_scheme_id in db.execute(stmt):
+            existing_by_library_id[library_id] = (profile_hash, cgmlst_scheme_id)
+
+    db_profiles_to_insert = []
+    db_profiles_to_update = []
+    num_unchanged = 0
+    profile_hashes_by_library_id = {}
+    for library_id, cgmlst_allele_profile in profiles_by_library_id.items():
+        # Same as `cgmlst_allele_profile_hash`.
+        profile_hash = utils.content_hash(cgmlst_allele_profile.profile)
+        profile_hashes_by_library_id[library_id] = profile_hash
+        if library_id not in existing_by_library_id:
+            db_profiles_to_insert.append({
+                'library_id': library_id,
+                'profile': json.dumps(cgmlst_allele_profile.profile),
+                'profile_hash': profile_hash,
+                'percent_called': cgmlst_allele_profile.percent_called,
+                'cgmlst_scheme_id': scheme_ins.id,
+            })
+        elif existing_by_library_id[library_id] == (profile_hash, scheme_ins.id):
+            num_unchanged += 1
+        else:
+            db_profiles_to_update.append({
+                'b_library_id': library_id,
+                'b_profile': json.dumps(cgmlst_allele_profile.profile),
+                'b_profile_hash': profile_hash,
+                'b_percent_called': cgmlst_allele_profile.percent_called,
+                'b_cgmlst_scheme_id': scheme_ins.id,
+            })
+
+    if db_profiles_to_insert:
+        db.execute(insert(CgmlstAlleleProfile), db_profiles_to_insert)
+    if db_profiles_to_update:
+        cgmlst_allele_profile_table = CgmlstAlleleProfile.__table__
+        stmt = (
+            update(cgmlst_allele_profile_table)
+            .where(cgmlst_allele_profile_table.c.library_id == bindparam('b_library_id'))
+            .values({column[2:]: bindparam(column) for column in db_profiles_to_update[0] if column != 'b_library_id'})
+        )
+        db.execute(stmt, db_profiles_to_update)
+    db.commit()
 
-        select_cgmlst_profile_stmt = select(CgmlstAlleleProfile).where(CgmlstAlleleProfile.library_id == library.id)
-        existing_profile_for_sample = db.scalars(select_cgmlst_profile_stmt).one_or_none()
+    written_library_ids = [db_profile['library_id'] for db_profile in db_profiles_to_insert]
+    written_library_ids += [db_profile['b_library_id'] for db_profile in db_profiles_to_update]
+    allele_matrix.update_profiles(
+        scheme_ins.id,
+        {library_id: profiles_by_library_id[library_id].profile for library_id in written_library_ids},
+        {library_id: profile_hashes_by_library_id[library_id] for library_id in written_library_ids},
+    )
+    if cluster_thresholds is not None:
+        # Imported here, since cluster codes need numpy, which is an optional dependency.
+        import tb_db.cluster_codes as cluster_codes
+        cluster_codes.assign_cluster_codes(db, scheme_ins.id, written_library_ids, cluster_thresholds)
+
+    if counts is not None:
+        counts['new'] = len(db_profiles_to_insert)
+        counts['updated'] = len(db_profiles_to_update)
+        counts['unchanged'] = num_unchanged
+        counts['skipped'] = num_skipped
+
+    created_library_ids = [db_profile['library_id'] for db_profile in db_profiles_to_insert]
+    db_cgmlst_allele_profiles_by_library_id = {}
+    for batch in _batched(created_library_ids):
+        stmt = select(CgmlstAlleleProfile).where(CgmlstAlleleProfile.library_id.in_(batch))
+        for db_cgmlst_allele_profile in db.scalars(stmt):
+            db_cgmlst_allele_profiles_by_library_id[db_cgmlst_allele_profile.library_id] = db_cgmlst_allele_profile
+    db_cgmlst_allele_profiles = [db_cgmlst_allele_profiles_by_library_id[library_id] for library_id in created_library_ids]
 
-        if existing_profile_for_sample is not None:
+    return db_cgmlst_allele_profiles
 
-            existing_profile_for_sample.percent_called = db_cgmlst_allele_profile.percent_called
-            existing_profile_for_sample.profile = db_cgmlst_allele_profile.profile
-            db.commit()
-            db.refresh(existing_profile_for_sample)
 
-        else:
-            db_cgmlst_allele_profiles.append(db_cgmlst_allele_profile)
+### MIRU
+# VNTR locus fields of `records.MiruRecord`, and a getter that reads them all at once.
+_MIRU_VNTR_FIELDS = [field for field in records.MiruRecord.__slots__ if field.startswith('vntr_locus')]
+_get_miru_vntr_values = operator.attrgetter(*_MIRU_VNTR_FIELDS)
 
-    db.add_all(db_cgmlst_allele_profiles)
-    db.commit()
-    
-    for db_cgmlst_allele_profile in db_cgmlst_allele_profiles:
-        db.refresh(db_cgmlst_allele_profile)
 
-    return db_cgmlst_allele_profiles
+def miru_vntr_summary(miru_profile: dict[str, object]):
+    """
+    Summarize the VNTR loci of a parsed MIRU profile.
+
+    :param miru_profile: MIRU profile, as produced by `parsers.parse_miru`, or a dict with the same keys.
+    :type miru_profile: records.MiruRecord|dict[str, object]
+    :return: Percent of VNTR loci called (or None if there are no loci), and the VNTR copy numbers indexed by locus position.
+    :rtype: tuple[float|NoneType, dict[int, str]]
+    """
+    if isinstance(miru_profile, records.MiruRecord):
+        vntr_values = _get_miru_vntr_values(miru_profile)
+        vntr_fields = {k: v for k, v in zip(_MIRU_VNTR_FIELDS, vntr_values) if v is not records.ABSENT}
+    else:
+        vntr_fields = {}
+        for k, v in miru_profile.items():
+            if k is not None:
+                if k.startswith("vntr_locus"):
+                    vntr_fields[k] = v
+
+    num_fields_called = len(list(filter(lambda x: x != '-', vntr_fields.values())))
+    num_fields_total = len(list(vntr_fields.values()))
+    if num_fields_total != 0:
+        percent_called = num_fields_called / num_fields_total * 100.0
+    else:
+        percent_called = None
+
+    profile_by_position = {int(k.split('vntr_locus_position_')[1]): v for k, v in vntr_fields.items()}
+
+    return percent_called, profile_by_position
 
 
-### MIRU
 def create_miru_profile(db: Session, sample_id: str, miru_profile: dict[str, object]):
     """
     Create single MIRU profile record, for sample specified by `sample_id`.
@@ -299,20 +534,7 @@ def create_miru_profile(db: Session, sample_id: str, miru_profile: dict[str, obj
     select_sample_stmt = select(Sample).where(Sample.sample_id == sample_id)
     sample = db.scalars(select_sample_stmt).one()
 
-    vntr_fields = {}
-    for k, v in miru_profile.items():
-        if k is not None:
-            if k.startswith("vntr_locus"):
-                vntr_fields[k] = v
-
-    num_fields_called = len(list(filter(lambda x: x != '-', vntr_fields.values())))
-    num_fields_total = len(list(vntr_fields.values()))
-    if num_fields_total != 0:
-        percent_called = num_fields_called / num_fields_total * 100.0
-    else:
-        percent_called = None
-
-    profile_by_position = {int(k.split('vntr_locus_position_')[1]): v for k, v in vntr_fields.items()}
+    percent_called, profile_by_position = miru_vntr_summary(miru_profile)
 
     db_miru_profile = MiruProfile(
         sample_id = sample.id,
@@ -334,6 +556,8 @@ def create_miru_profile(db: Session, sample_id: str, miru_profile: dict[str, obj
         db.commit()
         db.refresh(db_miru_profile)
         created_miru_profile = db_miru_profile
+    cache.invalidate(db, [cache.MIRU_CLUSTER], [sample_id])
+    refresh_cluster_summaries(db, CLUSTER_TYPE_MIRU, [cluster_id])
 
     return created_miru_profile
 
@@ -344,7 +568,7 @@ def create_miru_profiles(db: Session, miru_profiles_by_sample_id: dict[str, obje
 
     :param db: Database session.
     :type db: sqlalchemy.orm.Session
-    :param miru_profiles_by_sample_id:
+    :param miru_profiles_by_sample_id: MIRU profiles indexed by Sample ID, as dicts or `records.MiruRecord`.
     :type miru_profiles_by_sample_id: dict[str, object]
     :return: Created MIRU profiles.
     :rtype: list[models.MiruProfile]
@@ -358,8 +582,9 @@ def create_miru_profiles(db: Session, miru_profiles_by_sample_id: dict[str, obje
     db_miru_profiles = []
     created_miru_profiles = []
     added_miru_cluster_ids = set()
-    for sample_id, miru_profile in miru_profiles_by_sample_id.items():
-        cluster_id = miru_profile['cluster']
+    miru_profiles = records.as_records(miru_profiles_by_sample_id.values(), records.MiruRecord)
+    for sample_id, miru_profile in zip(miru_profiles_by_sample_id, miru_profiles):
+        cluster_id = miru_profile.cluster
         if (cluster_id not in existing_miru_cluster_ids) and (cluster_id not in added_miru_cluster_ids):
             db_miru_cluster = MiruCluster(
                 cluster_id = cluster_id
@@ -374,8 +599,8 @@ def create_miru_profiles(db: Session, miru_profiles_by_sample_id: dict[str, obje
         if sample_id not in existing_sample_ids:
             db_sample = Sample(
                 sample_id = sample_id,
-                accession = miru_profile['accession'],
-                collection_date = miru_profile['collection_date']
+                accession = None if miru_profile.accession is records.ABSENT else miru_profile.accession,
+                collection_date = None if miru_profile.collection_date is records.ABSENT else miru_profile.collection_date
             )
             db.add(db_sample)
             db.commit()
@@ -387,26 +612,13 @@ def create_miru_profiles(db: Session, miru_profiles_by_sample_id: dict[str, obje
         sample.miru_cluster.append(db_miru_cluster)
 
 
-        vntr_fields = {}
-        for k, v in miru_profile.items():
-            if k is not None:
-                if k.startswith("vntr_locus"):
-                    vntr_fields[k] = v
-
-        num_fields_called = len(list(filter(lambda x: x != '-', vntr_fields.values())))
-        num_fields_total = len(list(vntr_fields.values()))
-        if num_fields_total != 0:
-            percent_called = num_fields_called / num_fields_total * 100.0
-        else:
-            percent_called = None
-
-        profile_by_position = {int(k.split('vntr_locus_position_')[1]): v for k, v in vntr_fields.items()}
+        percent_called, profile_by_position = miru_vntr_summary(miru_profile)
 
         db_miru_profile = MiruProfile(
             sample_id = sample.id,
             percent_called = percent_called,
             profile_by_position = json.dumps(profile_by_position),
-            miru_pattern = miru_profile['miru_pattern']
+            miru_pattern = miru_profile.miru_pattern
         )
         select_miru_profile_stmt = select(MiruProfile).where(MiruProfile.sample_id == sample.id)
         existing_profile_for_sample = db.scalars(select_miru_profile_stmt).one_or_none()
@@ -426,6 +638,8 @@ def create_miru_profiles(db: Session, miru_profiles_by_sample_id: dict[str, obje
     for db_miru_profile in db_miru_profiles:
         db.refresh(db_miru_profile)
         created_miru_profiles.append(db_miru_profile)
+    cache.invalidate(db, [cache.MIRU_CLUSTER], miru_profiles_by_sample_id.keys())
+    refresh_cluster_summaries(db, CLUSTER_TYPE_MIRU, [miru_profile.cluster for miru_profile in miru_profiles])
 
     return created_miru_profiles
 
@@ -441,6 +655,10 @@ def get_miru_cluster_by_sample_id(db: Session, sample_id: str):
     :return: Miru Cluster name for the sample.
     :rtype: str
     """
+    cached_miru_cluster_code = cache.lookup(db, cache.MIRU_CLUSTER, sample_id)
+    if cached_miru_cluster_code is not cache.MISSING:
+        return list(cached_miru_cluster_code)
+
     query_result = db.query(Sample).filter(
         Sample.sample_id == sample_id
     )
@@ -451,6 +669,7 @@ def get_miru_cluster_by_sample_id(db: Session, sample_id: str):
         miru_cluster_id = row.id
         code = db.query(MiruCluster).get(miru_cluster_id).cluster_id
         miru_cluster_code.append(code)
+    cache.store(db, cache.MIRU_CLUSTER, sample_id, list(miru_cluster_code))
 
     return miru_cluster_code
 
@@ -469,6 +688,7 @@ def add_samples_to_cgmlst_clusters(db: Session, cgmlst_cluster: list[dict[str, o
     :return: sample with cgmlst cluster added.
     :rtype: models.Sample
     """
+    cgmlst_cluster = records.as_records(cgmlst_cluster, records.CgmlstClusterRecord)
     existing_samples = db.query(Sample).all()
     existing_sample_ids = set([sample.sample_id for sample in existing_samples])
 
@@ -478,8 +698,8 @@ def add_samples_to_cgmlst_clusters(db: Session, cgmlst_cluster: list[dict[str, o
     db_samples = []
     added_cgmlst_cluster_ids = set()
     for row in cgmlst_cluster:
-        sample_id = row['sample_id']
-        cluster_id = row['cluster']
+        sample_id = row.sample_id
+        cluster_id = row.cluster
         if (cluster_id not in existing_cgmlst_cluster_ids) and (cluster_id not in added_cgmlst_cluster_ids):
             db_cgmlst_cluster = CgmlstCluster(
                 cluster_id = cluster_id
@@ -491,6 +711,8 @@ def add_samples_to_cgmlst_clusters(db: Session, cgmlst_cluster: list[dict[str, o
         db_cgmlst_cluster = db.scalars(select_cgmlst_cluster_stmt).one()
         if sample_id not in existing_sample_ids:
             logging.warning('cannot add cgmlst cluster for a sample that does not exist...')
+            cache.invalidate(db, [cache.CGMLST_CLUSTER], [row.sample_id for row in cgmlst_cluster])
+            refresh_cluster_summaries(db, CLUSTER_TYPE_CGMLST, [row.cluster for row in cgmlst_cluster])
             return None         
         else:
             select_sample_stmt = select(Sample).where(Sample.sample_id == sample_id)
@@ -501,6 +723,8 @@ def add_samples_to_cgmlst_clusters(db: Session, cgmlst_cluster: list[dict[str, o
             
             db_samples.append(library)
             db.commit()
+    cache.invalidate(db, [cache.CGMLST_CLUSTER], [row.sample_id for row in cgmlst_cluster])
+    refresh_cluster_summaries(db, CLUSTER_TYPE_CGMLST, [row.cluster for row in cgmlst_cluster])
 
     return db_samples
 
@@ -546,6 +770,8 @@ def add_sample_to_cgmlst_cluster(db: Session, sample_id: str, cgmlst_cluster: di
         library = [lib for lib in sample.library if lib.sequencing_run_id == runid][0]
         library.cgmlst_cluster.append(db_cgmlst_cluster)
         db.commit()
+        cache.invalidate(db, [cache.CGMLST_CLUSTER], [sample_id])
+        refresh_cluster_summaries(db, CLUSTER_TYPE_CGMLST, [cluster_id])
 
         return sample
 
@@ -561,6 +787,10 @@ def get_cgmlst_cluster_by_sample_id(db: Session, sample_id: str):
     :return: a list of strings of cgmlst clusters this sample belongs to
     :rtype: str
     """
+    cached_cgmlst_cluster_code = cache.lookup(db, cache.CGMLST_CLUSTER, sample_id)
+    if cached_cgmlst_cluster_code is not cache.MISSING:
+        return list(cached_cgmlst_cluster_code)
+
     query_result = db.query(Sample).filter(
         Sample.sample_id == sample_id
     )
@@ -572,212 +802,639 @@ def get_cgmlst_cluster_by_sample_id(db: Session, sample_id: str):
             cgmlst_cluster_id = row.id
             code = db.query(CgmlstCluster).get(cgmlst_cluster_id).cluster_id
             cgmlst_cluster_code.append(code)
+    cache.store(db, cache.CGMLST_CLUSTER, sample_id, list(cgmlst_cluster_code))
 
     return cgmlst_cluster_code
 
+### cgMLST cluster snapshots
+def _get_cgmlst_cluster_ids_by_code(db: Session, cluster_codes):
+    """
+    Look up database IDs for cgMLST clusters, creating clusters that do not exist yet.
+
+    :return: Cluster database IDs, indexed by cluster code.
+    :rtype: dict[str, int]
+    """
+    cluster_codes = sorted(set(cluster_codes))
+
+    ids_by_cluster_code = {}
+    for batch in _batched(cluster_codes):
+        stmt = select(CgmlstCluster.cluster_id, CgmlstCluster.id).where(CgmlstCluster.cluster_id.in_(batch))
+        ids_by_cluster_code.update(db.execute(stmt).all())
+
+    missing_cluster_codes = [code for code in cluster_codes if code not in ids_by_cluster_code]
+    if missing_cluster_codes:
+        db.execute(insert(CgmlstCluster), [{'cluster_id': code} for code in missing_cluster_codes])
+        for batch in _batched(missing_cluster_codes):
+            stmt = select(CgmlstCluster.cluster_id, CgmlstCluster.id).where(CgmlstCluster.cluster_id.in_(batch))
+            ids_by_cluster_code.update(db.execute(stmt).all())
+
+    return ids_by_cluster_code
+
+
+def create_cgmlst_cluster_snapshot(db: Session, snapshot: str, cgmlst_clusters: list[dict[str, object]], runs: dict[str, str]):
+    """
+    Record a full cgMLST clustering under a snapshot label, and make it the
+    current clustering for the samples it contains.
+
+    The snapshot's assignments are kept in `cgmlst_cluster_assignment`, so that
+    snapshots can be compared with `diff_cgmlst_cluster_snapshots`. The current
+    clusters of the samples in the snapshot are replaced; samples that are not
+    in the snapshot keep their current clusters. Loading the same snapshot label
+    again replaces that snapshot.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param snapshot: Snapshot label, e.g. the clustering run ID or date.
+    :type snapshot: str
+    :param cgmlst_clusters: Dicts with keys `sample_id` and `cluster`.
+    :type cgmlst_clusters: list[dict[str, object]]
+    :param runs: Dict with sample ids and their run ids
+    :type runs: dict[str,str]
+    :return: Number of assignments recorded (`assigned`) and of samples skipped because they have no library on their run (`skipped`).
+    :rtype: dict[str, int]
+    """
+    cgmlst_clusters = records.as_records(cgmlst_clusters, records.CgmlstClusterRecord)
+    library_ids_by_sample_id = _get_library_ids_by_sample_id(db, runs, [row.sample_id for row in cgmlst_clusters])
+
+    assignments_by_library_id = {}
+    num_skipped = 0
+    for row in cgmlst_clusters:
+        library_id = library_ids_by_sample_id.get(row.sample_id)
+        if library_id is None:
+            logging.warning('cannot add cgmlst cluster for sample ' + row.sample_id + ' without a library on its run...')
+            num_skipped += 1
+            continue
+        assignments_by_library_id[library_id] = (row.sample_id, row.cluster)
+
+    cluster_ids_by_code = _get_cgmlst_cluster_ids_by_code(db, [cluster for sample_id, cluster in assignments_by_library_id.values()])
+    library_ids = sorted(assignments_by_library_id)
+
+    previous_cluster_codes = set()
+    for batch in _batched(library_ids):
+        stmt = (
+            select(CgmlstCluster.cluster_id)
+            .join(association_table_cgmlst, association_table_cgmlst.c.cgmlst_cluster_id == CgmlstCluster.id)
+            .where(association_table_cgmlst.c.library_id.in_(batch))
+        )
+        previous_cluster_codes.update(db.scalars(stmt))
+
+    stmt = delete(CgmlstClusterAssignment).where(CgmlstClusterAssignment.snapshot == snapshot)
+    db.execute(stmt.execution_options(synchronize_session=False))
+    for batch in _batched(library_ids):
+        db.execute(delete(association_table_cgmlst).where(association_table_cgmlst.c.library_id.in_(batch)))
+
+    created_at = datetime.datetime.now()
+    if library_ids:
+        db.execute(insert(CgmlstClusterAssignment), [
+            {
+                'snapshot': snapshot,
+                'library_id': library_id,
+                'cgmlst_cluster_id': cluster_ids_by_code[assignments_by_library_id[library_id][1]],
+                'created_at': created_at,
+            }
+            for library_id in library_ids
+        ])
+        db.execute(insert(association_table_cgmlst), [
+            {
+                'library_id': library_id,
+                'cgmlst_cluster_id': cluster_ids_by_code[assignments_by_library_id[library_id][1]],
+            }
+            for library_id in library_ids
+        ])
+    db.commit()
+
+    cache.invalidate(db, [cache.CGMLST_CLUSTER], [sample_id for sample_id, cluster in assignments_by_library_id.values()])
+    refresh_cluster_summaries(db, CLUSTER_TYPE_CGMLST, previous_cluster_codes | set(cluster_ids_by_code))
+
+    return {'assigned': len(library_ids), 'skipped': num_skipped}
+
+
+def get_cgmlst_cluster_snapshots(db: Session):
+    """
+    List the recorded cgMLST clustering snapshots.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :return: Dicts with keys `snapshot`, `created_at` and `num_samples`, oldest first.
+    :rtype: list[dict[str, object]]
+    """
+    stmt = (
+        select(
+            CgmlstClusterAssignment.snapshot,
+            func.min(CgmlstClusterAssignment.created_at),
+            func.count(CgmlstClusterAssignment.library_id),
+        )
+        .group_by(CgmlstClusterAssignment.snapshot)
+        .order_by(func.min(CgmlstClusterAssignment.created_at), CgmlstClusterAssignment.snapshot)
+    )
+    snapshots = []
+    for snapshot, created_at, num_samples in db.execute(stmt):
+        snapshots.append({'snapshot': snapshot, 'created_at': created_at, 'num_samples': num_samples})
+
+    return snapshots
+
+
+def diff_cgmlst_cluster_snapshots(db: Session, old_snapshot: str, new_snapshot: str):
+    """
+    Compare two cgMLST clustering snapshots.
+
+    Clusters are matched across snapshots by the samples they share, not by
+    their codes:
+
+    - `new_clusters`: clusters in the new snapshot that share no samples with any old cluster.
+    - `dissolved_clusters`: clusters in the old snapshot that share no samples with any new cluster.
+    - `merged_clusters`: new clusters that contain samples from two or more old clusters.
+    - `split_clusters`: old clusters whose samples are spread over two or more new clusters.
+    - `moved_samples`: samples in both snapshots whose cluster code changed.
+    - `added_samples` and `removed_samples`: samples in only one of the snapshots.
+
+    Sample sets are compared in the database, so only the per-cluster overlap
+    counts and the changed samples are returned to Python.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param old_snapshot: Label of the earlier snapshot.
+    :type old_snapshot: str
+    :param new_snapshot: Label of the later snapshot.
+    :type new_snapshot: str
+    :return: Differences, with the keys listed above. Merged and split clusters map a cluster code to the codes it was formed from or split into.
+    :rtype: dict[str, object]
+    """
+    old = aliased(CgmlstClusterAssignment)
+    new = aliased(CgmlstClusterAssignment)
+    old_cluster = aliased(CgmlstCluster)
+    new_cluster = aliased(CgmlstCluster)
+
+    def _cluster_codes(snapshot):
+        stmt = (
+            select(CgmlstCluster.cluster_id)
+            .join(CgmlstClusterAssignment, CgmlstClusterAssignment.cgmlst_cluster_id == CgmlstCluster.id)
+            .where(CgmlstClusterAssignment.snapshot == snapshot)
+            .distinct()
+        )
+        return set(db.scalars(stmt))
+
+    def _sample_ids(library_ids_stmt):
+        stmt = (
+            select(Sample.sample_id)
+            .join(Library, Library.sample_id == Sample.id)
+            .where(Library.id.in_(library_ids_stmt))
+            .order_by(Sample.sample_id)
+        )
+        return db.scalars(stmt).all()
+
+    def _library_ids(snapshot):
+        return select(CgmlstClusterAssignment.library_id).where(CgmlstClusterAssignment.snapshot == snapshot)
+
+    shared = (
+        select(old_cluster.cluster_id, new_cluster.cluster_id, func.count())
+        .select_from(old)
+        .join(new, and_(new.library_id == old.library_id, new.snapshot == new_snapshot))
+        .join(old_cluster, old_cluster.id == old.cgmlst_cluster_id)
+        .join(new_cluster, new_cluster.id == new.cgmlst_cluster_id)
+        .where(old.snapshot == old_snapshot)
+        .group_by(old_cluster.cluster_id, new_cluster.cluster_id)
+    )
+    new_codes_by_old_code = {}
+    old_codes_by_new_code = {}
+    for old_code, new_code, num_shared in db.execute(shared):
+        new_codes_by_old_code.setdefault(old_code, set()).add(new_code)
+        old_codes_by_new_code.setdefault(new_code, set()).add(old_code)
+
+    moved = (
+        select(Sample.sample_id, old_cluster.cluster_id, new_cluster.cluster_id)
+        .select_from(old)
+        .join(new, and_(new.library_id == old.library_id, new.snapshot == new_snapshot))
+        .join(old_cluster, old_cluster.id == old.cgmlst_cluster_id)
+        .join(new_cluster, new_cluster.id == new.cgmlst_cluster_id)
+        .join(Library, Library.id == old.library_id)
+        .join(Sample, Sample.id == Library.sample_id)
+        .where(and_(old.snapshot == old_snapshot, old_cluster.cluster_id != new_cluster.cluster_id))
+        .order_by(Sample.sample_id)
+    )
+    moved_samples = []
+    for sample_id, old_code, new_code in db.execute(moved):
+        moved_samples.append({'sample_id': sample_id, 'old_cluster_id': old_code, 'new_cluster_id': new_code})
+
+    diff = {
+        'new_clusters': sorted(_cluster_codes(new_snapshot) - set(old_codes_by_new_code)),
+        'dissolved_clusters': sorted(_cluster_codes(old_snapshot) - set(new_codes_by_old_code)),
+        'merged_clusters': {code: sorted(codes) for code, codes in sorted(old_codes_by_new_code.items()) if len(codes) > 1},
+        'split_clusters': {code: sorted(codes) for code, codes in sorted(new_codes_by_old_code.items()) if len(codes) > 1},
+        'moved_samples': moved_samples,
+        'added_samples': _sample_ids(_library_ids(new_snapshot).except_(_library_ids(old_snapshot))),
+        'removed_samples': _sample_ids(_library_ids(old_snapshot).except_(_library_ids(new_snapshot))),
+    }
+
+    return diff
+
+### Cluster summaries
+CLUSTER_TYPE_CGMLST = 'cgmlst'
+CLUSTER_TYPE_MIRU = 'miru'
+
+
+def _cluster_membership_stmt(cluster_type: str):
+    """
+    Query for (cluster code, sample ID, collection date) of every member of every cluster of one type.
+    """
+    if cluster_type == CLUSTER_TYPE_CGMLST:
+        cluster_model = CgmlstCluster
+        stmt = (
+            select(CgmlstCluster.cluster_id, Sample.sample_id, Sample.collection_date)
+            .join(association_table_cgmlst, association_table_cgmlst.c.cgmlst_cluster_id == CgmlstCluster.id)
+            .join(Library, Library.id == association_table_cgmlst.c.library_id)
+            .join(Sample, Sample.id == Library.sample_id)
+        )
+    elif cluster_type == CLUSTER_TYPE_MIRU:
+        cluster_model = MiruCluster
+        stmt = (
+            select(MiruCluster.cluster_id, Sample.sample_id, Sample.collection_date)
+            .join(association_table_miru, association_table_miru.c.miru_cluster_id == MiruCluster.id)
+            .join(Sample, Sample.id == association_table_miru.c.sample_id)
+        )
+    else:
+        raise ValueError('unknown cluster type: ' + str(cluster_type))
+
+    return cluster_model, stmt
+
+
+def refresh_cluster_summaries(db: Session, cluster_type: str, cluster_ids=None):
+    """
+    Recompute the cluster summaries for some or all clusters of one type.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param cluster_type: `cgmlst` or `miru`.
+    :type cluster_type: str
+    :param cluster_ids: Cluster codes to refresh. If None, all summaries of this type are rebuilt. None codes (samples without a cluster) are ignored.
+    :type cluster_ids: Iterable[str]|NoneType
+    :return: Number of cluster summaries written.
+    :rtype: int
+    """
+    cluster_model, membership_stmt = _cluster_membership_stmt(cluster_type)
+
+    if cluster_ids is None:
+        batches = [None]
+    else:
+        batches = list(_batched(sorted(set(cluster_id for cluster_id in cluster_ids if cluster_id is not None))))
+
+    updated_at = datetime.datetime.now()
+    num_written = 0
+    for batch in batches:
+        stmt = membership_stmt
+        delete_stmt = delete(ClusterSummary).where(ClusterSummary.cluster_type == cluster_type)
+        if batch is not None:
+            stmt = stmt.where(cluster_model.cluster_id.in_(batch))
+            delete_stmt = delete_stmt.where(ClusterSummary.cluster_id.in_(batch))
+
+        members_by_cluster_id = {}
+        for cluster_id, sample_id, collection_date in db.execute(stmt):
+            members = members_by_cluster_id.setdefault(cluster_id, {})
+            members[sample_id] = collection_date
+
+        db_cluster_summaries = []
+        for cluster_id, members in members_by_cluster_id.items():
+            collection_dates = [collection_date for collection_date in members.values() if collection_date is not None]
+            db_cluster_summaries.append({
+                'cluster_type': cluster_type,
+                'cluster_id': cluster_id,
+                'num_samples': len(members),
+                'first_collection_date': min(collection_dates) if collection_dates else None,
+                'last_collection_date': max(collection_dates) if collection_dates else None,
+                'sample_ids': sorted(members),
+                'updated_at': updated_at,
+            })
+
+        db.execute(delete_stmt.execution_options(synchronize_session=False))
+        if db_cluster_summaries:
+            db.execute(insert(ClusterSummary), db_cluster_summaries)
+        num_written += len(db_cluster_summaries)
+    db.commit()
+
+    return num_written
+
+
+def _clusters_for_samples(db: Session, sample_ids):
+    """
+    Codes of the cgMLST and MIRU clusters that samples belong to.
+
+    :return: Cluster codes, indexed by cluster type.
+    :rtype: dict[str, set[str]]
+    """
+    cluster_ids_by_type = {}
+    for cluster_type in [CLUSTER_TYPE_CGMLST, CLUSTER_TYPE_MIRU]:
+        cluster_model, membership_stmt = _cluster_membership_stmt(cluster_type)
+        cluster_ids = set()
+        for batch in _batched(sorted(set(sample_ids))):
+            stmt = membership_stmt.where(Sample.sample_id.in_(batch))
+            cluster_ids.update(cluster_id for cluster_id, sample_id, collection_date in db.execute(stmt))
+        cluster_ids_by_type[cluster_type] = cluster_ids
+
+    return cluster_ids_by_type
+
+
+def get_cluster_summaries(db: Session, cluster_type: str = None, cluster_ids=None):
+    """
+    Get cluster summaries: each cluster's size, first and last collection date, and member sample IDs.
+
+    Summaries are kept up to date by the functions that add samples to clusters
+    or delete samples. Use `refresh_cluster_summaries` to build them for data
+    that was loaded before they existed.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param cluster_type: `cgmlst` or `miru`. If None, summaries of both types are returned.
+    :type cluster_type: str
+    :param cluster_ids: Only return summaries for these cluster codes.
+    :type cluster_ids: list[str]
+    :return: Cluster summaries, ordered by cluster type and cluster code.
+    :rtype: list[models.ClusterSummary]
+    """
+    stmt = select(ClusterSummary)
+    if cluster_type is not None:
+        stmt = stmt.where(ClusterSummary.cluster_type == cluster_type)
+    if cluster_ids is not None:
+        stmt = stmt.where(ClusterSummary.cluster_id.in_(set(cluster_ids)))
+    stmt = stmt.order_by(ClusterSummary.cluster_type, ClusterSummary.cluster_id)
+
+    cluster_summaries = db.scalars(stmt).all()
+
+    return cluster_summaries
+
+
+def get_cluster_sample_ids(db: Session, cluster_type: str, cluster_id: str):
+    """
+    Get the current members of one cluster.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param cluster_type: `cgmlst` or `miru`.
+    :type cluster_type: str
+    :param cluster_id: Cluster code.
+    :type cluster_id: str
+    :return: Sample IDs of the cluster's members, sorted.
+    :rtype: list[str]
+    """
+    cluster_model, membership_stmt = _cluster_membership_stmt(cluster_type)
+    stmt = membership_stmt.where(cluster_model.cluster_id == cluster_id)
+    sample_ids = sorted(set(sample_id for code, sample_id, collection_date in db.execute(stmt)))
+
+    return sample_ids
+
+# QC fields that identify a distinct library for a sample on a sequencing run,
+# with the type each value is normalized to before hashing.
+LIBRARY_QC_FIELDS = [
+    ('sample_name', str),
+    ('most_abundant_species_name', str),
+    ('most_abundant_species_fraction_total_reads', float),
+    ('estimated_genome_size_bp', int),
+    ('estimated_depth_coverage', float),
+    ('total_bases', int),
+    ('average_base_quality', float),
+    ('percent_bases_above_q30', float),
+    ('percent_gc', float),
+]
+
+
+def library_qc_hash(library):
+    """
+    Hash the QC fields of a library, for duplicate detection.
+
+    :param library: Library, with the fields in `LIBRARY_QC_FIELDS` as attributes.
+    :type library: records.LibraryRecord|models.Library
+    :return: Hex digest of the normalized QC fields.
+    :rtype: str
+    """
+    qc = []
+    for field, field_type in LIBRARY_QC_FIELDS:
+        value = getattr(library, field)
+        if value is not None:
+            value = field_type(value)
+        qc.append(value)
+
+    return utils.content_hash(qc)
+
+
+def _get_sample_ids_by_sample_id(db: Session, sample_ids, create_missing=False):
+    """
+    Look up database IDs for samples, in one query per batch.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param sample_ids: Sample IDs to look up.
+    :type sample_ids: Iterable[str]
+    :param create_missing: Insert samples that do not exist yet.
+    :type create_missing: bool
+    :return: Sample database IDs, indexed by Sample ID.
+    :rtype: dict[str, int]
+    """
+    sample_ids = sorted(set(sample_ids))
+
+    ids_by_sample_id = {}
+    for batch in _batched(sample_ids):
+        stmt = select(Sample.sample_id, Sample.id).where(Sample.sample_id.in_(batch))
+        ids_by_sample_id.update(db.execute(stmt).all())
+
+    missing_sample_ids = [sample_id for sample_id in sample_ids if sample_id not in ids_by_sample_id]
+    if create_missing and missing_sample_ids:
+        db.execute(insert(Sample), [{'sample_id': sample_id} for sample_id in missing_sample_ids])
+        for batch in _batched(missing_sample_ids):
+            stmt = select(Sample.sample_id, Sample.id).where(Sample.sample_id.in_(batch))
+            ids_by_sample_id.update(db.execute(stmt).all())
+
+    return ids_by_sample_id
+
+
 def create_libraries(db:Session, libraries: dict[str, object]):
     """
     Create/add libraries tables
 
+    A library is only created if no library with the same QC hash exists for the
+    sample on the same sequencing run. All new libraries are inserted in one batch.
+
     :param db: Database session.
     :type db: sqlalchemy.orm.Session
-    :param libraries: str representing sample id.
+    :param libraries: Libraries with their QC, as dicts or `records.LibraryRecord`.
     :type libraries: dict[str,object], dictionaries representing sample qc, keys:sample_id,sample_name,sequencing_run_id,most_abundant_species_name,most_abundant_species_fraction_total_reads,estimated_genome_size_bp...
     :return: created libraries object
-    :rtype: models.Library
+    :rtype: list[models.Library]
     """
-    existing_samples = db.query(Sample).all()
-    existing_sample_ids = set([sample.sample_id for sample in existing_samples])
-
+    libraries = records.as_records(libraries, records.LibraryRecord)
+    ids_by_sample_id = _get_sample_ids_by_sample_id(db, [row.sample_id for row in libraries], create_missing=True)
+
+    existing_library_keys = set()
+    sample_db_ids = list(set(ids_by_sample_id.values()))
+    for batch in _batched(sample_db_ids):
+        stmt = select(Library).where(and_(Library.sample_id.in_(batch), Library.qc_hash == None))
+        for db_library in db.scalars(stmt):
+            db_library.qc_hash = library_qc_hash(db_library)
+        stmt = select(Library.sample_id, Library.sequencing_run_id, Library.qc_hash).where(Library.sample_id.in_(batch))
+        existing_library_keys.update(db.execute(stmt).all())
 
     db_created_libraries = []
-
     for row in libraries:
-        sample_id = row['sample_id']
+        sample_id = row.sample_id
+        qc_hash = library_qc_hash(row)
+        library_key = (ids_by_sample_id[sample_id], row.sequencing_run_id, qc_hash)
+        if library_key in existing_library_keys:
+            logging.debug('qc for sample ' + sample_id + ' already exists in the database..')
+            continue
+        existing_library_keys.add(library_key)
+        library_created = Library(
+            sample_id = ids_by_sample_id[sample_id],
+            sample_name = row.sample_name,
+            sequencing_run_id = row.sequencing_run_id,
+            most_abundant_species_name = row.most_abundant_species_name,
+            most_abundant_species_fraction_total_reads = row.most_abundant_species_fraction_total_reads,
+            estimated_genome_size_bp = row.estimated_genome_size_bp,
+            estimated_depth_coverage = row.estimated_depth_coverage,
+            total_bases = row.total_bases,
+            average_base_quality = row.average_base_quality,
+            percent_bases_above_q30 = row.percent_bases_above_q30,
+            percent_gc = row.percent_gc,
+            qc_hash = qc_hash,
+        )
+        db_created_libraries.append(library_created)
 
-        if sample_id not in existing_sample_ids:
-            db_sample = Sample(
-                sample_id = sample_id
-            )
-            db.add(db_sample)
-            db.commit()
-        stmt = select(Sample).where(Sample.sample_id == sample_id)
-        sample = db.scalars(stmt).one()
-        stmt = select(Library).where(Library.sample_id == sample.id) 
-        db_libraries = db.scalars(stmt).fetchmany()
-
-        if not db_libraries:
-            library_created = Library(
-                    sample_id = sample.id,
-                    sample_name = row['sample_name'],
-                    sequencing_run_id = row['sequencing_run_id'],
-                    most_abundant_species_name = row['most_abundant_species_name'],
-                    most_abundant_species_fraction_total_reads = row['most_abundant_species_fraction_total_reads'],
-                    estimated_genome_size_bp = row['estimated_genome_size_bp'],
-                    estimated_depth_coverage = row['estimated_depth_coverage'],
-                    total_bases = row['total_bases'],
-                    average_base_quality = row['average_base_quality'],
-                    percent_bases_above_q30 = row['percent_bases_above_q30'],
-                    percent_gc = row['percent_gc']
+    db.add_all(db_created_libraries)
+    db.flush()
+    created_library_ids = [db_created_library.id for db_created_library in db_created_libraries]
+    db.commit()
 
-                )
-            db_created_libraries.append(library_created)
-            db.add_all(db_created_libraries)
-            db.commit()  
-            for db_created_library in db_created_libraries:
-                db.refresh(db_created_library)
-
-        else:   
-            for i in db_libraries:
-                libraries_json = {}
-                libraries_json['sample_id'] = sample_id
-                libraries_json['sample_name'] = i.sample_name
-                libraries_json['sequencing_run_id'] = i.sequencing_run_id
-                libraries_json['most_abundant_species_name'] = i.most_abundant_species_name
-                libraries_json['most_abundant_species_fraction_total_reads'] = i.most_abundant_species_fraction_total_reads
-                libraries_json['estimated_genome_size_bp'] = i.estimated_genome_size_bp
-                libraries_json['estimated_depth_coverage'] = i.estimated_depth_coverage
-                libraries_json['total_bases'] = i.total_bases
-                libraries_json['average_base_quality'] = i.average_base_quality
-                libraries_json['percent_bases_above_q30'] = i.percent_bases_above_q30
-                libraries_json['percent_gc'] = i.percent_gc
-                
-                if row != libraries_json: #only add if different from what is in the db
-                    library_created = Library(
-                        sample_id = sample.id,
-                        sample_name = row['sample_name'],
-                        sequencing_run_id = row['sequencing_run_id'],
-                        most_abundant_species_name = row['most_abundant_species_name'],
-                        most_abundant_species_fraction_total_reads = row['most_abundant_species_fraction_total_reads'],
-                        estimated_genome_size_bp = row['estimated_genome_size_bp'],
-                        estimated_depth_coverage = row['estimated_depth_coverage'],
-                        total_bases = row['total_bases'],
-                        average_base_quality = row['average_base_quality'],
-                        percent_bases_above_q30 = row['percent_bases_above_q30'],
-                        percent_gc = row['percent_gc'],
-
-                    )
-                    db_created_libraries.append(library_created)
-                    db.add_all(db_created_libraries)
-                    db.commit()  
-                    for db_created_library in db_created_libraries:
-                        db.refresh(db_created_library)
-                else:
-                    print("qc for sample "+ sample_id, " already exists in the database..")
+    # Reload all created libraries with one query per batch, rather than one refresh per library.
+    for batch in _batched(created_library_ids):
+        db.scalars(select(Library).where(Library.id.in_(batch))).all()
 
     return db_created_libraries
 
 def create_complexes(db: Session, complexes: list[dict[str, object]], runs:dict[str,str]):
     """
-    Create multiple tb complexes assignment table.
+    Create or update multiple tb complexes assignment table.
+
+    Libraries for the whole input are resolved with one query. New complexes are
+    then inserted, and existing ones updated, with one statement each.
 
     :param db: Database session.
     :type db: sqlalchemy.orm.Session
-    :param complexes: List of dictionaries designating MTBC complex, NTM or non-mycobacteria.
+    :param complexes: MTBC complex, NTM or non-mycobacteria assignments, as dicts or `records.ComplexRecord`.
     :type complexes: list[dict[str, object]]
-    :return: Created tb complexes.
-    :rtype: list[models.TbComplex]
+    :param runs: Dict with sample ids and their run ids
+    :type runs: dict[str,str]
+    :return: Outcome for each input row, in input order. Each outcome has keys `sample_id`, `library_id`
+             and `outcome`, which is one of `created`, `updated`, `duplicate` (superseded by a later row
+             for the same library) or `no_library`.
+    :rtype: list[dict[str, object]]
     """
-    existing_samples = db.query(Sample).all()
-    existing_sample_ids = set([sample.sample_id for sample in existing_samples])
+    complexes = records.as_records(complexes, records.ComplexRecord)
+    library_ids_by_sample_id = _get_library_ids_by_sample_id(db, runs, [complex.sample_id for complex in complexes])
 
-    db_complexes = []
-    for complex in complexes:
-        sample_id = complex['sample_id']
-        if sample_id not in existing_sample_ids:
-            db_sample = Sample(
-                sample_id = sample_id
-            )
-            db.add(db_sample)
-            db.commit()
-        stmt = select(Sample).where(Sample.sample_id == sample_id)
-        sample = db.scalars(stmt).one()
-        library = [lib for lib in sample.library if lib.sequencing_run_id == runs[sample_id]][0]
-
-        db_complex = library.tb_complex
-
-        if db_complex:
-            db_complex.library_id = library.id
-            db_complex.mtbc_prop = complex['mtbc_prop']
-            db_complex.ntm_prop = complex['ntm_prop']
-            db_complex.nonmycobacterium_prop = complex['nonmycobacterium_prop']
-            db_complex.unclassified_prop = complex['unclassified_prop']
-            db_complex.complex = complex['complex']
-            db_complex.reason = complex['reason']
-            db_complex.flag = complex['flag']
-            db.commit()
+    existing_complex_library_ids = set()
+    for batch in _batched(list(set(library_ids_by_sample_id.values()))):
+        stmt = select(TbComplex.library_id).where(TbComplex.library_id.in_(batch))
+        existing_complex_library_ids.update(db.scalars(stmt).all())
 
+    outcomes = []
+    complexes_by_library_id = {}
+    for complex in complexes:
+        sample_id = complex.sample_id
+        library_id = library_ids_by_sample_id.get(sample_id)
+        outcome = {
+            'sample_id': sample_id,
+            'library_id': library_id,
+        }
+        outcomes.append(outcome)
+        if library_id is None:
+            logging.warning('cannot add complex for sample ' + sample_id + ' without a library on its run...')
+            outcome['outcome'] = 'no_library'
+            continue
+        if library_id in complexes_by_library_id:
+            complexes_by_library_id[library_id][0]['outcome'] = 'duplicate'
+        if library_id in existing_complex_library_ids:
+            outcome['outcome'] = 'updated'
         else:
-            db_tb_complex = TbComplex(
-                library_id = library.id,
-                mtbc_prop = complex['mtbc_prop'],
-                ntm_prop = complex['ntm_prop'],
-                nonmycobacterium_prop = complex['nonmycobacterium_prop'],
-                unclassified_prop = complex['unclassified_prop'],
-                complex = complex['complex'],
-                reason = complex['reason'],
-                flag = complex['flag'],
-
-            )
-            db_complexes.append(db_tb_complex)
-            library.tb_complex.append(db_tb_complex)
-
-    db.add_all(db_complexes)
+            outcome['outcome'] = 'created'
+        complexes_by_library_id[library_id] = (outcome, {
+            'mtbc_prop': complex.mtbc_prop,
+            'ntm_prop': complex.ntm_prop,
+            'nonmycobacterium_prop': complex.nonmycobacterium_prop,
+            'unclassified_prop': complex.unclassified_prop,
+            'complex': complex.complex,
+            'reason': complex.reason,
+            'flag': complex.flag,
+        })
+
+    db_complexes_to_insert = []
+    db_complexes_to_update = []
+    for library_id, (outcome, db_complex) in complexes_by_library_id.items():
+        if library_id in existing_complex_library_ids:
+            db_complex = {'b_' + column: value for column, value in db_complex.items()}
+            db_complex['b_library_id'] = library_id
+            db_complexes_to_update.append(db_complex)
+        else:
+            db_complex['library_id'] = library_id
+            db_complexes_to_insert.append(db_complex)
+
+    if db_complexes_to_insert:
+        db.execute(insert(TbComplex), db_complexes_to_insert)
+    if db_complexes_to_update:
+        tb_complex_table = TbComplex.__table__
+        stmt = (
+            update(tb_complex_table)
+            .where(tb_complex_table.c.library_id == bindparam('b_library_id'))
+            .values({column[2:]: bindparam(column) for column in db_complexes_to_update[0] if column != 'b_library_id'})
+        )
+        db.execute(stmt, db_complexes_to_update)
     db.commit()
 
-    return db_complexes
+    return outcomes
 
 def create_species(db: Session, species: list[dict[str, object]],runs:dict[str,str]):
     """
     Create multiple tb species table.
 
+    Species rows may belong to any number of samples. The existing species
+    for each library are replaced by the incoming rows, one batch of libraries
+    at a time, and everything is committed once at the end.
+
     :param db: Database session.
     :type db: sqlalchemy.orm.Session
-    :param species: List of dictionaries designating MTBC complex, NTM or non-mycobacteria.
+    :param species: Species assignments, as dicts or `records.SpeciesRecord`.
     :type species: list[dict[str, object]]
+    :param runs: Dict with sample ids and their run ids
+    :type runs: dict[str,str]
     :return: Created tb species.
     :rtype: list[models.TbSpecies]
     """
-    existing_samples = db.query(Sample).all()
-    existing_sample_ids = set([sample.sample_id for sample in existing_samples])
-    sample_id = species[0]['sample_id']
-    stmt = select(Sample).where(Sample.sample_id == sample_id)
-    sample = db.scalars(stmt).one()
-    library = [lib for lib in sample.library if lib.sequencing_run_id == runs[sample_id]][0]
+    species = records.as_records(species, records.SpeciesRecord)
+    library_ids_by_sample_id = _get_library_ids_by_sample_id(db, runs, [row.sample_id for row in species])
+
+    species_by_library_id = {}
+    for row in species:
+        sample_id = row.sample_id
+        library_id = library_ids_by_sample_id.get(sample_id)
+        if library_id is None:
+            logging.warning('cannot add species for sample ' + sample_id + ' without a library on its run...')
+            continue
+        species_by_library_id.setdefault(library_id, []).append({
+            'library_id': library_id,
+            'taxonomy_level': row.taxonomy_level,
+            'species_name': row.name,
+            'ncbi_taxonomy_id': row.ncbi_taxonomy_id,
+            'fraction_total_reads': row.fraction_total_reads,
+            'num_assigned_reads': row.num_assigned_reads,
+        })
+
+    library_ids = list(species_by_library_id.keys())
+    for batch in _batched(library_ids):
+        db.execute(delete(TbSpecies).where(TbSpecies.library_id.in_(batch)))
+        db_species = [speci for library_id in batch for speci in species_by_library_id[library_id]]
+        db.execute(insert(TbSpecies), db_species)
+    db.commit()
 
-    db_species = library.tb_species
-    
     db_created_species = []
-
-    if db_species: #if top5 species already exist, update
-        for i in range((len(species))):
-            print(i)
-            db_species[i].library_id = library.id
-            db_species[i].taxonomy_level = species[i]['taxonomy_level']
-            db_species[i].species_name = species[i]['name']
-            db_species[i].ncbi_taxonomy_id = species[i]['ncbi_taxonomy_id']
-            db_species[i].fraction_total_reads = species[i]['fraction_total_reads']
-            db_species[i].num_assigned_reads = species[i]['num_assigned_reads']
-            db.commit()
-    else:
-
-        for row in species:    
-            speci_created = TbSpecies(
-                    library_id = library.id,
-                
-                    taxonomy_level = row['taxonomy_level'],
-                    species_name = row['name'],
-                    ncbi_taxonomy_id = row['ncbi_taxonomy_id'],
-                    fraction_total_reads = row['fraction_total_reads'],
-                    num_assigned_reads = row['num_assigned_reads']
-                )
-            db_created_species.append(speci_created)
-        
-        db.add_all(db_created_species)
-
-        for ds in db_created_species:
-            library.tb_species.append(ds)
-        db.commit()
+    for batch in _batched(library_ids):
+        stmt = select(TbSpecies).where(TbSpecies.library_id.in_(batch)).order_by(TbSpecies.id)
+        db_created_species.extend(db.scalars(stmt).all())
 
     return db_created_species
 
@@ -865,4 +1522,196 @@ def create_amr_summary(db: Session, amr_report: list[dict[str, object]], runs:di
 
 
     
-    
\ No newline at end of file
+    
+
+
+### Resistance matrix
+def get_resistance_matrix(db: Session, sample_ids=None, date_range=None):
+    """
+    Build a sample by drug resistance matrix from the AMR profiles, using each
+    sample's most recent library with an AMR profile.
+
+    Mutations are counted per library and drug in one aggregate query, whose
+    rows are streamed and pivoted into a NumPy array.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param sample_ids: Only include these samples. If None, every sample with an AMR profile.
+    :type sample_ids: Iterable[str]|NoneType
+    :param date_range: Only include samples collected from the first to the last date (inclusive). Either date may be None for an open range.
+    :type date_range: tuple[datetime.date, datetime.date]|NoneType
+    :return: Dict with keys `sample_ids` (sorted), `collection_dates`, `drugs` (sorted) and `matrix`, the number of resistance mutations of each sample (row) to each drug (column). Samples without resistance mutations have a row of zeros.
+    :rtype: dict[str, object]
+    """
+    # Imported here, since numpy is an optional dependency.
+    import numpy as np
+
+    stmt = (
+        select(Sample.sample_id, Sample.collection_date, AmrProfile.library_id, Drug.drug_id, func.count(DrugMutationProfile.id))
+        .join(Library, Library.sample_id == Sample.id)
+        .join(AmrProfile, AmrProfile.library_id == Library.id)
+        .outerjoin(DrugMutationProfile, DrugMutationProfile.amr_id == AmrProfile.id)
+        .outerjoin(Drug, Drug.id == DrugMutationProfile.drug)
+        .group_by(Sample.sample_id, Sample.collection_date, AmrProfile.library_id, Drug.drug_id)
+    )
+    if date_range is not None:
+        first_date, last_date = date_range
+        if first_date is not None:
+            stmt = stmt.where(Sample.collection_date >= first_date)
+        if last_date is not None:
+            stmt = stmt.where(Sample.collection_date <= last_date)
+    if sample_ids is None:
+        batches = [None]
+    else:
+        batches = list(_batched(sorted(set(sample_ids))))
+
+    row_sample_ids = []
+    row_library_ids = []
+    row_drugs = []
+    row_counts = []
+    collection_dates_by_sample_id = {}
+    for batch in batches:
+        batch_stmt = stmt if batch is None else stmt.where(Sample.sample_id.in_(batch))
+        result = db.execute(batch_stmt.execution_options(yield_per=BULK_BATCH_SIZE))
+        for partition in result.partitions():
+            for sample_id, collection_date, library_id, drug_id, count in partition:
+                row_sample_ids.append(sample_id)
+                row_library_ids.append(library_id)
+                row_drugs.append(drug_id)
+                row_counts.append(count)
+                collection_dates_by_sample_id[sample_id] = collection_date
+
+    matrix_sample_ids = sorted(collection_dates_by_sample_id)
+    if not row_sample_ids:
+        return {'sample_ids': [], 'collection_dates': [], 'drugs': [], 'matrix': np.zeros((0, 0), dtype=np.int32)}
+
+    sample_index = np.searchsorted(np.array(matrix_sample_ids), np.array(row_sample_ids))
+    library_ids = np.array(row_library_ids, dtype=np.int64)
+    latest_library_ids = np.full(len(matrix_sample_ids), -1, dtype=np.int64)
+    np.maximum.at(latest_library_ids, sample_index, library_ids)
+    # Rows without a drug are AMR profiles without resistance mutations.
+    keep = (library_ids == latest_library_ids[sample_index]) & np.array([drug_id is not None for drug_id in row_drugs], dtype=bool)
+
+    drugs = sorted(set(drug_id for drug_id, is_kept in zip(row_drugs, keep) if is_kept))
+    matrix = np.zeros((len(matrix_sample_ids), len(drugs)), dtype=np.int32)
+    if drugs:
+        kept_rows = np.nonzero(keep)[0]
+        drug_index = np.searchsorted(np.array(drugs), np.array([row_drugs[i] for i in kept_rows]))
+        np.add.at(matrix, (sample_index[kept_rows], drug_index), np.array(row_counts, dtype=np.int32)[kept_rows])
+
+    resistance_matrix = {
+        'sample_ids': matrix_sample_ids,
+        'collection_dates': [collection_dates_by_sample_id[sample_id] for sample_id in matrix_sample_ids],
+        'drugs': drugs,
+        'matrix': matrix,
+    }
+
+    return resistance_matrix
+
+
+def resistance_prevalence_by_quarter(resistance_matrix: dict[str, object]):
+    """
+    Roll a resistance matrix up into the prevalence of resistance to each drug
+    per quarter of collection date. Samples without a collection date are left out.
+
+    :param resistance_matrix: Resistance matrix, as returned by `get_resistance_matrix`.
+    :type resistance_matrix: dict[str, object]
+    :return: Dicts with keys `quarter` (e.g. `2022Q1`), `drug`, `num_samples` (profiled in the quarter), `num_resistant` and `prevalence`, ordered by quarter and drug.
+    :rtype: list[dict[str, object]]
+    """
+    import numpy as np
+
+    dated = [i for i, collection_date in enumerate(resistance_matrix['collection_dates']) if collection_date is not None]
+    if not dated:
+        return []
+    quarter_labels = [
+        str(collection_date.year) + 'Q' + str((collection_date.month - 1) // 3 + 1)
+        for collection_date in (resistance_matrix['collection_dates'][i] for i in dated)
+    ]
+    quarters, quarter_index = np.unique(np.array(quarter_labels), return_inverse=True)
+    num_samples = np.bincount(quarter_index, minlength=len(quarters))
+    num_resistant = np.zeros((len(quarters), len(resistance_matrix['drugs'])), dtype=np.int64)
+    np.add.at(num_resistant, quarter_index, resistance_matrix['matrix'][dated] > 0)
+
+    prevalence = []
+    for q, quarter in enumerate(quarters):
+        for d, drug in enumerate(resistance_matrix['drugs']):
+            prevalence.append({
+                'quarter': str(quarter),
+                'drug': drug,
+                'num_samples': int(num_samples[q]),
+                'num_resistant': int(num_resistant[q, d]),
+                'prevalence': float(num_resistant[q, d] / num_samples[q]),
+            })
+
+    return prevalence
+
+
+### Ingest runs
+def get_latest_ingest_run(db: Session, loader: str, input_path: str = None, content_hash: str = None, outcome: str = 'success'):
+    """
+    Get the most recent ingest run for a loader, optionally for a given input path or content hash.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param loader: Loader name, e.g. `load_samples`.
+    :type loader: str
+    :param input_path: Input file path.
+    :type input_path: str
+    :param content_hash: Content hash of the input file.
+    :type content_hash: str
+    :param outcome: Only consider runs with this outcome. If None, consider all runs.
+    :type outcome: str
+    :return: Most recent matching ingest run.
+    :rtype: models.IngestRun|NoneType
+    """
+    stmt = select(IngestRun).where(IngestRun.loader == loader)
+    if input_path is not None:
+        stmt = stmt.where(IngestRun.input_path == input_path)
+    if content_hash is not None:
+        stmt = stmt.where(IngestRun.content_hash == content_hash)
+    if outcome is not None:
+        stmt = stmt.where(IngestRun.outcome == outcome)
+    stmt = stmt.order_by(IngestRun.id.desc()).limit(1)
+
+    ingest_run = db.scalars(stmt).one_or_none()
+
+    return ingest_run
+
+
+def invalidate_ingest_runs(db: Session, message: str):
+    """
+    Mark all successful ingest runs as `invalidated`, so that no later run is
+    skipped or reduced to changed rows because of them. Use this whenever rows
+    loaded by earlier runs are removed from the database. The change is not committed.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param message: Reason, stored as the message of the invalidated runs.
+    :type message: str
+    :return: Number of invalidated runs.
+    :rtype: int
+    """
+    stmt = update(IngestRun).where(IngestRun.outcome == 'success').values(outcome='invalidated', message=message)
+    result = db.execute(stmt)
+
+    return result.rowcount
+
+
+def create_ingest_run(db: Session, ingest_run: dict[str, object]):
+    """
+    Record an ingest run.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param ingest_run: Dict representing an ingest run, with keys matching the columns of `models.IngestRun`.
+    :type ingest_run: dict[str, object]
+    :return: Created ingest run.
+    :rtype: models.IngestRun
+    """
+    db_ingest_run = IngestRun(**ingest_run)
+    db.add(db_ingest_run)
+    db.commit()
+    db.refresh(db_ingest_run)
+
+    return db_ingest_run
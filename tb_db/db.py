@@ -0,0 +1,146 @@
+import contextlib
+import json
+import logging
+
+from sqlalchemy import create_engine
+from sqlalchemy import event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import NullPool
+
+# Defaults used for server databases (PostgreSQL) when the config does not override them.
+DEFAULT_POOL_SIZE = 5
+DEFAULT_MAX_OVERFLOW = 10
+DEFAULT_POOL_TIMEOUT_SECONDS = 30
+DEFAULT_POOL_RECYCLE_SECONDS = 1800
+DEFAULT_EXECUTEMANY_PAGE_SIZE = 1000
+
+_engines_by_connection_uri = {}
+
+
+def load_config(config_path: str):
+    """
+    Load a JSON config file.
+
+    :param config_path: Path to config file (JSON format).
+    :type config_path: str
+    :return: Parsed config.
+    :rtype: dict[str, object]
+    """
+    with open(config_path, 'r') as f:
+        config = json.load(f)
+
+    return config
+
+
+def _engine_options(config: dict[str, object]):
+    """
+    Build the keyword arguments for `sqlalchemy.create_engine` from a config.
+
+    Recognized (optional) config keys, besides `connection_uri`:
+
+    - `pool`: dict with any of `size`, `max_overflow`, `timeout`, `recycle` and `pre_ping`.
+    - `statement_timeout_ms`: Server-side statement timeout (PostgreSQL only).
+    - `executemany_page_size`: Rows per page for psycopg2 fast executemany.
+    - `pgbouncer`: If true, don't keep a client-side pool (PgBouncer does the pooling),
+      and don't send session-level startup options, which PgBouncer rejects.
+
+    :param config: Config, as loaded by `load_config`.
+    :type config: dict[str, object]
+    :return: Keyword arguments for `create_engine`.
+    :rtype: dict[str, object]
+    """
+    url = make_url(config['connection_uri'])
+    pool_config = config.get('pool', {})
+    options = {}
+
+    if url.get_backend_name() == 'sqlite':
+        return options
+
+    options['pool_pre_ping'] = pool_config.get('pre_ping', True)
+    if config.get('pgbouncer', False):
+        options['poolclass'] = NullPool
+    else:
+        options['pool_size'] = pool_config.get('size', DEFAULT_POOL_SIZE)
+        options['max_overflow'] = pool_config.get('max_overflow', DEFAULT_MAX_OVERFLOW)
+        options['pool_timeout'] = pool_config.get('timeout', DEFAULT_POOL_TIMEOUT_SECONDS)
+        options['pool_recycle'] = pool_config.get('recycle', DEFAULT_POOL_RECYCLE_SECONDS)
+
+    if url.get_backend_name() == 'postgresql' and url.get_driver_name() in ('', 'psycopg2'):
+        page_size = config.get('executemany_page_size', DEFAULT_EXECUTEMANY_PAGE_SIZE)
+        options['executemany_mode'] = 'values_plus_batch'
+        options['executemany_values_page_size'] = page_size
+        options['executemany_batch_page_size'] = page_size
+
+        statement_timeout_ms = config.get('statement_timeout_ms')
+        if statement_timeout_ms is not None:
+            if config.get('pgbouncer', False):
+                logging.warning('statement_timeout_ms is ignored behind PgBouncer; set it on the database role instead...')
+            else:
+                options['connect_args'] = {'options': '-c statement_timeout=' + str(int(statement_timeout_ms))}
+
+    return options
+
+
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA foreign_keys=ON')
+    cursor.close()
+
+
+def create_engine_from_config(config: dict[str, object]):
+    """
+    Create a tuned engine from a config.
+
+    See `_engine_options` for the config keys that are recognized. On SQLite,
+    foreign key enforcement (and so `ON DELETE CASCADE`) is switched on for every connection.
+
+    :param config: Config, as loaded by `load_config`.
+    :type config: dict[str, object]
+    :return: Engine.
+    :rtype: sqlalchemy.engine.Engine
+    """
+    engine = create_engine(config['connection_uri'], **_engine_options(config))
+    if engine.dialect.name == 'sqlite':
+        event.listen(engine, 'connect', _enable_sqlite_foreign_keys)
+
+    return engine
+
+
+def get_engine(config: dict[str, object]):
+    """
+    Get the engine shared by everything in this process that uses the same connection URI.
+
+    :param config: Config, as loaded by `load_config`.
+    :type config: dict[str, object]
+    :return: Engine.
+    :rtype: sqlalchemy.engine.Engine
+    """
+    connection_uri = config['connection_uri']
+    if connection_uri not in _engines_by_connection_uri:
+        _engines_by_connection_uri[connection_uri] = create_engine_from_config(config)
+
+    return _engines_by_connection_uri[connection_uri]
+
+
+@contextlib.contextmanager
+def session_scope(config: dict[str, object]):
+    """
+    Provide a session on the shared engine, closed when the block exits.
+
+    Uncommitted work is rolled back if the block raises.
+
+    :param config: Config, as loaded by `load_config`.
+    :type config: dict[str, object]
+    :return: Database session.
+    :rtype: Iterator[sqlalchemy.orm.Session]
+    """
+    Session = sessionmaker(bind=get_engine(config))
+    session = Session()
+    try:
+        yield session
+    except Exception:
+        session.rollback()
+        raise
+    finally:
+        session.close()
@@ -0,0 +1,226 @@
+import json
+import logging
+
+import numpy as np
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import *
+
+import tb_db.allele_matrix as allele_matrix
+
+# Upper bound on the number of elements of the allele indicator matrices built
+# at once by `pairwise_distances` (4 bytes each).
+MAX_BLOCK_ELEMENTS = 64 * 1024 * 1024
+
+# Sample IDs looked up per query by `load_profiles`.
+LOOKUP_BATCH_SIZE = 500
+
+
+def _locus_chunks(rows, max_columns):
+    """
+    Split the loci (columns) of an allele matrix into consecutive chunks whose
+    called alleles have at most `max_columns` distinct values in total (a single
+    locus with more gets a chunk of its own).
+
+    :return: `(start, end)` column ranges.
+    :rtype: list[tuple[int, int]]
+    """
+    sorted_rows = np.sort(rows, axis=0)
+    num_alleles = np.count_nonzero((sorted_rows[1:] != sorted_rows[:-1]) & (sorted_rows[1:] != allele_matrix.MISSING_ALLELE), axis=0)
+    num_alleles += sorted_rows[0] != allele_matrix.MISSING_ALLELE
+
+    chunks = []
+    start = 0
+    num_columns = 0
+    for locus, locus_num_alleles in enumerate(num_alleles.tolist()):
+        if locus > start and num_columns + locus_num_alleles > max_columns:
+            chunks.append((start, locus))
+            start = locus
+            num_columns = 0
+        num_columns += locus_num_alleles
+    chunks.append((start, rows.shape[1]))
+
+    return chunks
+
+
+def _allele_indicators(rows):
+    """
+    One column per distinct (locus, allele) pair of the called alleles in an
+    allele matrix, set to 1 in the rows that have that allele at that locus.
+
+    :rtype: numpy.ndarray
+    """
+    called = rows != allele_matrix.MISSING_ALLELE
+    row_indices, loci = np.nonzero(called)
+    codes = loci.astype(np.int64) * (int(rows.max()) + 1) + rows[called]
+    keys, columns = np.unique(codes, return_inverse=True)
+    indicators = np.zeros((rows.shape[0], len(keys)), dtype=np.float32)
+    indicators[row_indices, columns] = 1
+
+    return indicators
+
+
+def pairwise_distances(profiles, other_profiles=None, scale_missing=False, locus_mask=None):
+    """
+    Allele distances between cgMLST profiles, ignoring missing data.
+
+    The distance between two profiles is the number of loci that are called in
+    both (i.e. not `allele_matrix.MISSING_ALLELE`) and have different alleles:
+    the number of loci called in both, less the number with the same allele.
+    Both counts are matrix products (so they run in BLAS), of the called
+    loci and of one indicator column per distinct (locus, allele) pair. Loci are
+    taken in chunks, so the indicator matrices stay within `MAX_BLOCK_ELEMENTS`
+    unless a single locus has more alleles than that allows. This is fast for
+    closely related profiles, which share a few alleles per locus, and slows
+    down with the number of distinct alleles.
+
+    :param profiles: Allele matrix, one row per profile.
+    :type profiles: numpy.ndarray
+    :param other_profiles: Allele matrix to compare against, with the same loci. Defaults to `profiles`.
+    :type other_profiles: numpy.ndarray
+    :param scale_missing: If True, scale each distance up to the number of loci, as if the loci missing from either profile differed at the same rate as the loci called in both.
+    :type scale_missing: bool
+    :param locus_mask: If given, only the loci (columns) where the mask is True are compared, e.g. to leave out the loci reported by `locus_qc.poor_loci`.
+    :type locus_mask: numpy.ndarray
+    :return: Distance matrix with one row per profile in `profiles` and one column per profile in `other_profiles`. Integer unless `scale_missing` is set.
+    :rtype: numpy.ndarray
+    """
+    profiles = np.asarray(profiles)
+    same_profiles = other_profiles is None
+    other_profiles = profiles if same_profiles else np.asarray(other_profiles)
+    if locus_mask is not None:
+        locus_mask = np.asarray(locus_mask, dtype=bool)
+        profiles = profiles[:, locus_mask]
+        other_profiles = profiles if same_profiles else other_profiles[:, locus_mask]
+    num_rows = profiles.shape[0]
+    num_loci = profiles.shape[1]
+
+    dtype = np.float64 if scale_missing else np.int32
+    if num_rows == 0 or other_profiles.shape[0] == 0:
+        return np.zeros((num_rows, other_profiles.shape[0]), dtype=dtype)
+
+    # Both sets of profiles share the indicator columns, so they're encoded together.
+    rows = profiles if same_profiles else np.concatenate([profiles, other_profiles])
+    # Float32 sums of 0/1 products are exact up to 2**24 loci.
+    num_shared = np.zeros((num_rows, other_profiles.shape[0]), dtype=np.float32)
+    num_equal = np.zeros((num_rows, other_profiles.shape[0]), dtype=np.float32)
+    for start, end in _locus_chunks(rows, max(1, MAX_BLOCK_ELEMENTS // rows.shape[0])):
+        called = (rows[:, start:end] != allele_matrix.MISSING_ALLELE).astype(np.float32)
+        indicators = _allele_indicators(rows[:, start:end])
+        if same_profiles:
+            num_shared += called @ called.T
+            num_equal += indicators @ indicators.T
+        else:
+            num_shared += called[:num_rows] @ called[num_rows:].T
+            num_equal += indicators[:num_rows] @ indicators[num_rows:].T
+    differing = num_shared - num_equal
+
+    if scale_missing:
+        with np.errstate(divide='ignore', invalid='ignore'):
+            distances = np.where(num_shared > 0, differing.astype(np.float64) * num_loci / num_shared, np.nan)
+    else:
+        distances = np.rint(differing).astype(np.int32)
+
+    return distances
+
+
+def load_profiles(db: Session, sample_ids, scheme_id: int = None):
+    """
+    Load the cgMLST profiles of some samples as an allele matrix.
+
+    Each sample's most recent library with a profile is used. Rows come from
+    the scheme's memory-mapped allele matrix when it is configured and holds
+    every library needed; otherwise profiles are read from the database.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param sample_ids: Sample IDs.
+    :type sample_ids: Iterable[str]
+    :param scheme_id: Database ID of the cgMLST scheme. Required if the samples have profiles from more than one scheme.
+    :type scheme_id: int
+    :return: Sample IDs with a profile (in input order), the matrix's loci, and the allele matrix with one row per sample.
+    :rtype: tuple[list[str], list[str], numpy.ndarray]
+    """
+    sample_ids = list(dict.fromkeys(sample_ids))
+
+    library_ids_by_sample_id = {}
+    scheme_ids = set()
+    for start in range(0, len(sample_ids), LOOKUP_BATCH_SIZE):
+        batch = sample_ids[start:start + LOOKUP_BATCH_SIZE]
+        stmt = (
+            select(Sample.sample_id, Library.id, CgmlstAlleleProfile.cgmlst_scheme_id)
+            .join(Library, Library.sample_id == Sample.id)
+            .join(CgmlstAlleleProfile, CgmlstAlleleProfile.library_id == Library.id)
+            .where(Sample.sample_id.in_(batch))
+            .order_by(Library.id)
+        )
+        if scheme_id is not None:
+            stmt = stmt.where(CgmlstAlleleProfile.cgmlst_scheme_id == scheme_id)
+        for sample_id, library_id, profile_scheme_id in db.execute(stmt):
+            library_ids_by_sample_id[sample_id] = library_id
+            scheme_ids.add(profile_scheme_id)
+
+    if len(scheme_ids) > 1:
+        raise ValueError('samples have cgMLST profiles from more than one scheme; pass scheme_id')
+    missing_sample_ids = [sample_id for sample_id in sample_ids if sample_id not in library_ids_by_sample_id]
+    if missing_sample_ids:
+        logging.warning('no cgMLST profile for samples: ' + ', '.join(missing_sample_ids))
+    found_sample_ids = [sample_id for sample_id in sample_ids if sample_id in library_ids_by_sample_id]
+    library_ids = [library_ids_by_sample_id[sample_id] for sample_id in found_sample_ids]
+    if not library_ids:
+        return [], [], np.zeros((0, 0), dtype=np.int32)
+
+    found_library_ids, loci, rows = load_library_profiles(db, scheme_ids.pop(), library_ids)
+
+    return found_sample_ids, loci, rows
+
+
+def load_library_profiles(db: Session, scheme_id: int, library_ids=None):
+    """
+    Load the cgMLST profiles of some or all libraries of a scheme as an allele matrix.
+
+    Rows come from the scheme's memory-mapped allele matrix when it is
+    configured and holds every library needed; otherwise profiles are read
+    from the database.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param scheme_id: Database ID of the cgMLST scheme.
+    :type scheme_id: int|NoneType
+    :param library_ids: Library database IDs. If None, all libraries with a profile in the scheme.
+    :type library_ids: list[int]|NoneType
+    :return: Library IDs with a profile (in input order, or in ID order if `library_ids` is None), the matrix's loci, and the allele matrix with one row per library.
+    :rtype: tuple[list[int], list[str], numpy.ndarray]
+    """
+    if library_ids is None:
+        stmt = (
+            select(CgmlstAlleleProfile.library_id)
+            .where(CgmlstAlleleProfile.cgmlst_scheme_id == scheme_id)
+            .order_by(CgmlstAlleleProfile.library_id)
+        )
+        library_ids = db.scalars(stmt).all()
+    library_ids = list(library_ids)
+    if not library_ids:
+        return [], [], np.zeros((0, 0), dtype=np.int32)
+
+    if allele_matrix.is_configured() and scheme_id is not None:
+        matrix = allele_matrix.get_allele_matrix(scheme_id)
+        if all(library_id in matrix.row_offsets for library_id in library_ids):
+            found_library_ids, rows = matrix.rows(library_ids)
+            return found_library_ids, list(matrix.loci), rows
+
+    profiles_by_library_id = {}
+    for start in range(0, len(library_ids), LOOKUP_BATCH_SIZE):
+        batch = library_ids[start:start + LOOKUP_BATCH_SIZE]
+        stmt = select(CgmlstAlleleProfile.library_id, CgmlstAlleleProfile.profile).where(CgmlstAlleleProfile.library_id.in_(batch))
+        for library_id, profile in db.execute(stmt):
+            if isinstance(profile, str):
+                profile = json.loads(profile)
+            profiles_by_library_id[library_id] = profile
+    found_library_ids = [library_id for library_id in library_ids if library_id in profiles_by_library_id]
+    loci = list(profiles_by_library_id[found_library_ids[0]]) if found_library_ids else []
+    rows = allele_matrix.encode_profiles([profiles_by_library_id[library_id] for library_id in found_library_ids], loci)
+
+    return found_library_ids, loci, rows
@@ -0,0 +1,192 @@
+import contextlib
+import datetime
+import hashlib
+import os
+
+import tb_db.crud as crud
+import tb_db.utils as utils
+
+# Number of hex digits kept from each row hash. 64 bits is plenty for telling
+# rows of one input apart, and keeps the stored hash list small.
+ROW_HASH_LENGTH = 16
+
+
+def row_hash(row):
+    """
+    Short content hash of one parsed row.
+
+    :param row: Parsed row.
+    :type row: dict
+    :return: Hex digest, truncated to `ROW_HASH_LENGTH` characters.
+    :rtype: str
+    """
+    return utils.content_hash(row)[:ROW_HASH_LENGTH]
+
+
+def _auxiliary_content_hash(paths):
+    if not paths:
+        return None
+    sha256 = hashlib.sha256()
+    for path in paths:
+        sha256.update(utils.file_content_hash(path).encode())
+
+    return sha256.hexdigest()
+
+
+class IngestRunRecorder:
+    """
+    Tracks one loader run over one input file, and decides how much of the
+    input needs to be processed:
+
+    - If the input file (and any auxiliary inputs, such as a locations file
+      used to look up sequencing runs) is identical to the last successful run
+      of the same loader, `unchanged` is True and nothing needs to be loaded.
+    - Otherwise, `changed_rows` drops the parsed rows that were already loaded,
+      unchanged, by the last successful run of the same loader over the same path.
+
+    Rows that disappeared from the input are not deleted. Deleting samples
+    with `crud.delete_samples` invalidates earlier runs, so the next run
+    reloads its whole input.
+    """
+
+    def __init__(self, db, loader: str, input_path: str, auxiliary_paths=None, force=False):
+        self.db = db
+        self.loader = loader
+        self.input_path = os.path.abspath(input_path)
+        self.auxiliary_paths = [path for path in (auxiliary_paths or []) if path is not None]
+        self.force = force
+        self.started_at = datetime.datetime.now()
+        self.num_rows = None
+        self.num_rows_processed = None
+        self.row_hashes = None
+        self.unchanged = False
+
+        stat = os.stat(input_path)
+        self.input_size = stat.st_size
+        self.input_mtime = stat.st_mtime
+        self.auxiliary_content_hash = _auxiliary_content_hash(self.auxiliary_paths)
+
+        self.previous_run = crud.get_latest_ingest_run(db, loader, input_path=self.input_path)
+        previous = self.previous_run
+        if previous is not None and previous.input_size == self.input_size and previous.input_mtime == self.input_mtime:
+            # Same size and modification time as last time: trust the stored hash
+            # rather than reading the whole file again.
+            self.content_hash = previous.content_hash
+        else:
+            self.content_hash = utils.file_content_hash(input_path)
+
+        if not force:
+            matching_run = previous
+            if matching_run is None or matching_run.content_hash != self.content_hash:
+                matching_run = crud.get_latest_ingest_run(db, loader, content_hash=self.content_hash)
+            if matching_run is not None and matching_run.auxiliary_content_hash == self.auxiliary_content_hash:
+                self.unchanged = True
+                self.row_hashes = matching_run.row_hashes
+                self.num_rows = matching_run.num_rows
+                self.num_rows_processed = 0
+
+    def changed_rows(self, rows):
+        """
+        Record the hash of every parsed row, and return only the rows that were
+        not loaded by the previous successful run over the same input path.
+
+        All rows are returned if there is no previous run, if auxiliary inputs
+        have changed since then, or if the recorder was created with `force`.
+
+        :param rows: Parsed rows, either a list of dicts or a dict of dicts indexed by sample ID.
+        :type rows: list[dict]|dict[str, dict]
+        :return: Added or changed rows, in the same shape as `rows`.
+        :rtype: list[dict]|dict[str, dict]
+        """
+        if isinstance(rows, dict):
+            hashes = {key: row_hash(row) for key, row in rows.items()}
+            self.row_hashes = sorted(set(hashes.values()))
+        else:
+            hashes = [row_hash(row) for row in rows]
+            self.row_hashes = sorted(set(hashes))
+        self.num_rows = len(rows)
+
+        previous = self.previous_run
+        if self.force or previous is None or previous.row_hashes is None or previous.auxiliary_content_hash != self.auxiliary_content_hash:
+            changed = rows
+        else:
+            previous_hashes = set(previous.row_hashes)
+            if isinstance(rows, dict):
+                changed = {key: row for key, row in rows.items() if hashes[key] not in previous_hashes}
+            else:
+                changed = [row for row, h in zip(rows, hashes) if h not in previous_hashes]
+
+        self.num_rows_processed = len(changed)
+
+        return changed
+
+    def record(self, outcome: str, message: str = None):
+        """
+        Store the run in the `ingest_run` table.
+
+        :param outcome: One of `success`, `unchanged` or `failed`. Successful runs
+                        become `invalidated` when samples are deleted.
+        :type outcome: str
+        :param message: Error message for failed runs.
+        :type message: str
+        :return: Stored ingest run.
+        :rtype: models.IngestRun
+        """
+        ingest_run = {
+            'loader': self.loader,
+            'input_path': self.input_path,
+            'input_size': self.input_size,
+            'input_mtime': self.input_mtime,
+            'content_hash': self.content_hash,
+            'auxiliary_content_hash': self.auxiliary_content_hash,
+            'outcome': outcome,
+            'num_rows': self.num_rows,
+            'num_rows_processed': self.num_rows_processed,
+            'row_hashes': self.row_hashes if outcome == 'success' else None,
+            'started_at': self.started_at,
+            'finished_at': datetime.datetime.now(),
+            'message': message,
+        }
+
+        return crud.create_ingest_run(self.db, ingest_run)
+
+
+@contextlib.contextmanager
+def ingest_run(db, loader: str, input_path: str, auxiliary_paths=None, force=False):
+    """
+    Record a loader run in the ingest run ledger when the block exits.
+
+    Unchanged runs are recorded with outcome `unchanged` and successful runs with
+    outcome `success`. If the block raises, the session is rolled back, the run
+    is recorded with outcome `failed`, and the exception is re-raised.
+
+    Only successful runs are used to decide whether a later run can be skipped,
+    so the caller should check `unchanged` before loading anything::
+
+        with ingest.ingest_run(session, 'load_samples', path) as run:
+            if not run.unchanged:
+                samples = run.changed_rows(parsers.parse_samples(path))
+                crud.create_samples(session, samples)
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param loader: Loader name, e.g. `load_samples`.
+    :type loader: str
+    :param input_path: Path to the main input file.
+    :type input_path: str
+    :param auxiliary_paths: Paths to other inputs whose changes should force a full reload.
+    :type auxiliary_paths: list[str]
+    :param force: If True, never treat the input as unchanged.
+    :type force: bool
+    :return: Recorder for the run.
+    :rtype: Iterator[IngestRunRecorder]
+    """
+    recorder = IngestRunRecorder(db, loader, input_path, auxiliary_paths=auxiliary_paths, force=force)
+    try:
+        yield recorder
+    except Exception as e:
+        db.rollback()
+        recorder.record('failed', message=str(e))
+        raise
+    else:
+        recorder.record('unchanged' if recorder.unchanged else 'success')
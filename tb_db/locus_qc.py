@@ -0,0 +1,137 @@
+import numpy as np
+
+from sqlalchemy import select, func
+from sqlalchemy.orm import Session
+
+from .models import *
+
+import tb_db.allele_matrix as allele_matrix
+import tb_db.cache as cache
+import tb_db.distance as distance
+
+# Matrix cells processed at once when counting alleles per locus.
+MAX_BLOCK_ELEMENTS = 16 * 1024 * 1024
+
+# Defaults used by `poor_loci`.
+DEFAULT_MIN_CALL_RATE = 0.95
+
+_locus_qc_by_key = {}
+
+
+def compute_locus_qc(profiles, loci, library_ids):
+    """
+    Per-locus and per-library QC statistics of an allele matrix.
+
+    - `call_rate`: fraction of profiles with the locus called.
+    - `num_alleles`: number of distinct alleles called at the locus.
+    - `diversity`: Simpson's diversity of the called alleles (the probability
+      that two calls drawn at random differ), 0 if fewer than two calls.
+    - `new_allele_rate`: fraction of calls that carry an allele not seen in
+      any earlier profile (by row order), i.e. `num_alleles` / number of calls.
+    - `missingness`: fraction of loci not called, per library.
+
+    :param profiles: Allele matrix, one row per library and one column per locus.
+    :type profiles: numpy.ndarray
+    :param loci: Locus of each column.
+    :type loci: list[str]
+    :param library_ids: Library of each row.
+    :type library_ids: list[int]
+    :return: Statistics, with keys `loci`, `call_rate`, `num_alleles`, `diversity` and `new_allele_rate` (arrays with one value per locus), and `library_ids` and `missingness` (one value per library).
+    :rtype: dict[str, object]
+    """
+    profiles = np.asarray(profiles)
+    num_profiles, num_loci = profiles.shape
+    called = profiles != allele_matrix.MISSING_ALLELE
+    num_called = np.count_nonzero(called, axis=0)
+
+    num_alleles = np.zeros(num_loci, dtype=np.int64)
+    sum_squared_counts = np.zeros(num_loci, dtype=np.float64)
+    block_size = max(1, MAX_BLOCK_ELEMENTS // max(1, num_profiles))
+    for start in range(0, num_loci, block_size):
+        block = np.sort(profiles[:, start:start + block_size], axis=0)
+        # Sorted columns hold runs of equal alleles; a run starts wherever the value changes.
+        run_starts = np.ones(block.shape, dtype=bool)
+        run_starts[1:] = block[1:] != block[:-1]
+        run_starts &= block != allele_matrix.MISSING_ALLELE
+        num_alleles[start:start + block.shape[1]] = np.count_nonzero(run_starts, axis=0)
+
+        columns, positions = np.nonzero(run_starts.T)
+        if len(columns) == 0:
+            continue
+        # Run lengths, from the position of each run start in the flattened (column-major)
+        # block. Uncalled alleles sort first, so a column's last run ends at the column's end.
+        flat_starts = columns * num_profiles + positions
+        run_ends = np.minimum(np.append(flat_starts[1:], block.shape[1] * num_profiles), (columns + 1) * num_profiles)
+        run_lengths = (run_ends - flat_starts).astype(np.float64)
+        sum_squared_counts[start:start + block.shape[1]] = np.bincount(columns, weights=run_lengths ** 2, minlength=block.shape[1])
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        call_rate = num_called / num_profiles if num_profiles else np.zeros(num_loci)
+        diversity = np.where(
+            num_called > 1,
+            (1.0 - sum_squared_counts / np.maximum(num_called, 1) ** 2) * num_called / np.maximum(num_called - 1, 1),
+            0.0,
+        )
+        new_allele_rate = np.where(num_called > 0, num_alleles / np.maximum(num_called, 1), 0.0)
+        missingness = 1.0 - np.count_nonzero(called, axis=1) / num_loci if num_loci else np.zeros(num_profiles)
+
+    locus_qc = {
+        'loci': list(loci),
+        'call_rate': call_rate,
+        'num_alleles': num_alleles,
+        'diversity': diversity,
+        'new_allele_rate': new_allele_rate,
+        'library_ids': list(library_ids),
+        'missingness': missingness,
+    }
+
+    return locus_qc
+
+
+def get_locus_qc(db: Session, scheme_id: int):
+    """
+    Per-locus and per-library QC statistics of all stored profiles of a scheme (see `compute_locus_qc`).
+
+    Results are cached in-process by scheme, number of profiles and highest
+    library ID, so they are only recomputed after profiles are added or deleted.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param scheme_id: Database ID of the cgMLST scheme.
+    :type scheme_id: int
+    :return: Statistics.
+    :rtype: dict[str, object]
+    """
+    stmt = (
+        select(func.count(CgmlstAlleleProfile.id), func.max(CgmlstAlleleProfile.library_id))
+        .where(CgmlstAlleleProfile.cgmlst_scheme_id == scheme_id)
+    )
+    num_profiles, max_library_id = db.execute(stmt).one()
+    key = (cache.database_key(db), scheme_id, num_profiles, max_library_id)
+    if key not in _locus_qc_by_key:
+        for stale_key in [k for k in _locus_qc_by_key if k[:2] == key[:2]]:
+            del _locus_qc_by_key[stale_key]
+        library_ids, loci, profiles = distance.load_library_profiles(db, scheme_id)
+        _locus_qc_by_key[key] = compute_locus_qc(profiles, loci, library_ids)
+
+    return _locus_qc_by_key[key]
+
+
+def poor_loci(locus_qc, min_call_rate=DEFAULT_MIN_CALL_RATE, max_new_allele_rate=None):
+    """
+    Loci that perform poorly, e.g. to pass as `exclude_loci` to `mst.build_mst`.
+
+    :param locus_qc: Statistics, as returned by `get_locus_qc` or `compute_locus_qc`.
+    :type locus_qc: dict[str, object]
+    :param min_call_rate: Loci called in a smaller fraction of profiles are poor.
+    :type min_call_rate: float
+    :param max_new_allele_rate: If given, loci with a higher new-allele rate are poor.
+    :type max_new_allele_rate: float
+    :return: Poor loci, in matrix order.
+    :rtype: list[str]
+    """
+    poor = locus_qc['call_rate'] < min_call_rate
+    if max_new_allele_rate is not None:
+        poor |= locus_qc['new_allele_rate'] > max_new_allele_rate
+
+    return [locus for locus, is_poor in zip(locus_qc['loci'], poor) if is_poor]
@@ -0,0 +1,208 @@
+import contextlib
+import datetime
+import json
+import os
+import resource
+import sys
+import time
+
+# Prefix for every exported metric name.
+METRIC_PREFIX = 'tb_db_loader_'
+
+METRIC_HELP = {
+    'rows_parsed': 'Rows parsed from the input files.',
+    'rows_written': 'Rows created or updated in the database.',
+    'bytes_read': 'Size of the input files.',
+    'stage_duration_seconds': 'Wall-clock duration of each loader stage.',
+    'rows_parsed_per_second': 'Rows parsed per second of the parse stage.',
+    'rows_written_per_second': 'Rows written per second of the write stage.',
+    'peak_rss_bytes': 'Peak resident set size of the loader process.',
+    'duration_seconds': 'Wall-clock duration of the whole loader run.',
+    'last_run_timestamp_seconds': 'Unix time at which the loader run finished.',
+    'success': '1 if the loader run finished without an error, otherwise 0.',
+}
+
+
+def peak_rss_bytes():
+    """
+    Peak resident set size of this process.
+
+    :return: Peak RSS in bytes.
+    :rtype: int
+    """
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    if sys.platform == 'darwin':
+        return max_rss
+
+    return max_rss * 1024
+
+
+class MetricsRegistry:
+    """
+    Collects metrics for one loader run, and exports them in Prometheus text
+    format (for the node_exporter textfile collector) or as a JSON run report.
+
+    The parse and write stages are expected to be named `parse` and `write`;
+    their durations are used to compute throughput.
+    """
+
+    def __init__(self, loader: str):
+        self.loader = loader
+        self.counters = {
+            'rows_parsed': 0,
+            'rows_written': 0,
+            'bytes_read': 0,
+        }
+        self.stage_durations = {}
+        self.success = None
+        self._start_time = time.perf_counter()
+        self._finish_time = None
+        self._finished_at = None
+
+    def inc(self, name: str, value=1):
+        """
+        Increment a counter.
+
+        :param name: Counter name, e.g. `rows_parsed`.
+        :type name: str
+        :param value: Amount to add.
+        :type value: int
+        """
+        self.counters[name] = self.counters.get(name, 0) + value
+
+    def add_input(self, path: str):
+        """
+        Count the size of an input file towards `bytes_read`.
+
+        :param path: Path to input file.
+        :type path: str
+        """
+        if path is not None and os.path.exists(path):
+            self.inc('bytes_read', os.path.getsize(path))
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """
+        Time a stage of the run. Repeated stages with the same name are summed.
+
+        :param name: Stage name, e.g. `parse` or `write`.
+        :type name: str
+        """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stage_durations[name] = self.stage_durations.get(name, 0.0) + time.perf_counter() - start
+
+    def finish(self, success=True):
+        """
+        Mark the run as finished.
+
+        :param success: Whether the run finished without an error.
+        :type success: bool
+        """
+        self.success = success
+        self._finish_time = time.perf_counter()
+        self._finished_at = datetime.datetime.now(datetime.timezone.utc)
+
+    def report(self):
+        """
+        All metrics for the run.
+
+        :return: Metrics, indexed by name. Stage durations are indexed by stage name.
+        :rtype: dict[str, object]
+        """
+        if self._finish_time is None:
+            self.finish()
+
+        report = dict(self.counters)
+        report['stage_duration_seconds'] = dict(self.stage_durations)
+        for counter, stage in [('rows_parsed', 'parse'), ('rows_written', 'write')]:
+            stage_duration = self.stage_durations.get(stage)
+            if stage_duration:
+                report[counter + '_per_second'] = self.counters[counter] / stage_duration
+        report['peak_rss_bytes'] = peak_rss_bytes()
+        report['duration_seconds'] = self._finish_time - self._start_time
+        report['last_run_timestamp_seconds'] = self._finished_at.timestamp()
+        report['success'] = 1 if self.success else 0
+
+        return report
+
+    def to_prometheus(self):
+        """
+        All metrics in Prometheus text exposition format, labelled with the loader name.
+
+        :return: Metrics text.
+        :rtype: str
+        """
+        lines = []
+        for name, value in self.report().items():
+            metric_name = METRIC_PREFIX + name
+            lines.append('# HELP ' + metric_name + ' ' + METRIC_HELP.get(name, name))
+            lines.append('# TYPE ' + metric_name + ' gauge')
+            if isinstance(value, dict):
+                for stage, stage_value in sorted(value.items()):
+                    lines.append(metric_name + '{loader="' + self.loader + '",stage="' + stage + '"} ' + repr(float(stage_value)))
+            else:
+                lines.append(metric_name + '{loader="' + self.loader + '"} ' + repr(float(value)))
+
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus_textfile(self, path: str):
+        """
+        Write metrics in Prometheus text format. The file is replaced atomically,
+        so the textfile collector never reads a partial file.
+
+        :param path: Output path, conventionally ending in `.prom`.
+        :type path: str
+        """
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp_path, path)
+
+    def write_json_report(self, path: str):
+        """
+        Write metrics as a JSON run report.
+
+        :param path: Output path.
+        :type path: str
+        """
+        metrics = self.report()
+        report = {
+            'loader': self.loader,
+            'finished_at': self._finished_at.isoformat(),
+            'metrics': metrics,
+        }
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2)
+
+
+@contextlib.contextmanager
+def loader_run(loader: str, prometheus_textfile=None, json_report=None):
+    """
+    Collect metrics for a loader run and write them out when the block exits,
+    whether or not it raised.
+
+    :param loader: Loader name, used as the `loader` label.
+    :type loader: str
+    :param prometheus_textfile: If given, write metrics to this file in Prometheus text format.
+    :type prometheus_textfile: str
+    :param json_report: If given, write a JSON run report to this file.
+    :type json_report: str
+    :return: Metrics registry for the run.
+    :rtype: Iterator[MetricsRegistry]
+    """
+    registry = MetricsRegistry(loader)
+    try:
+        yield registry
+    except BaseException:
+        registry.finish(success=False)
+        raise
+    else:
+        registry.finish(success=True)
+    finally:
+        if prometheus_textfile is not None:
+            registry.write_prometheus_textfile(prometheus_textfile)
+        if json_report is not None:
+            registry.write_json_report(json_report)
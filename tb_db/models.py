@@ -17,6 +17,7 @@ from sqlalchemy.orm import make_transient
 from sqlalchemy.orm import Session
 from sqlalchemy import Table
 from sqlalchemy import BigInteger
+from sqlalchemy import Index
 
 def camel_to_snake(s: str) -> str:
     """
@@ -42,15 +43,15 @@ Base = declarative_base(cls=Base)
 association_table_cgmlst = Table(
     "association_table_cgmlst",
     Base.metadata,
-    Column("library_id", ForeignKey("library.id")),
-    Column("cgmlst_cluster_id", ForeignKey("cgmlst_cluster.id")),
+    Column("library_id", ForeignKey("library.id", ondelete="CASCADE")),
+    Column("cgmlst_cluster_id", ForeignKey("cgmlst_cluster.id", ondelete="CASCADE")),
 )
 
 association_table_miru = Table(
     "association_table_miru",
     Base.metadata,
-    Column("sample_id", ForeignKey("sample.id"), primary_key=True),
-    Column("miru_cluster_id", ForeignKey("miru_cluster.id"), primary_key=True),
+    Column("sample_id", ForeignKey("sample.id", ondelete="CASCADE"), primary_key=True),
+    Column("miru_cluster_id", ForeignKey("miru_cluster.id", ondelete="CASCADE"), primary_key=True),
 )
 
 
@@ -60,8 +61,12 @@ class Sample(Base):
     accession = Column(String)
     collection_date = Column(Date)
 
-    library = relationship("Library", backref = 'samples')
-    miru_profile = relationship("MiruProfile", backref = 'samples', cascade="all,delete")
+    __table_args__ = (
+        Index("ix_sample_sample_id", "sample_id"),
+    )
+
+    library = relationship("Library", backref = 'samples', cascade="all,delete", passive_deletes=True)
+    miru_profile = relationship("MiruProfile", backref = 'samples', cascade="all,delete", passive_deletes=True)
     miru_cluster = relationship("MiruCluster", secondary=association_table_miru, backref ='samples', cascade="all, delete")
 
 
@@ -70,7 +75,7 @@ class Library(Base):
     """
     """
 
-    sample_id = Column(Integer, ForeignKey("sample.id"), nullable=False)
+    sample_id = Column(Integer, ForeignKey("sample.id", ondelete="CASCADE"), nullable=False)
     sample_name = Column(String)
     sequencing_run_id = Column(String)
     library_id = Column(String)
@@ -82,16 +87,20 @@ class Library(Base):
     average_base_quality = Column(Float)
     percent_bases_above_q30 = Column(Float)
     percent_gc = Column(Float)
+    qc_hash = Column(String(64))
 
+    __table_args__ = (
+        Index("ix_library_sample_id_sequencing_run_id_qc_hash", "sample_id", "sequencing_run_id", "qc_hash"),
+    )
 
     cgmlst_cluster = relationship("CgmlstCluster", secondary=association_table_cgmlst, backref = 'libraries', cascade="all, delete")
 
-    cgmlst_allele_profile = relationship("CgmlstAlleleProfile", backref = 'libraries', cascade="all,delete")
+    cgmlst_allele_profile = relationship("CgmlstAlleleProfile", backref = 'libraries', cascade="all,delete", passive_deletes=True)
     
 
-    tb_complex = relationship('TbComplex',backref = 'libraries', cascade = "all,delete")
-    tb_species = relationship('TbSpecies',backref = 'libraries', cascade = "all,delete")
-    amr_profile = relationship('AmrProfile', backref = 'libraries',cascade = "all,delete")
+    tb_complex = relationship('TbComplex',backref = 'libraries', cascade = "all,delete", passive_deletes=True)
+    tb_species = relationship('TbSpecies',backref = 'libraries', cascade = "all,delete", passive_deletes=True)
+    amr_profile = relationship('AmrProfile', backref = 'libraries',cascade = "all,delete", passive_deletes=True)
 
 
 
@@ -108,17 +117,18 @@ class CgmlstAlleleProfile(Base):
     """
     """
 
-    library_id = Column(Integer, ForeignKey("library.id"), nullable=False)
+    library_id = Column(Integer, ForeignKey("library.id", ondelete="CASCADE"), nullable=False)
     cgmlst_scheme_id = Column(Integer, ForeignKey("cgmlst_scheme.id"), nullable=True)
     percent_called = Column(Float)
     profile = Column(JSON)
+    profile_hash = Column(String(64))
 
 
 class MiruProfile(Base):
     """
     """
 
-    sample_id = Column(Integer, ForeignKey("sample.id"), nullable=False)
+    sample_id = Column(Integer, ForeignKey("sample.id", ondelete="CASCADE"), nullable=False)
     percent_called = Column(Float)
     profile_by_position = Column(JSON)
     miru_pattern = Column(String)
@@ -136,7 +146,7 @@ class MiruCluster(Base):
 
 class TbComplex(Base):
 
-    library_id = Column(Integer, ForeignKey("library.id"), nullable=False)
+    library_id = Column(Integer, ForeignKey("library.id", ondelete="CASCADE"), nullable=False)
     mtbc_prop = Column(Float)
     ntm_prop = Column(Float)
     nonmycobacterium_prop = Column(Float)
@@ -148,7 +158,7 @@ class TbComplex(Base):
 
 class TbSpecies(Base):
 
-    library_id = Column(Integer, ForeignKey("library.id"), nullable= False)
+    library_id = Column(Integer, ForeignKey("library.id", ondelete="CASCADE"), nullable= False)
     taxonomy_level = Column(String)
     species_name = Column(String)
     ncbi_taxonomy_id = Column(Float)
@@ -163,16 +173,97 @@ class Drug(Base):
 
 class AmrProfile(Base):
 
-    library_id = Column(Integer, ForeignKey("library.id"),nullable = False)
+    library_id = Column(Integer, ForeignKey("library.id", ondelete="CASCADE"),nullable = False)
     date = Column(Date)
     dr_type = Column(String)
     median_depth = Column(Integer)
     tbprofiler_version = Column(JSON)
 
-    drug_mutation_profile = relationship("DrugMutationProfile", backref = 'amr_profile', cascade="all,delete")
+    drug_mutation_profile = relationship("DrugMutationProfile", backref = 'amr_profile', cascade="all,delete", passive_deletes=True)
 
 class DrugMutationProfile(Base):
     #sample_id = Column(Integer, ForeignKey("sample.id"),nullable = False)
-    amr_id = Column(Integer, ForeignKey("amr_profile.id"), nullable= False)
+    amr_id = Column(Integer, ForeignKey("amr_profile.id", ondelete="CASCADE"), nullable= False)
     drug = Column(Integer, ForeignKey("drug.id"), nullable = True)
     mutation = Column(String)
+
+
+class ClusterSummary(Base):
+    """
+    Size, collection date range and members of one cgMLST or MIRU cluster,
+    maintained by the functions in `tb_db.crud` that change cluster membership.
+    """
+
+    cluster_type = Column(String, nullable=False)
+    cluster_id = Column(String, nullable=False)
+    num_samples = Column(Integer)
+    first_collection_date = Column(Date)
+    last_collection_date = Column(Date)
+    sample_ids = Column(JSON)
+    updated_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_cluster_summary_cluster_type_cluster_id", "cluster_type", "cluster_id", unique=True),
+    )
+
+
+class CgmlstClusterAssignment(Base):
+    """
+    The cgMLST cluster of one library in one clustering snapshot (e.g. one
+    re-import of an external clustering). `association_table_cgmlst` holds the
+    current assignments; this table keeps every snapshot, so that cluster
+    history can be compared.
+    """
+
+    snapshot = Column(String, nullable=False)
+    library_id = Column(Integer, ForeignKey("library.id", ondelete="CASCADE"), nullable=False)
+    cgmlst_cluster_id = Column(Integer, ForeignKey("cgmlst_cluster.id", ondelete="CASCADE"), nullable=False)
+    created_at = Column(DateTime)
+
+    __table_args__ = (
+        Index("ix_cgmlst_cluster_assignment_snapshot_library_id", "snapshot", "library_id", unique=True),
+        Index("ix_cgmlst_cluster_assignment_snapshot_cgmlst_cluster_id", "snapshot", "cgmlst_cluster_id"),
+    )
+
+
+class CgmlstClusterCode(Base):
+    """
+    The cluster number of one library at one allele distance threshold, for
+    hierarchical cgMLST nomenclature (see `tb_db.cluster_codes`).
+    """
+
+    library_id = Column(Integer, ForeignKey("library.id", ondelete="CASCADE"), nullable=False)
+    cgmlst_scheme_id = Column(Integer, ForeignKey("cgmlst_scheme.id", ondelete="CASCADE"), nullable=False)
+    threshold = Column(Integer, nullable=False)
+    cluster_number = Column(Integer, nullable=False)
+
+    __table_args__ = (
+        Index("ix_cgmlst_cluster_code_scheme_threshold_library_id", "cgmlst_scheme_id", "threshold", "library_id", unique=True),
+        Index("ix_cgmlst_cluster_code_scheme_threshold_cluster_number", "cgmlst_scheme_id", "threshold", "cluster_number"),
+    )
+
+
+class IngestRun(Base):
+    """
+    One run of a loader over an input file, used to skip unchanged inputs and
+    to process only the rows that changed since the previous run.
+    """
+
+    loader = Column(String, nullable=False)
+    input_path = Column(String, nullable=False)
+    input_size = Column(BigInteger)
+    input_mtime = Column(Float)
+    content_hash = Column(String(64))
+    auxiliary_content_hash = Column(String(64))
+    outcome = Column(String)
+    num_rows = Column(Integer)
+    num_rows_processed = Column(Integer)
+    row_hashes = Column(JSON)
+    started_at = Column(DateTime)
+    finished_at = Column(DateTime)
+    message = Column(String)
+
+    __table_args__ = (
+        Index("ix_ingest_run_loader_input_path", "loader", "input_path"),
+        Index("ix_ingest_run_loader_content_hash", "loader", "content_hash"),
+    )
@@ -0,0 +1,225 @@
+import json
+import math
+import re
+
+from xml.sax.saxutils import escape
+from xml.sax.saxutils import quoteattr
+
+import numpy as np
+
+from sqlalchemy.orm import Session
+
+import tb_db.crud as crud
+import tb_db.distance as distance
+
+# Characters that must be quoted in Newick labels.
+_NEWICK_SPECIAL_CHARACTERS = re.compile(r"[\s()\[\]':;,]")
+
+
+def minimum_spanning_tree(distances):
+    """
+    Minimum spanning tree of a complete graph, given as a dense distance matrix.
+
+    Uses Prim's algorithm with a vectorized update of the closest tree node for
+    every remaining node, which is O(n²) and suits the complete graphs of
+    allele distances. Ties are broken by the lowest node index, so the tree is
+    deterministic. Pairs with an undefined (NaN) distance are joined last; a
+    node with no defined distance to any node of the tree is joined to the root
+    with a NaN distance.
+
+    :param distances: Symmetric distance matrix.
+    :type distances: numpy.ndarray
+    :return: Edges as `(parent index, child index, distance)`, in the order they were added. The first node is the root.
+    :rtype: list[tuple[int, int, float]]
+    """
+    distances = np.asarray(distances, dtype=np.float64)
+    num_nodes = distances.shape[0]
+    if num_nodes == 0:
+        return []
+    weights = np.where(np.isnan(distances), np.inf, distances)
+
+    in_tree = np.zeros(num_nodes, dtype=bool)
+    in_tree[0] = True
+    closest_distance = weights[0].copy()
+    closest_node = np.zeros(num_nodes, dtype=np.int64)
+
+    edges = []
+    for _ in range(num_nodes - 1):
+        remaining = np.flatnonzero(~in_tree)
+        node = int(remaining[np.argmin(closest_distance[remaining])])
+        # Still the root if no tree node had a finite distance to it.
+        parent = int(closest_node[node])
+        edges.append((parent, node, distances[parent, node]))
+        in_tree[node] = True
+        closer = ~in_tree & (weights[node] < closest_distance)
+        closest_distance[closer] = weights[node][closer]
+        closest_node[closer] = node
+
+    return edges
+
+
+def _python_number(value):
+    value = float(value)
+    if math.isnan(value):
+        return None
+    if value.is_integer():
+        return int(value)
+
+    return value
+
+
+def build_mst(db: Session, sample_ids, scheme_id: int = None, scale_missing=False, exclude_loci=None):
+    """
+    Build a minimum spanning tree of samples from their stored cgMLST profiles.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param sample_ids: Sample IDs. Samples without a cgMLST profile are left out.
+    :type sample_ids: Iterable[str]
+    :param scheme_id: Database ID of the cgMLST scheme, if the samples have profiles from more than one.
+    :type scheme_id: int
+    :param scale_missing: Scale distances for missing loci (see `distance.pairwise_distances`).
+    :type scale_missing: bool
+    :param exclude_loci: Loci to leave out of the distances, e.g. as reported by `locus_qc.poor_loci`.
+    :type exclude_loci: Iterable[str]
+    :return: Sample IDs in the tree (the first is the root), and edges as `(parent sample ID, child sample ID, allele distance)`. The distance is None if it is undefined, e.g. for a sample that shares no called loci with the others when `scale_missing` is set.
+    :rtype: tuple[list[str], list[tuple[str, str, int|float]]]
+    """
+    sample_ids, loci, profiles = distance.load_profiles(db, sample_ids, scheme_id=scheme_id)
+    locus_mask = None
+    if exclude_loci is not None:
+        exclude_loci = set(exclude_loci)
+        locus_mask = np.array([locus not in exclude_loci for locus in loci], dtype=bool)
+    distances = distance.pairwise_distances(profiles, scale_missing=scale_missing, locus_mask=locus_mask)
+    edges = [
+        (sample_ids[parent], sample_ids[child], _python_number(edge_distance))
+        for parent, child, edge_distance in minimum_spanning_tree(distances)
+    ]
+
+    return sample_ids, edges
+
+
+def build_cluster_mst(db: Session, cluster_id: str, scheme_id: int = None, scale_missing=False, exclude_loci=None):
+    """
+    Build a minimum spanning tree of the members of a cgMLST cluster.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param cluster_id: cgMLST cluster code.
+    :type cluster_id: str
+    :return: Sample IDs and edges, as returned by `build_mst`.
+    :rtype: tuple[list[str], list[tuple[str, str, int|float]]]
+    """
+    sample_ids = crud.get_cluster_sample_ids(db, crud.CLUSTER_TYPE_CGMLST, cluster_id)
+
+    return build_mst(db, sample_ids, scheme_id=scheme_id, scale_missing=scale_missing, exclude_loci=exclude_loci)
+
+
+def _newick_label(label):
+    if _NEWICK_SPECIAL_CHARACTERS.search(label):
+        return "'" + label.replace("'", "''") + "'"
+
+    return label
+
+
+def to_newick(sample_ids, edges):
+    """
+    Format a spanning tree as Newick, rooted at the first sample.
+
+    Samples with children are written as labelled internal nodes, and edge
+    distances as branch lengths.
+
+    :param sample_ids: Sample IDs, as returned by `build_mst`.
+    :type sample_ids: list[str]
+    :param edges: Edges, as returned by `build_mst`.
+    :type edges: list[tuple[str, str, int|float]]
+    :return: Newick string, terminated by `;`.
+    :rtype: str
+    """
+    if not sample_ids:
+        return ';'
+    children_by_parent = {}
+    distance_by_child = {}
+    for parent, child, edge_distance in edges:
+        children_by_parent.setdefault(parent, []).append(child)
+        distance_by_child[child] = edge_distance
+
+    def _node(sample_id):
+        node = _newick_label(sample_id)
+        if sample_id in distance_by_child and distance_by_child[sample_id] is not None:
+            node += ':' + str(distance_by_child[sample_id])
+        return node
+
+    # Iterative post-order traversal, since chains of thousands of samples
+    # would exceed the recursion limit.
+    formatted = {}
+    stack = [(sample_ids[0], False)]
+    while stack:
+        sample_id, children_done = stack.pop()
+        children = children_by_parent.get(sample_id, [])
+        if children_done or not children:
+            if children:
+                formatted[sample_id] = '(' + ','.join(formatted.pop(child) for child in children) + ')' + _node(sample_id)
+            else:
+                formatted[sample_id] = _node(sample_id)
+            continue
+        stack.append((sample_id, True))
+        stack.extend((child, False) for child in reversed(children))
+
+    return formatted[sample_ids[0]] + ';'
+
+
+def to_graphml(sample_ids, edges):
+    """
+    Format a spanning tree as GraphML, with the allele distance as the `distance` edge attribute.
+
+    :param sample_ids: Sample IDs, as returned by `build_mst`.
+    :type sample_ids: list[str]
+    :param edges: Edges, as returned by `build_mst`.
+    :type edges: list[tuple[str, str, int|float]]
+    :return: GraphML document.
+    :rtype: str
+    """
+    lines = [
+        '<?xml version="1.0" encoding="UTF-8"?>',
+        '<graphml xmlns="http://graphml.graphdrawing.org/xmlns">',
+        '  <key id="distance" for="edge" attr.name="distance" attr.type="double"/>',
+        '  <graph id="mst" edgedefault="undirected">',
+    ]
+    for sample_id in sample_ids:
+        lines.append('    <node id=' + quoteattr(sample_id) + '/>')
+    for parent, child, edge_distance in edges:
+        lines.append('    <edge source=' + quoteattr(parent) + ' target=' + quoteattr(child) + '>')
+        if edge_distance is not None:
+            lines.append('      <data key="distance">' + escape(str(edge_distance)) + '</data>')
+        lines.append('    </edge>')
+    lines.append('  </graph>')
+    lines.append('</graphml>')
+
+    return '\n'.join(lines) + '\n'
+
+
+def to_json(sample_ids, edges):
+    """
+    Format a spanning tree as JSON, with keys `nodes` (sample IDs) and `edges` (`source`, `target` and `distance`).
+
+    :param sample_ids: Sample IDs, as returned by `build_mst`.
+    :type sample_ids: list[str]
+    :param edges: Edges, as returned by `build_mst`.
+    :type edges: list[tuple[str, str, int|float]]
+    :return: JSON document.
+    :rtype: str
+    """
+    tree = {
+        'nodes': list(sample_ids),
+        'edges': [{'source': parent, 'target': child, 'distance': edge_distance} for parent, child, edge_distance in edges],
+    }
+
+    return json.dumps(tree, indent=2)
+
+
+FORMATS = {
+    'newick': to_newick,
+    'graphml': to_graphml,
+    'json': to_json,
+}
@@ -1,35 +1,284 @@
+import bz2
+import collections
+import concurrent.futures
 import csv
 import datetime
+import functools
+import gzip
+import io
 import json
+import logging
 
-### Samples
-def parse_samples(samples_path):
-    samples = []
-    with open(samples_path, 'r') as f:
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+from .records import *
+
+# Size of the byte ranges parsed by each worker process in parallel mode.
+CHUNK_SIZE = 64 * 1024 * 1024
+
+# Errors raised by the row parsers on malformed rows.
+_ROW_ERRORS = (KeyError, ValueError, IndexError, TypeError)
+
+
+def _compression(path):
+    """
+    Compression of an input file, from its extension: `gz`, `bz2`, `zst` or None.
+    """
+    path = str(path)
+    for extension in ['gz', 'bz2', 'zst']:
+        if path.endswith('.' + extension):
+            return extension
+
+    return None
+
+
+def open_input(path):
+    """
+    Open an input file for reading as text. Files ending in `.gz`, `.bz2` or
+    `.zst` are decompressed as they are read, without temporary files.
+    Reading `.zst` files needs the optional `zstandard` package.
+
+    :param path: Path to input file.
+    :type path: str
+    :return: Text file object.
+    :rtype: io.TextIOBase
+    """
+    compression = _compression(path)
+    if compression == 'gz':
+        return gzip.open(path, 'rt')
+    if compression == 'bz2':
+        return bz2.open(path, 'rt')
+    if compression == 'zst':
+        if zstandard is None:
+            raise ImportError('reading ' + str(path) + ' needs the zstandard package: pip install zstandard')
+        return io.TextIOWrapper(zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), closefd=True))
+
+    return open(path, 'r')
+
+
+class ParseError(ValueError):
+    """
+    A row of an input file could not be parsed.
+    """
+
+    def __init__(self, path: str, line_number: int, message: str):
+        super().__init__(str(path) + ', line ' + str(line_number) + ': ' + message)
+        self.path = path
+        self.line_number = line_number
+
+
+def _describe_row_error(error):
+    return type(error).__name__ + ': ' + str(error)
+
+
+def _chunk_ranges(path, chunk_size=CHUNK_SIZE):
+    """
+    Split a csv file after its header line into byte ranges of about
+    `chunk_size` bytes, each extended to end on a line boundary. A line
+    boundary may fall inside a quoted field with a line break, which
+    `_iter_records_parallel` detects.
+
+    :return: Header line, and `(start, end)` offsets of each range.
+    :rtype: tuple[bytes, list[tuple[int, int]]]
+    """
+    ranges = []
+    with open(path, 'rb') as f:
+        header = f.readline()
+        start = f.tell()
+        f.seek(0, 2)
+        size = f.tell()
+        while start < size:
+            f.seek(min(start + chunk_size, size))
+            f.readline()
+            end = f.tell()
+            ranges.append((start, end))
+            start = end
+
+    return header, ranges
+
+
+def _parse_chunk(path, fieldnames, start, end, row_parser):
+    """
+    Parse the rows in one byte range of a csv file, in a worker process.
+
+    :return: Parsed rows up to the first bad row, number of lines in the range,
+             number of quote characters in the range, and for the first bad row
+             its line number within the range and the error.
+    :rtype: tuple[list, int, int, tuple[int, str]|NoneType]
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        data = f.read(end - start)
+    num_lines = data.count(b'\n') + (1 if data and not data.endswith(b'\n') else 0)
+    num_quotes = data.count(b'"')
+
+    rows = []
+    reader = csv.DictReader(io.TextIOWrapper(io.BytesIO(data), newline=''), fieldnames=fieldnames)
+    for row in reader:
+        try:
+            rows.append(row_parser(row))
+        except _ROW_ERRORS as e:
+            return rows, num_lines, num_quotes, (reader.line_num, _describe_row_error(e))
+
+    return rows, num_lines, num_quotes, None
+
+
+def _iter_records_from(path, row_parser, fieldnames, start, line_number):
+    """
+    Parse the rows of an uncompressed csv file from byte offset `start` to the
+    end, in this process.
+
+    :param line_number: Line number of the last line before `start`.
+    :type line_number: int
+    """
+    with open(path, 'rb') as f:
+        f.seek(start)
+        reader = csv.DictReader(io.TextIOWrapper(f, newline=''), fieldnames=fieldnames)
+        for row in reader:
+            try:
+                record = row_parser(row)
+            except _ROW_ERRORS as e:
+                raise ParseError(path, line_number + reader.line_num, _describe_row_error(e)) from e
+            yield record
+
+
+def _iter_records_parallel(path, row_parser, processes, chunk_size):
+    header, ranges = _chunk_ranges(path, chunk_size)
+    fieldnames = next(csv.reader(io.TextIOWrapper(io.BytesIO(header), newline='')), None)
+    if fieldnames is None:
+        return
+    if header.count(b'"') % 2 == 1:
+        logging.warning('quoted line break in the header of ' + str(path) + ', parsing it in one process')
+        yield from _iter_records(path, row_parser)
+        return
+    ranges = iter(ranges)
+
+    # Line number of the last line before the next range; the header is line 1.
+    line_number = 1
+    # Offset to parse the rest of the file from in this process, if a range ends inside a quoted field.
+    serial_start = None
+    with concurrent.futures.ProcessPoolExecutor(max_workers=processes) as executor:
+        # A few ranges per process are in flight at once, so memory use doesn't grow with the file.
+        pending = collections.deque()
+        for start, end in ranges:
+            pending.append((start, executor.submit(_parse_chunk, path, fieldnames, start, end, row_parser)))
+            if len(pending) == 2 * processes:
+                break
+        # Whether the ranges so far end inside a quoted field, from the parity of their quote characters.
+        in_quotes = False
+        while pending:
+            start, future = pending.popleft()
+            rows, num_lines, num_quotes, error = future.result()
+            in_quotes ^= num_quotes % 2 == 1
+            if in_quotes:
+                # The range ends inside a quoted field with a line break, so its last row was split.
+                serial_start = start
+            else:
+                next_range = next(ranges, None)
+                if next_range is not None:
+                    pending.append((next_range[0], executor.submit(_parse_chunk, path, fieldnames, next_range[0], next_range[1], row_parser)))
+            if serial_start is not None or error is not None:
+                for pending_start, pending_future in pending:
+                    pending_future.cancel()
+            if serial_start is not None:
+                break
+            if error is not None:
+                raise ParseError(path, line_number + error[0], error[1])
+            line_number += num_lines
+            yield from rows
+
+    if serial_start is not None:
+        logging.warning('quoted line break in ' + str(path) + ' after line ' + str(line_number) + ', parsing the rest of it in one process')
+        yield from _iter_records_from(path, row_parser, fieldnames, serial_start, line_number)
+
+
+def _iter_records(path, row_parser, processes=None, chunk_size=CHUNK_SIZE):
+    """
+    Parse the rows of a csv file with a header line, in file order.
+
+    With more than one process, the file is split into byte ranges aligned to
+    line boundaries, which are parsed by a pool of worker processes and merged
+    back in file order. From the first range that ends inside a quoted field
+    with a line break (detected by an odd number of `"` so far, so a stray
+    quote in an unquoted field also triggers it), the rest of the file is
+    parsed in this process. Compressed files can't be split, so they are always
+    parsed in this process. Either way, the first bad row in the file is
+    reported, as a `ParseError` with its line number.
+
+    :param path: Path to csv file.
+    :type path: str
+    :param row_parser: Function that converts a row, as read by `csv.DictReader`, to a record. Must be picklable in parallel mode.
+    :type row_parser: Callable[[dict[str, str]], object]
+    :param processes: Number of worker processes. If None or 1, the file is parsed in this process.
+    :type processes: int|NoneType
+    :param chunk_size: Approximate size in bytes of the ranges parsed by each worker.
+    :type chunk_size: int
+    :return: Iterator of records.
+    :rtype: Iterator[object]
+    """
+    if processes is not None and processes > 1 and _compression(path) is None:
+        yield from _iter_records_parallel(path, row_parser, processes, chunk_size)
+        return
+
+    with open_input(path) as f:
         reader = csv.DictReader(f)
         for row in reader:
-            dt = datetime.datetime.strptime(row['collection_date'], "%Y-%m-%d")
-            d = datetime.date(dt.year,dt.month,dt.day)
-            sample = {
-                'sample_id': row['sample_id'],
-                'collection_date': d,
-            }
-            samples.append(sample)
+            try:
+                record = row_parser(row)
+            except _ROW_ERRORS as e:
+                raise ParseError(path, reader.line_num, _describe_row_error(e)) from e
+            yield record
+
+
+### Samples
+def _sample_record(row):
+    dt = datetime.datetime.strptime(row['collection_date'], "%Y-%m-%d")
+    d = datetime.date(dt.year,dt.month,dt.day)
+
+    return SampleRecord(
+        sample_id = row['sample_id'],
+        collection_date = d,
+    )
+
+
+def parse_samples(samples_path, processes=None):
+    """
+    Parse a samples csv file.
+
+    :param samples_path: Path to samples csv file.
+    :type samples_path: str
+    :param processes: Number of worker processes to parse with (see `_iter_records`).
+    :type processes: int|NoneType
+    :return: Samples, in file order.
+    :rtype: list[records.SampleRecord]
+    """
+    samples = list(_iter_records(samples_path, _sample_record, processes))
 
     return samples
     
 # cgmlst cluster
-def parse_cgmlst_cluster(samples_path):
-    samples = []
-    with open(samples_path, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
+def _cgmlst_cluster_record(row):
+    return CgmlstClusterRecord(
+        sample_id = row['sample_id'][:6],
+        cluster = row['clusters_cgmlst'],
+    )
 
-            sample = {
-                'sample_id': row['sample_id'][:6],
-                'cluster':row['clusters_cgmlst'],
-            }
-            samples.append(sample)
+
+def parse_cgmlst_cluster(samples_path, processes=None):
+    """
+    Parse a cgMLST cluster csv file.
+
+    :param samples_path: Path to cgMLST cluster csv file.
+    :type samples_path: str
+    :param processes: Number of worker processes to parse with (see `_iter_records`).
+    :type processes: int|NoneType
+    :return: Cluster assignments, in file order.
+    :rtype: list[records.CgmlstClusterRecord]
+    """
+    samples = list(_iter_records(samples_path, _cgmlst_cluster_record, processes))
 
     return samples
 
@@ -74,15 +323,89 @@ def _miru_clean_fieldname(fieldname: str) -> str:
 
     return clean_fieldname
 
+
+# Cleaned MIRU csv fieldnames that are renamed to `records.MiruRecord` fields.
+_MIRU_FIELDNAME_TRANSLATION = {
+    'key': 'sample_id',
+    'acc_num': 'accession',
+    'miru_02': 'vntr_locus_position_154',
+    'miru_04': 'vntr_locus_position_580',
+    'miru_10': 'vntr_locus_position_960',
+    'miru_16': 'vntr_locus_position_1644',
+    'miru_20': 'vntr_locus_position_2059',
+    'miru_23': 'vntr_locus_position_2531',
+    'miru_24': 'vntr_locus_position_2687',
+    'miru_26': 'vntr_locus_position_2996',
+    'miru_27': 'vntr_locus_position_3007',
+    'miru_31': 'vntr_locus_position_3192',
+    'miru_39': 'vntr_locus_position_4348',
+    'miru_40': 'vntr_locus_position_802',
+    '424': 'vntr_locus_position_424',
+    '577': 'vntr_locus_position_577',
+    "1955": 'vntr_locus_position_1955',
+    "2163": 'vntr_locus_position_2163',
+    "2165": 'vntr_locus_position_2165',
+    "2347": 'vntr_locus_position_2347',
+    "2401": 'vntr_locus_position_2401',
+    "2461": 'vntr_locus_position_2461',
+    "3171": 'vntr_locus_position_3171',
+    "3690": 'vntr_locus_position_3690',
+    "4052": 'vntr_locus_position_4052',
+    "4156": 'vntr_locus_position_4156',
+}
+
+
+# Index of each `records.MiruRecord` field in its constructor arguments.
+_MIRU_FIELD_INDEX = {field: index for index, field in enumerate(MiruRecord.__slots__)}
+
+
+@functools.lru_cache(maxsize=None)
+def _miru_field(fieldname):
+    """
+    Cleaned and translated MIRU csv fieldname. Cached, since every row repeats the header.
+    """
+    cleaned_fieldname = _miru_clean_fieldname(fieldname)
+
+    return _MIRU_FIELDNAME_TRANSLATION.get(cleaned_fieldname, cleaned_fieldname)
+
+
+def _miru_record(row):
+    values = [ABSENT] * len(MiruRecord.__slots__)
+    for k, v in row.items():
+        field = _miru_field(k)
+        if field == "year_tested":
+            field = "quarter_tested"
+            v = _miru_convert_quarterly_format(v)
+            try:
+                year_tested = v.split('-')[0]
+            except IndexError as e:
+                year_tested = None
+            values[_MIRU_FIELD_INDEX['year_tested']] = year_tested
+        elif field == 'collection_date':
+            v = _miru_convert_date(v)
+
+        v = v.strip()
+        if v == "":
+            v = None
+        elif field == 'collection_date':
+            v = datetime.date.fromisoformat(v)
+        index = _MIRU_FIELD_INDEX.get(field)
+        if index is not None:
+            values[index] = v
+
+    return MiruRecord(*values)
+
     
-def parse_miru(miru_path: str) -> dict[str, object]:
+def parse_miru(miru_path: str, processes: int = None) -> dict[str, object]:
     """
     Parse a MIRU csv file.
 
     :param miru_path: Path to MIRU csv file. 
     :type miru_path: str
-    :return: Dict of MIRU profiles, indexed by Sample ID
-    :rtype: dict[str, object]
+    :param processes: Number of worker processes to parse with (see `_iter_records`).
+    :type processes: int|NoneType
+    :return: MIRU profiles, indexed by Sample ID. Columns that are not fields of `records.MiruRecord` are ignored.
+    :rtype: dict[str, records.MiruRecord]
     """
     # doi:10.1371/journal.pone.0149435.t001
     # Table 1
@@ -113,101 +436,57 @@ def parse_miru(miru_path: str) -> dict[str, object]:
         4348: 'MIRU39',
     }
 
-    fieldname_translation = {
-        'key': 'sample_id',
-        'acc_num': 'accession',
-        'miru_02': 'vntr_locus_position_154',
-        'miru_04': 'vntr_locus_position_580',
-        'miru_10': 'vntr_locus_position_960',
-        'miru_16': 'vntr_locus_position_1644',
-        'miru_20': 'vntr_locus_position_2059',
-        'miru_23': 'vntr_locus_position_2531',
-        'miru_24': 'vntr_locus_position_2687',
-        'miru_26': 'vntr_locus_position_2996',
-        'miru_27': 'vntr_locus_position_3007',
-        'miru_31': 'vntr_locus_position_3192',
-        'miru_39': 'vntr_locus_position_4348',
-        'miru_40': 'vntr_locus_position_802',
-        '424': 'vntr_locus_position_424',
-        '577': 'vntr_locus_position_577',
-        "1955": 'vntr_locus_position_1955',
-        "2163": 'vntr_locus_position_2163',
-        "2165": 'vntr_locus_position_2165',
-        "2347": 'vntr_locus_position_2347',
-        "2401": 'vntr_locus_position_2401',
-        "2461": 'vntr_locus_position_2461',
-        "3171": 'vntr_locus_position_3171',
-        "3690": 'vntr_locus_position_3690',
-        "4052": 'vntr_locus_position_4052',
-        "4156": 'vntr_locus_position_4156',
-    }
     miru_by_sample_id = {}
-    with open(miru_path, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            miru = {}
-            for k, v in row.items():
-                cleaned_key = _miru_clean_fieldname(k)
-                if cleaned_key in fieldname_translation:
-                    cleaned_key = fieldname_translation[cleaned_key]
-                elif cleaned_key == "year_tested":
-                    cleaned_key = "quarter_tested"
-                    v = _miru_convert_quarterly_format(v)
-                    try:
-                        year_tested = v.split('-')[0]
-                    except IndexError as e:
-                        year_tested = None
-                    miru['year_tested'] = year_tested
-                elif cleaned_key == 'collection_date':
-                    v = _miru_convert_date(v)
-
-                v = v.strip()
-                if v == "":
-                    v = None
-                miru[cleaned_key] = v
-            miru_by_sample_id[miru['sample_id']] = miru
+    for miru in _iter_records(miru_path, _miru_record, processes):
+        miru_by_sample_id[miru.sample_id] = miru
 
     return miru_by_sample_id
 
 
 ### cgMLST
-def parse_cgmlst(cgmlst_path: str, uncalled='-'):
+def _cgmlst_record(row, uncalled='-'):
+    sample_id = row.pop('sample_id')
+    sample_id = sample_id[:6]
+    profile = row
+    num_total_loci = len(row)
+    num_uncalled_loci = 0
+    for k, v in profile.items():
+        if v == uncalled:
+            num_uncalled_loci += 1
+    if num_total_loci > 0:
+        percent_called = (1 - (float(num_uncalled_loci) / num_total_loci)) * 100
+    else:
+        percent_called = None
+
+    return CgmlstProfileRecord(
+        sample_id = sample_id,
+        profile = profile,
+        percent_called = percent_called,
+    )
+
+
+def parse_cgmlst(cgmlst_path: str, uncalled='-', processes: int = None):
     """
     Parse a cgMLST csv file.
 
     :param cgmlst_path: Path to cgMLST csv file. 
     :type cgmlst_path: str
-    :return: Dictionary of cgMLST profiles, indexed by Sample ID.
-    :rtype: dict[str, object]
+    :param uncalled: Allele of uncalled loci.
+    :type uncalled: str
+    :param processes: Number of worker processes to parse with (see `_iter_records`).
+    :type processes: int|NoneType
+    :return: cgMLST profiles, indexed by Sample ID.
+    :rtype: dict[str, records.CgmlstProfileRecord]
     """
     cgmlst_by_sample_id = {}
-    with open(cgmlst_path, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            sample_id = row.pop('sample_id')
-            sample_id = sample_id[:6]
-            profile = row
-            num_total_loci = len(row)
-            num_uncalled_loci = 0
-            for k, v in profile.items():
-                if v == uncalled:
-                    num_uncalled_loci += 1
-            if num_total_loci > 0:
-                percent_called = (1 - (float(num_uncalled_loci) / num_total_loci)) * 100
-            else:
-                percent_called = None
-
-            cgmlst_by_sample_id[sample_id] = {
-                'sample_id': sample_id,
-                'profile': profile,
-                'percent_called': percent_called
-            }
+    for cgmlst in _iter_records(cgmlst_path, functools.partial(_cgmlst_record, uncalled=uncalled), processes):
+        cgmlst_by_sample_id[cgmlst.sample_id] = cgmlst
 
     return cgmlst_by_sample_id
 
 def parse_run_ids(locations_path):
 
-    with open(locations_path, 'r') as f:
+    with open_input(locations_path) as f:
         reader = csv.DictReader(f)
         runs = {rows['ID'][:6]:rows['R1'].split('/')[6] for rows in reader}
 
@@ -217,47 +496,37 @@ def parse_run_ids(locations_path):
 
 # libraries
 def parse_libraries(qc_path, locations_path):
-    qcs = []
-    with open(qc_path, 'r') as f:
+    qc_by_sample_id = {}
+    with open_input(qc_path) as f:
         reader = csv.DictReader(f)
         for row in reader:
-            qc = {
-                'sample_id': row['sample_id'],
-                'sample_name': row['sample_id'],
-                'most_abundant_species_name':row['most_abundant_species_name'],
+            # The first QC row of a sample is used, if there are several.
+            if row['sample_id'] in qc_by_sample_id:
+                continue
+            qc_by_sample_id[row['sample_id']] = {
+                'most_abundant_species_name': row['most_abundant_species_name'],
                 'most_abundant_species_fraction_total_reads': float(row['most_abundant_species_fraction_total_reads']),
                 'estimated_genome_size_bp': int(row['estimated_genome_size_bp']),
                 'estimated_depth_coverage': float(row['estimated_depth_coverage']),
                 'total_bases': int(row['total_bases']),
                 'average_base_quality': float(row['average_base_quality']),
                 'percent_bases_above_q30': float(row['percent_bases_above_q30']),
-                'percent_gc': float(row['percent_gc'])
+                'percent_gc': float(row['percent_gc']),
             }
-            qcs.append(qc)
 
     locations = []
 
-    with open(locations_path, 'r') as f:
+    with open_input(locations_path) as f:
         reader = csv.DictReader(f)
         for row in reader:
-            qc = [qc for qc in qcs if qc['sample_id'] == row['ID']]
-            print(qc)
-            location = {
-                'sample_id': row['ID'][0:6],
-                'sample_name': row['ID'],
-                'sequencing_run_id':row['R1'].split('/')[6],
-                'R1_location': row['R1'],
-                'R2_location': row['R2'],
-                'most_abundant_species_name': qc[0]['most_abundant_species_name'],
-                'most_abundant_species_fraction_total_reads': qc[0]['most_abundant_species_fraction_total_reads'],
-                'estimated_genome_size_bp': qc[0]['estimated_genome_size_bp'],
-                'estimated_depth_coverage': qc[0]['estimated_depth_coverage'],
-                'total_bases': qc[0]['total_bases'],
-                'average_base_quality': qc[0]['average_base_quality'],
-                'percent_bases_above_q30': qc[0]['percent_bases_above_q30'],
-                'percent_gc': qc[0]['percent_gc'],
-
-            }
+            location = LibraryRecord(
+                sample_id = row['ID'][0:6],
+                sample_name = row['ID'],
+                sequencing_run_id = row['R1'].split('/')[6],
+                R1_location = row['R1'],
+                R2_location = row['R2'],
+                **qc_by_sample_id[row['ID']],
+            )
             locations.append(location)
 
     return locations
@@ -270,54 +539,93 @@ def dict_clean(items):
         result[key] = value
     return result
 
-def parse_complex(complex_path):
-    complexes = []
-    with open(complex_path, 'r') as f:
-        reader = csv.DictReader(f)
-        for row in reader:   
-            complex = {
-                'sample_id': row['sample_id'][:6],
-                'mtbc_prop' : row['MTBC'],
-                'ntm_prop' : row['NTM'],
-                'nonmycobacterium_prop' : row['non-mycobacterium'],
-                'unclassified_prop' : row['unclassified'],
-                'complex' : row['complex'],
-                'reason' : row['reason'],
-                'flag' : row['flag']
-            }
-            complexes.append(complex)
-        dict_str = json.dumps(complexes)
-        my_dict = json.loads(dict_str, object_pairs_hook=dict_clean)
+def _complex_record(row):
+    # Empty fields are read as '0', as `dict_clean` does.
+    row = dict_clean(row.items())
 
-    return my_dict
+    return ComplexRecord(
+        sample_id = row['sample_id'][:6],
+        mtbc_prop = float(row['MTBC']),
+        ntm_prop = float(row['NTM']),
+        nonmycobacterium_prop = float(row['non-mycobacterium']),
+        unclassified_prop = float(row['unclassified']),
+        complex = row['complex'],
+        reason = row['reason'],
+        flag = row['flag'],
+    )
+
+
+def parse_complex(complex_path, processes=None):
+    """
+    Parse a MTBC complex csv file.
+
+    :param complex_path: Path to complex csv file.
+    :type complex_path: str
+    :param processes: Number of worker processes to parse with (see `_iter_records`).
+    :type processes: int|NoneType
+    :return: Complex assignments, in file order.
+    :rtype: list[records.ComplexRecord]
+    """
+    complexes = list(_iter_records(complex_path, _complex_record, processes))
+
+    return complexes
+
+def _species_record(row):
+    return SpeciesRecord(
+        sample_id = row['sample_id'][:6],
+        taxonomy_level = row['taxonomy_lvl'],
+        name = row['name'],
+        ncbi_taxonomy_id = int(row['taxonomy_id']),
+        fraction_total_reads = float(row['fraction_total_reads']),
+        num_assigned_reads = int(row['kraken_assigned_reads']),
+    )
+
+
+def iter_species(speciation_path, top_n=5, processes=None):
+    """
+    Stream the top `top_n` rows for each sample from a Kraken species report.
+
+    Rows are yielded in file order. Reports may contain any number of
+    samples, so a combined summary for a whole run can be loaded in one pass.
+
+    :param speciation_path: Path to species csv file.
+    :type speciation_path: str
+    :param top_n: Maximum number of rows to keep per sample.
+    :type top_n: int
+    :param processes: Number of worker processes to parse with (see `_iter_records`).
+    :type processes: int|NoneType
+    :return: Iterator of species assignments.
+    :rtype: Iterator[records.SpeciesRecord]
+    """
+    num_rows_by_sample_id = {}
+    for speci in _iter_records(speciation_path, _species_record, processes):
+        num_rows = num_rows_by_sample_id.get(speci.sample_id, 0)
+        if num_rows >= top_n:
+            continue
+        num_rows_by_sample_id[speci.sample_id] = num_rows + 1
+        yield speci
+
+
+def parse_species(speciation_path, top_n=5, processes=None):
+    """
+    Parse a Kraken species report, keeping the top `top_n` rows per sample.
+
+    :param speciation_path: Path to species csv file.
+    :type speciation_path: str
+    :param top_n: Maximum number of rows to keep per sample.
+    :type top_n: int
+    :param processes: Number of worker processes to parse with (see `_iter_records`).
+    :type processes: int|NoneType
+    :return: Species assignments.
+    :rtype: list[records.SpeciesRecord]
+    """
+    species = list(iter_species(speciation_path, top_n, processes))
 
-def parse_species(speciation_path):
-    species = []
-    
-    with open(speciation_path, 'r') as f:
-        reader = csv.DictReader(f)
-        count = 0
-        for row in reader:
-            if count == 5: #get only top 5 
-                break
-            else:
-                speci = {
-                    'sample_id': row['sample_id'][:6],
-                    'taxonomy_level' : row['taxonomy_lvl'],
-                    'name' : row['name'],
-                    'ncbi_taxonomy_id' : row['taxonomy_id'],
-                    'fraction_total_reads' : row['fraction_total_reads'],
-                    'num_assigned_reads' : row['kraken_assigned_reads']
-                    
-                }
-                species.append(speci)
-                count+=1
-    
     return species
 
 def parse_amr_summary(amr_path):
     
-    f = open(amr_path)
+    f = open_input(amr_path)
   
     # returns JSON object as 
     # a dictionary
@@ -0,0 +1,195 @@
+import contextlib
+import functools
+import inspect
+import time
+
+from sqlalchemy import event
+
+import tb_db.bulk_load as bulk_load
+import tb_db.crud as crud
+
+# Name used for statements executed outside any instrumented function.
+UNATTRIBUTED = '<other>'
+
+
+class QueryProfiler:
+    """
+    Records, per instrumented function, the number of calls, SQL statements,
+    rows, commits, and time spent in the database versus in Python.
+
+    Rows are counted from the driver's `cursor.rowcount`, which psycopg2 reports
+    for SELECT statements but sqlite3 only reports for INSERT/UPDATE/DELETE.
+    Statements and time are attributed to the innermost instrumented function
+    that is running, so a function's totals don't include the functions it calls.
+    """
+
+    def __init__(self, engine):
+        self.engine = engine
+        self.stats_by_name = {}
+        self._call_stack = []
+        self._statement_start_times = []
+
+    def _stats(self, name):
+        if name not in self.stats_by_name:
+            self.stats_by_name[name] = {
+                'calls': 0,
+                'statements': 0,
+                'rows': 0,
+                'commits': 0,
+                'db_seconds': 0.0,
+                'total_seconds': 0.0,
+                'nested_seconds': 0.0,
+            }
+
+        return self.stats_by_name[name]
+
+    def _current_name(self):
+        if self._call_stack:
+            return self._call_stack[-1]
+
+        return UNATTRIBUTED
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        self._statement_start_times.append(time.perf_counter())
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - self._statement_start_times.pop()
+        stats = self._stats(self._current_name())
+        stats['statements'] += 1
+        stats['db_seconds'] += elapsed
+        if cursor.rowcount is not None and cursor.rowcount > 0:
+            stats['rows'] += cursor.rowcount
+
+    def _commit(self, conn):
+        self._stats(self._current_name())['commits'] += 1
+
+    def start(self):
+        event.listen(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.listen(self.engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.listen(self.engine, 'commit', self._commit)
+
+    def stop(self):
+        event.remove(self.engine, 'before_cursor_execute', self._before_cursor_execute)
+        event.remove(self.engine, 'after_cursor_execute', self._after_cursor_execute)
+        event.remove(self.engine, 'commit', self._commit)
+
+    def wrap(self, name, function):
+        """
+        Wrap a function so that its calls are recorded under `name`.
+        """
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            stats = self._stats(name)
+            stats['calls'] += 1
+            self._call_stack.append(name)
+            start = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - start
+                stats['total_seconds'] += elapsed
+                self._call_stack.pop()
+                if self._call_stack:
+                    self._stats(self._call_stack[-1])['nested_seconds'] += elapsed
+
+        wrapper.__wrapped_by_profiler__ = True
+
+        return wrapper
+
+    def summary(self):
+        """
+        Recorded statistics, one dict per function, slowest first.
+
+        `python_seconds` is the time spent in the function itself, outside of
+        database calls and outside of any instrumented functions it calls.
+
+        :return: Statistics per function.
+        :rtype: list[dict[str, object]]
+        """
+        summary = []
+        for name, stats in self.stats_by_name.items():
+            row = dict(stats, name=name)
+            row['python_seconds'] = max(stats['total_seconds'] - stats['db_seconds'] - stats['nested_seconds'], 0.0)
+            summary.append(row)
+        summary.sort(key=lambda row: max(row['total_seconds'], row['db_seconds']), reverse=True)
+
+        return summary
+
+    def format_summary(self):
+        """
+        Recorded statistics as a plain-text table.
+
+        :return: Table.
+        :rtype: str
+        """
+        header = ['function', 'calls', 'statements', 'rows', 'commits', 'db_s', 'python_s']
+        rows = [header]
+        for stats in self.summary():
+            rows.append([
+                stats['name'],
+                str(stats['calls']),
+                str(stats['statements']),
+                str(stats['rows']),
+                str(stats['commits']),
+                '{:.3f}'.format(stats['db_seconds']),
+                '{:.3f}'.format(stats['python_seconds']),
+            ])
+        widths = [max(len(row[i]) for row in rows) for i in range(len(header))]
+        lines = []
+        for row in rows:
+            cells = [row[0].ljust(widths[0])] + [cell.rjust(width) for cell, width in zip(row[1:], widths[1:])]
+            lines.append('  '.join(cells))
+
+        return '\n'.join(lines)
+
+
+def _public_functions(module):
+    for name, member in vars(module).items():
+        if name.startswith('_') or not inspect.isfunction(member):
+            continue
+        if member.__module__ != module.__name__:
+            continue
+        yield name, member
+
+
+@contextlib.contextmanager
+def profile_queries(engine, modules=(crud, bulk_load), enabled=True, report_file=None):
+    """
+    Record query counts and latency for every public function in `modules` while the block runs.
+
+    Functions are replaced with recording wrappers on entry and restored on exit,
+    so there is no overhead when profiling is not in use.
+
+    :param engine: Engine whose statements are recorded.
+    :type engine: sqlalchemy.engine.Engine
+    :param modules: Modules whose public functions are instrumented.
+    :type modules: tuple[module]
+    :param enabled: If False, do nothing and yield None, so callers can pass a command-line flag straight through.
+    :type enabled: bool
+    :param report_file: If given, the summary table is written to this file when the block exits.
+    :type report_file: file
+    :return: Profiler.
+    :rtype: Iterator[QueryProfiler|NoneType]
+    """
+    if not enabled:
+        yield None
+        return
+
+    profiler = QueryProfiler(engine)
+    originals = []
+    for module in modules:
+        for name, function in list(_public_functions(module)):
+            if getattr(function, '__wrapped_by_profiler__', False):
+                continue
+            originals.append((module, name, function))
+            setattr(module, name, profiler.wrap(module.__name__.split('.')[-1] + '.' + name, function))
+
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        for module, name, function in originals:
+            setattr(module, name, function)
+        if report_file is not None:
+            print(profiler.format_summary(), file=report_file)
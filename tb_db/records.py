@@ -0,0 +1,350 @@
+import dataclasses
+import datetime
+
+
+class _Absent:
+    """
+    Type of `ABSENT`. Pickles by name, so records parsed in worker processes
+    keep the same sentinel.
+    """
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return 'ABSENT'
+
+    def __reduce__(self):
+        return 'ABSENT'
+
+
+# Value of a field whose column is not in the input at all, as opposed to a
+# blank cell (None). Absent fields are left out of key access, like a missing
+# key of the dicts the parsers used to return.
+ABSENT = _Absent()
+
+
+class Record:
+    """
+    Base class of the parsed row types produced by `tb_db.parsers`.
+
+    Records are dataclasses with `__slots__`, so each row only stores its
+    field values. They also support read access by key (`record['sample_id']`,
+    `record.get(...)`, `keys()`, `items()`), so code written against the
+    dicts the parsers used to return keeps working unchanged. Code on the hot
+    path (`tb_db.crud`, `tb_db.bulk_load`) reads fields as attributes instead,
+    which skips the key lookup. `__slots__` are declared by hand, since
+    `dataclass(slots=True)` needs Python 3.10.
+    """
+
+    __slots__ = ()
+
+    # Fields that `from_dict` sets to `ABSENT` if they are missing; all others are required.
+    _OPTIONAL_FIELDS = frozenset()
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls.as_dict = _make_as_dict(cls)
+
+    @classmethod
+    def from_dict(cls, row):
+        """
+        Build a record from a dict with (at least) the record's fields as keys.
+
+        :param row: Field values, indexed by field name. Other keys are ignored.
+        :type row: dict[str, object]
+        :return: Record. Optional fields missing from `row` are `ABSENT`.
+        :rtype: Record
+        :raises KeyError: If a required field is missing from `row`.
+        """
+        return cls(*[row.get(field, ABSENT) if field in cls._OPTIONAL_FIELDS else row[field] for field in cls.__slots__])
+
+    def __getitem__(self, key):
+        try:
+            value = getattr(self, key)
+        except (AttributeError, TypeError):
+            raise KeyError(key)
+        if value is ABSENT:
+            raise KeyError(key)
+
+        return value
+
+    def __contains__(self, key):
+        return key in self.__slots__ and getattr(self, key) is not ABSENT
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def keys(self):
+        return [field for field in self.__slots__ if getattr(self, field) is not ABSENT]
+
+    def values(self):
+        return [getattr(self, field) for field in self.keys()]
+
+    def items(self):
+        return [(field, getattr(self, field)) for field in self.keys()]
+
+    def as_dict(self):
+        """
+        :return: Field values, indexed by field name. Absent fields are left out.
+        :rtype: dict[str, object]
+        """
+        return dict(self.items())
+
+
+def _make_as_dict(cls):
+    """
+    Generate `as_dict` for a record class, as a single dict display over its
+    fields, like `dataclasses` generates `__init__`. `utils.content_hash` calls
+    it for every hashed row, where a generic loop over the fields costs about
+    three times as much.
+    """
+    lines = ['def as_dict(self):']
+    lines.append('    row = {' + ', '.join('%r: self.%s' % (field, field) for field in cls.__slots__) + '}')
+    for field in cls.__slots__:
+        if field in cls._OPTIONAL_FIELDS:
+            lines.append('    if row[%r] is ABSENT:' % field)
+            lines.append('        del row[%r]' % field)
+    lines.append('    return row')
+    namespace = {}
+    exec('\n'.join(lines), {'ABSENT': ABSENT}, namespace)
+    as_dict = namespace['as_dict']
+    as_dict.__qualname__ = cls.__qualname__ + '.as_dict'
+    as_dict.__doc__ = Record.as_dict.__doc__
+
+    return as_dict
+
+
+def iter_records(rows, record_type):
+    """
+    Convert rows to records of one type, so they can be read by attribute.
+    Records of that type are kept as they are; dicts go through `Record.from_dict`.
+
+    :param rows: Rows, as dicts or records.
+    :type rows: Iterable[dict[str, object]|Record]
+    :param record_type: Record class, e.g. `LibraryRecord`.
+    :type record_type: type
+    :return: Iterator of records, in the same order.
+    :rtype: Iterator[Record]
+    """
+    for row in rows:
+        yield row if type(row) is record_type else record_type.from_dict(row)
+
+
+def as_records(rows, record_type):
+    """
+    Like `iter_records`, but returns a list, for callers that read the rows more than once.
+
+    :param rows: Rows, as dicts or records.
+    :type rows: Iterable[dict[str, object]|Record]
+    :param record_type: Record class, e.g. `LibraryRecord`.
+    :type record_type: type
+    :return: Records, in the same order.
+    :rtype: list[Record]
+    """
+    return list(iter_records(rows, record_type))
+
+
+@dataclasses.dataclass
+class SampleRecord(Record):
+    """
+    One row of a samples csv file, as parsed by `parsers.parse_samples`.
+    """
+
+    __slots__ = ('sample_id', 'collection_date')
+
+    sample_id: str
+    collection_date: datetime.date
+
+
+@dataclasses.dataclass
+class CgmlstClusterRecord(Record):
+    """
+    One row of a cgMLST cluster csv file, as parsed by `parsers.parse_cgmlst_cluster`.
+    """
+
+    __slots__ = ('sample_id', 'cluster')
+
+    sample_id: str
+    cluster: str
+
+
+@dataclasses.dataclass
+class CgmlstProfileRecord(Record):
+    """
+    One cgMLST allele profile, as parsed by `parsers.parse_cgmlst`.
+    """
+
+    __slots__ = ('sample_id', 'profile', 'percent_called')
+
+    sample_id: str
+    profile: dict[str, str]
+    percent_called: float
+
+
+@dataclasses.dataclass
+class LibraryRecord(Record):
+    """
+    One sequencing library with its QC, as parsed by `parsers.parse_libraries`.
+    """
+
+    __slots__ = (
+        'sample_id',
+        'sample_name',
+        'sequencing_run_id',
+        'R1_location',
+        'R2_location',
+        'most_abundant_species_name',
+        'most_abundant_species_fraction_total_reads',
+        'estimated_genome_size_bp',
+        'estimated_depth_coverage',
+        'total_bases',
+        'average_base_quality',
+        'percent_bases_above_q30',
+        'percent_gc',
+    )
+
+    _OPTIONAL_FIELDS = frozenset(['R1_location', 'R2_location'])
+
+    sample_id: str
+    sample_name: str
+    sequencing_run_id: str
+    R1_location: str
+    R2_location: str
+    most_abundant_species_name: str
+    most_abundant_species_fraction_total_reads: float
+    estimated_genome_size_bp: int
+    estimated_depth_coverage: float
+    total_bases: int
+    average_base_quality: float
+    percent_bases_above_q30: float
+    percent_gc: float
+
+
+@dataclasses.dataclass
+class ComplexRecord(Record):
+    """
+    One MTBC complex assignment, as parsed by `parsers.parse_complex`.
+    """
+
+    __slots__ = (
+        'sample_id',
+        'mtbc_prop',
+        'ntm_prop',
+        'nonmycobacterium_prop',
+        'unclassified_prop',
+        'complex',
+        'reason',
+        'flag',
+    )
+
+    sample_id: str
+    mtbc_prop: float
+    ntm_prop: float
+    nonmycobacterium_prop: float
+    unclassified_prop: float
+    complex: str
+    reason: str
+    flag: str
+
+
+@dataclasses.dataclass
+class SpeciesRecord(Record):
+    """
+    One species assignment from a Kraken report, as parsed by `parsers.iter_species`.
+    """
+
+    __slots__ = (
+        'sample_id',
+        'taxonomy_level',
+        'name',
+        'ncbi_taxonomy_id',
+        'fraction_total_reads',
+        'num_assigned_reads',
+    )
+
+    sample_id: str
+    taxonomy_level: str
+    name: str
+    ncbi_taxonomy_id: int
+    fraction_total_reads: float
+    num_assigned_reads: int
+
+
+@dataclasses.dataclass
+class MiruRecord(Record):
+    """
+    One MIRU-VNTR profile, as parsed by `parsers.parse_miru`. Copy numbers are
+    kept as strings, since uncalled loci are reported as `-`. Fields whose
+    columns are not in the input (e.g. loci of 12 or 15 locus typing) are `ABSENT`.
+    """
+
+    __slots__ = (
+        'sample_id',
+        'cluster',
+        'accession',
+        'source',
+        'collection_date',
+        'year_tested',
+        'quarter_tested',
+        'miru_pattern',
+        'vntr_locus_position_154',
+        'vntr_locus_position_424',
+        'vntr_locus_position_577',
+        'vntr_locus_position_580',
+        'vntr_locus_position_802',
+        'vntr_locus_position_960',
+        'vntr_locus_position_1644',
+        'vntr_locus_position_1955',
+        'vntr_locus_position_2059',
+        'vntr_locus_position_2163',
+        'vntr_locus_position_2165',
+        'vntr_locus_position_2347',
+        'vntr_locus_position_2401',
+        'vntr_locus_position_2461',
+        'vntr_locus_position_2531',
+        'vntr_locus_position_2687',
+        'vntr_locus_position_2996',
+        'vntr_locus_position_3007',
+        'vntr_locus_position_3171',
+        'vntr_locus_position_3192',
+        'vntr_locus_position_3690',
+        'vntr_locus_position_4052',
+        'vntr_locus_position_4156',
+        'vntr_locus_position_4348',
+    )
+
+    # MIRU profiles are passed to `crud.create_miru_profiles` indexed by sample ID, without it.
+    _OPTIONAL_FIELDS = frozenset(__slots__)
+
+    sample_id: str
+    cluster: str
+    accession: str
+    source: str
+    collection_date: datetime.date
+    year_tested: str
+    quarter_tested: str
+    miru_pattern: str
+    vntr_locus_position_154: str
+    vntr_locus_position_424: str
+    vntr_locus_position_577: str
+    vntr_locus_position_580: str
+    vntr_locus_position_802: str
+    vntr_locus_position_960: str
+    vntr_locus_position_1644: str
+    vntr_locus_position_1955: str
+    vntr_locus_position_2059: str
+    vntr_locus_position_2163: str
+    vntr_locus_position_2165: str
+    vntr_locus_position_2347: str
+    vntr_locus_position_2401: str
+    vntr_locus_position_2461: str
+    vntr_locus_position_2531: str
+    vntr_locus_position_2687: str
+    vntr_locus_position_2996: str
+    vntr_locus_position_3007: str
+    vntr_locus_position_3171: str
+    vntr_locus_position_3192: str
+    vntr_locus_position_3690: str
+    vntr_locus_position_4052: str
+    vntr_locus_position_4156: str
+    vntr_locus_position_4348: str
@@ -0,0 +1,130 @@
+import logging
+
+import numpy as np
+
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+
+from .models import *
+
+import tb_db.distance as distance
+
+# Defaults used by `find_transmission_links`.
+DEFAULT_MAX_DISTANCE = 5
+DEFAULT_MAX_DAYS = 365
+
+# Samples (in collection date order) compared against their date window at once.
+SWEEP_BATCH_SIZE = 256
+
+
+def _dated_libraries(db: Session, scheme_id: int = None, sample_ids=None):
+    """
+    Each sample's most recent library with a cgMLST profile, with the sample's collection date.
+
+    :return: Sample IDs, library IDs and collection dates, and the scheme ID of the profiles.
+    :rtype: tuple[list[str], list[int], list[datetime.date], int]
+    """
+    stmt = (
+        select(Sample.sample_id, Sample.collection_date, Library.id, CgmlstAlleleProfile.cgmlst_scheme_id)
+        .join(Library, Library.sample_id == Sample.id)
+        .join(CgmlstAlleleProfile, CgmlstAlleleProfile.library_id == Library.id)
+        .order_by(Library.id)
+    )
+    if scheme_id is not None:
+        stmt = stmt.where(CgmlstAlleleProfile.cgmlst_scheme_id == scheme_id)
+    if sample_ids is None:
+        batches = [None]
+    else:
+        sample_ids = sorted(set(sample_ids))
+        batches = [sample_ids[start:start + distance.LOOKUP_BATCH_SIZE] for start in range(0, len(sample_ids), distance.LOOKUP_BATCH_SIZE)]
+
+    rows_by_sample_id = {}
+    scheme_ids = set()
+    num_undated = 0
+    for batch in batches:
+        batch_stmt = stmt if batch is None else stmt.where(Sample.sample_id.in_(batch))
+        for sample_id, collection_date, library_id, profile_scheme_id in db.execute(batch_stmt):
+            if collection_date is None:
+                num_undated += 1
+                continue
+            rows_by_sample_id[sample_id] = (collection_date, library_id)
+            scheme_ids.add(profile_scheme_id)
+    if num_undated:
+        logging.warning('skipping ' + str(num_undated) + ' cgMLST profiles of samples without a collection date...')
+    if len(scheme_ids) > 1:
+        raise ValueError('samples have cgMLST profiles from more than one scheme; pass scheme_id')
+
+    dated = sorted(rows_by_sample_id.items(), key=lambda item: (item[1][0], item[0]))
+
+    return (
+        [sample_id for sample_id, row in dated],
+        [row[1] for sample_id, row in dated],
+        [row[0] for sample_id, row in dated],
+        scheme_ids.pop() if scheme_ids else scheme_id,
+    )
+
+
+def find_transmission_links(db: Session, max_distance: int = DEFAULT_MAX_DISTANCE, max_days: int = DEFAULT_MAX_DAYS, scheme_id: int = None, sample_ids=None, exclude_loci=None):
+    """
+    Find putative transmission links: pairs of samples whose cgMLST profiles
+    are within `max_distance` alleles and whose collection dates are within `max_days`.
+
+    Samples are sorted by collection date and compared in batches of
+    `SWEEP_BATCH_SIZE`: each batch against the samples from its first one up
+    to the end of its last one's date window. Pairs further apart in time are
+    never compared. Within that range, pairs outside a sample's own window (and
+    each pair's mirror image) are still computed, and then discarded.
+
+    :param db: Database session.
+    :type db: sqlalchemy.orm.Session
+    :param max_distance: Largest allele distance of a link (see `distance.pairwise_distances`).
+    :type max_distance: int
+    :param max_days: Largest number of days between the collection dates of a link.
+    :type max_days: int
+    :param scheme_id: Database ID of the cgMLST scheme, if profiles from more than one scheme are stored.
+    :type scheme_id: int
+    :param sample_ids: Only consider these samples. If None, the whole collection.
+    :type sample_ids: Iterable[str]
+    :param exclude_loci: Loci to leave out of the distances, e.g. as reported by `locus_qc.poor_loci`.
+    :type exclude_loci: Iterable[str]
+    :return: Links, each a dict with keys `sample_id`, `linked_sample_id` (collected on the same day or later), `distance` and `days_apart`, ordered by the first sample's collection date.
+    :rtype: list[dict[str, object]]
+    """
+    dated_sample_ids, library_ids, collection_dates, scheme_id = _dated_libraries(db, scheme_id=scheme_id, sample_ids=sample_ids)
+    found_library_ids, loci, profiles = distance.load_library_profiles(db, scheme_id, library_ids)
+    if found_library_ids != library_ids:
+        found = set(found_library_ids)
+        keep = [i for i, library_id in enumerate(library_ids) if library_id in found]
+        dated_sample_ids = [dated_sample_ids[i] for i in keep]
+        collection_dates = [collection_dates[i] for i in keep]
+
+    locus_mask = None
+    if exclude_loci is not None:
+        exclude_loci = set(exclude_loci)
+        locus_mask = np.array([locus not in exclude_loci for locus in loci], dtype=bool)
+
+    days = np.array([collection_date.toordinal() for collection_date in collection_dates], dtype=np.int64)
+    # End (exclusive) of each sample's date window in the sorted order.
+    window_ends = np.searchsorted(days, days + max_days, side='right')
+
+    links = []
+    for start in range(0, len(days), SWEEP_BATCH_SIZE):
+        end = min(start + SWEEP_BATCH_SIZE, len(days))
+        window_end = int(window_ends[end - 1])
+        if window_end <= start + 1:
+            continue
+        distances = distance.pairwise_distances(profiles[start:end], profiles[start:window_end], locus_mask=locus_mask)
+
+        rows = np.arange(start, end)[:, None]
+        columns = np.arange(start, window_end)[None, :]
+        days_apart = days[columns] - days[rows]
+        is_link = (columns > rows) & (days_apart <= max_days) & (distances <= max_distance)
+        for row, column in zip(*np.nonzero(is_link)):
+            links.append({
+                'sample_id': dated_sample_ids[start + row],
+                'linked_sample_id': dated_sample_ids[start + column],
+                'distance': int(distances[row, column]),
+                'days_apart': int(days_apart[row, column]),
+            })
+
+    return links
@@ -1,6 +1,10 @@
 import datetime
+import hashlib
+import json
 import re
 
+import tb_db.records as records
+
 # https://stackoverflow.com/a/1176023
 def camel_to_snake(name):
     name = re.sub('(.)([A-Z][a-z]+)', r'\1_\2', name)
@@ -17,4 +21,53 @@ def row2dict(row):
 
     return d
 
-    return d
\ No newline at end of file
+
+def _json_default(obj):
+    if hasattr(obj, 'as_dict'):
+        return obj.as_dict()
+
+    return str(obj)
+
+
+# Shared by all `content_hash` calls; `json.dumps` with options builds a new encoder per call.
+_CONTENT_HASH_ENCODER = json.JSONEncoder(sort_keys=True, separators=(',', ':'), default=_json_default)
+
+
+def content_hash(obj):
+    """
+    Stable SHA-256 hex digest of a JSON-serializable object.
+
+    Dict keys are sorted, so two objects with the same content always hash
+    the same regardless of insertion order. Parsed records (see
+    `tb_db.records`) hash the same as dicts with the same fields.
+
+    :param obj: Object to hash.
+    :type obj: object
+    :return: Hex digest.
+    :rtype: str
+    """
+    if isinstance(obj, records.Record):
+        # Converted up front: going through `_json_default` is slower.
+        obj = obj.as_dict()
+    serialized = _CONTENT_HASH_ENCODER.encode(obj)
+
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def file_content_hash(path, chunk_size=1024 * 1024):
+    """
+    SHA-256 hex digest of a file's contents, read in chunks.
+
+    :param path: Path to file.
+    :type path: str
+    :param chunk_size: Bytes read at a time.
+    :type chunk_size: int
+    :return: Hex digest.
+    :rtype: str
+    """
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+
+    return sha256.hexdigest()
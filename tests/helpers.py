@@ -0,0 +1,31 @@
+"""
+Shared test data.
+"""
+
+
+def make_library(sample_id, sequencing_run_id='TESTABC'):
+    """
+    A sequencing library with passing QC, as accepted by `crud.create_libraries`.
+
+    :param sample_id: Sample ID, also used as the sample name.
+    :type sample_id: str
+    :param sequencing_run_id: Sequencing run ID.
+    :type sequencing_run_id: str
+    :return: Library, with its QC fields.
+    :rtype: dict[str, object]
+    """
+    library = {
+        'sample_id': sample_id,
+        'sample_name' : sample_id,
+        'sequencing_run_id': sequencing_run_id,
+        'most_abundant_species_name':'mtb',
+        "most_abundant_species_fraction_total_reads" : 90,
+        "estimated_genome_size_bp" : 12345,
+        "estimated_depth_coverage" : 40,
+        "total_bases" : 12345,
+        "average_base_quality" : 33,
+        "percent_bases_above_q30" : 95,
+        "percent_gc" : 55
+    }
+
+    return library
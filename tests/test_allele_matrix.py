@@ -0,0 +1,101 @@
+import tempfile
+import unittest
+
+import numpy as np
+
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+import tb_db.allele_matrix as allele_matrix
+import tb_db.bulk_load as bulk_load
+import tb_db.crud as crud
+import tb_db.models as models
+
+from helpers import make_library
+
+connection_uri = "sqlite:///:memory:"
+
+
+class TestAlleleMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp_dir.cleanup()
+
+    def test_encode_allele(self):
+        self.assertEqual(allele_matrix.encode_allele('12'), 12)
+        self.assertEqual(allele_matrix.encode_allele('INF-7'), 7)
+        self.assertEqual(allele_matrix.encode_allele('-'), allele_matrix.MISSING_ALLELE)
+        self.assertEqual(allele_matrix.encode_allele('LNF'), allele_matrix.MISSING_ALLELE)
+
+    def test_upsert_and_remove(self):
+        matrix = allele_matrix.AlleleMatrix(self.tmp_dir.name, 1)
+        matrix.upsert({
+            10: {'Rv0001': '1', 'Rv0002': '2'},
+            11: {'Rv0001': '3', 'Rv0002': '-'},
+            12: {'Rv0001': '5'},
+        })
+        matrix.upsert({11: {'Rv0001': '4', 'Rv0002': '4'}})
+
+        reopened = allele_matrix.AlleleMatrix(self.tmp_dir.name, 1)
+        self.assertEqual(reopened.loci, ['Rv0001', 'Rv0002'])
+        self.assertEqual(reopened.library_ids, [10, 11, 12])
+        np.testing.assert_array_equal(reopened.matrix, [[1, 2], [4, 4], [5, 0]])
+
+        self.assertEqual(reopened.remove([11, 99]), 1)
+        self.assertEqual(reopened.library_ids, [10, 12])
+        np.testing.assert_array_equal(reopened.matrix, [[1, 2], [5, 0]])
+        library_ids, rows = reopened.rows([12, 11])
+        self.assertEqual(library_ids, [12])
+        np.testing.assert_array_equal(rows, [[5, 0]])
+
+
+class TestAlleleMatrixMaintenance(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.TemporaryDirectory()
+        allele_matrix.configure(self.tmp_dir.name)
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        libraries = [make_library(sample_id) for sample_id in ['SAM001', 'SAM002']]
+        crud.create_libraries(self.session, libraries)
+        self.runs = {'SAM001': 'TESTABC', 'SAM002': 'TESTABC'}
+        self.scheme = {'name':'Ridom cgMLST.org','version':'2.1','num_loci':2891}
+
+    def tearDown(self):
+        allele_matrix.configure(None)
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+        self.tmp_dir.cleanup()
+
+    def _profiles(self, alleles):
+        return [
+            {'sample_id': sample_id, 'profile': {'Rv0001': allele, 'Rv0002': '1'}, 'percent_called': 100.0}
+            for sample_id, allele in alleles.items()
+        ]
+
+    def test_matrix_follows_crud(self):
+        crud.create_cgmlst_allele_profiles(self.session, self.scheme, self._profiles({'SAM001': '1', 'SAM002': '2'}), self.runs)
+        crud.create_cgmlst_allele_profiles(self.session, self.scheme, self._profiles({'SAM002': '3'}), self.runs)
+        scheme_id = self.session.query(models.CgmlstScheme).one().id
+
+        matrix = allele_matrix.get_allele_matrix(scheme_id)
+        library_ids, rows = matrix.rows(matrix.library_ids)
+        self.assertEqual(len(library_ids), 2)
+        np.testing.assert_array_equal(rows, [[1, 1], [3, 1]])
+
+        crud.delete_samples(self.session, ['SAM001'])
+        matrix.reload()
+        np.testing.assert_array_equal(matrix.matrix, [[3, 1]])
+
+    def test_sync_after_bulk_load(self):
+        bulk_load.load_cgmlst_allele_profiles(self.session, self.scheme, self._profiles({'SAM001': '1', 'SAM002': '2'}), self.runs)
+        scheme_id = self.session.query(models.CgmlstScheme).one().id
+
+        matrix = allele_matrix.get_allele_matrix(scheme_id)
+        np.testing.assert_array_equal(matrix.matrix, [[1, 1], [2, 1]])
+        self.assertEqual(matrix.sync(self.session), {'written': 0, 'removed': 0})
@@ -0,0 +1,79 @@
+import datetime
+import json
+import os
+import unittest
+
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+import tb_db.models as models
+import tb_db.crud as crud
+import tb_db.bulk_load as bulk_load
+import tb_db.parsers as parsers
+
+from helpers import make_library
+
+connection_uri = "sqlite:///:memory:"
+
+test_data_path = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class TestBulkLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        libraries = [make_library(sample_id) for sample_id in ['SAM001', 'SAM002']]
+        crud.create_libraries(self.session, libraries)
+        self.runs = {'SAM001': 'TESTABC', 'SAM002': 'TESTABC', 'SAM003': 'TESTABC'}
+        self.scheme = {'name':'Ridom cgMLST.org','version':'2.1','num_loci':2891}
+
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+
+    def test_load_cgmlst_allele_profiles(self):
+        profiles = [
+            {'sample_id': 'SAM001', 'profile': {'Rv0001': '1', 'Rv0002': '-'}, 'percent_called': 50.0},
+            {'sample_id': 'SAM003', 'profile': {'Rv0001': '1', 'Rv0002': '2'}, 'percent_called': 100.0},
+        ]
+        counts = bulk_load.load_cgmlst_allele_profiles(self.session, self.scheme, profiles, self.runs)
+        self.assertEqual(counts, {'staged': 2, 'inserted': 1, 'updated': 0, 'unchanged': 0, 'skipped': 1})
+
+        counts = bulk_load.load_cgmlst_allele_profiles(self.session, self.scheme, profiles[:1], self.runs)
+        self.assertEqual(counts['unchanged'], 1)
+        self.assertEqual(counts['updated'], 0)
+
+        profiles[0]['profile']['Rv0002'] = '3'
+        counts = bulk_load.load_cgmlst_allele_profiles(self.session, self.scheme, profiles[:1], self.runs)
+        self.assertEqual(counts['updated'], 1)
+
+        db_profile = self.session.query(models.CgmlstAlleleProfile).one()
+        self.assertEqual(json.loads(db_profile.profile), {'Rv0001': '1', 'Rv0002': '3'})
+
+
+    def test_load_miru_profiles(self):
+        miru_profiles_by_sample_id = parsers.parse_miru(os.path.join(test_data_path, 'miru_01.csv'))
+
+        counts = bulk_load.load_miru_profiles(self.session, miru_profiles_by_sample_id)
+        self.assertEqual(counts, {'staged': 1, 'inserted': 1, 'updated': 0})
+        counts = bulk_load.load_miru_profiles(self.session, miru_profiles_by_sample_id)
+        self.assertEqual(counts, {'staged': 1, 'inserted': 0, 'updated': 1})
+
+        self.assertEqual(crud.get_miru_cluster_by_sample_id(self.session, 'S001'), ['CLUST001'])
+        sample = crud.get_sample(self.session, 'S001')
+        self.assertEqual(sample.collection_date, datetime.date(2009, 10, 2))
+        db_profile = self.session.query(models.MiruProfile).one()
+        self.assertEqual(json.loads(db_profile.profile_by_position)['154'], '2')
+
+
+    def test_load_species(self):
+        species = parsers.iter_species(os.path.join(test_data_path, 'species_01.csv'))
+
+        counts = bulk_load.load_species(self.session, species, self.runs)
+
+        self.assertEqual(counts, {'staged': 8, 'deleted': 0, 'inserted': 8, 'skipped': 0})
+        self.assertEqual(self.session.query(models.TbSpecies).count(), 8)
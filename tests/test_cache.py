@@ -0,0 +1,105 @@
+import os
+import tempfile
+import time
+import unittest
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+import tb_db.cache as cache
+import tb_db.crud as crud
+import tb_db.models as models
+
+from helpers import make_library
+
+connection_uri = "sqlite:///:memory:"
+
+
+class TestCacheBackends(unittest.TestCase):
+
+    def test_lru_cache_evicts_and_expires(self):
+        lru_cache = cache.LRUCache(max_entries=2, ttl_seconds=60)
+        lru_cache.set('a', 1)
+        lru_cache.set('b', 2)
+        lru_cache.get('a')
+        lru_cache.set('c', 3)
+
+        self.assertEqual(lru_cache.get('a'), 1)
+        self.assertIs(lru_cache.get('b'), cache.MISSING)
+
+        lru_cache.ttl_seconds = 0
+        lru_cache.set('d', None)
+        time.sleep(0.001)
+        self.assertIs(lru_cache.get('d'), cache.MISSING)
+
+    def test_disk_cache(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'cache.sqlite')
+            disk_cache = cache.DiskCache(path, ttl_seconds=60)
+            disk_cache.set(('cgmlst_cluster', 'db', 'SAM001'), ['BC300'])
+
+            self.assertEqual(cache.DiskCache(path).get(('cgmlst_cluster', 'db', 'SAM001')), ['BC300'])
+            disk_cache.delete(('cgmlst_cluster', 'db', 'SAM001'))
+            self.assertIs(disk_cache.get(('cgmlst_cluster', 'db', 'SAM001')), cache.MISSING)
+
+
+class TestCachedLookups(unittest.TestCase):
+
+    def setUp(self):
+        cache.configure(cache.LRUCache())
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        crud.create_libraries(self.session, [make_library('SAM001')])
+        crud.add_sample_to_cgmlst_cluster(self.session, 'SAM001', {'cluster': 'BC300'}, 'TESTABC')
+
+        self.statements = []
+        event.listen(self.engine, 'before_cursor_execute', self._record_statement)
+
+
+    def tearDown(self):
+        event.remove(self.engine, 'before_cursor_execute', self._record_statement)
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+        cache.configure(cache.LRUCache())
+
+
+    def _record_statement(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+    def test_cgmlst_cluster_lookup_is_cached_and_invalidated(self):
+        self.assertEqual(crud.get_cgmlst_cluster_by_sample_id(self.session, 'SAM001'), ['BC300'])
+        num_statements = len(self.statements)
+        self.assertEqual(crud.get_cgmlst_cluster_by_sample_id(self.session, 'SAM001'), ['BC300'])
+        self.assertEqual(len(self.statements), num_statements)
+
+        crud.add_sample_to_cgmlst_cluster(self.session, 'SAM001', {'cluster': 'BC301'}, 'TESTABC')
+
+        self.assertEqual(crud.get_cgmlst_cluster_by_sample_id(self.session, 'SAM001'), ['BC300', 'BC301'])
+
+
+    def test_get_sample_after_delete(self):
+        sample = crud.get_sample(self.session, 'SAM001')
+        self.assertIs(crud.get_sample(self.session, 'SAM001'), sample)
+
+        crud.delete_samples(self.session, ['SAM001'])
+
+        self.assertIsNone(crud.get_sample(self.session, 'SAM001'))
+
+
+    def test_invalidation_listener(self):
+        invalidated = []
+        cache.add_invalidation_listener(lambda namespace, sample_ids: invalidated.append((namespace, sample_ids)))
+        try:
+            crud.add_sample_to_cgmlst_cluster(self.session, 'SAM001', {'cluster': 'BC301'}, 'TESTABC')
+        finally:
+            cache._invalidation_listeners.clear()
+
+        self.assertEqual(invalidated, [(cache.CGMLST_CLUSTER, ['SAM001'])])
+
+
+if __name__ == '__main__':
+    unittest.main()
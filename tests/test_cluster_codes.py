@@ -0,0 +1,55 @@
+import unittest
+
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+import tb_db.cluster_codes as cluster_codes
+import tb_db.crud as crud
+import tb_db.models as models
+
+from helpers import make_library
+
+connection_uri = "sqlite:///:memory:"
+
+
+class TestClusterCodes(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        self.sample_ids = ['SAM001', 'SAM002', 'SAM003', 'SAM004']
+        libraries = [make_library(sample_id) for sample_id in self.sample_ids]
+        crud.create_libraries(self.session, libraries)
+        self.runs = {sample_id: 'TESTABC' for sample_id in self.sample_ids}
+        self.scheme = {'name':'Ridom cgMLST.org','version':'2.1','num_loci':2891}
+        self.thresholds = [0, 2, 5]
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+    def _load(self, alleles_by_sample_id):
+        profiles = [
+            {'sample_id': sample_id, 'profile': dict(zip(['Rv0001', 'Rv0002', 'Rv0003', 'Rv0004'], alleles)), 'percent_called': 100.0}
+            for sample_id, alleles in alleles_by_sample_id.items()
+        ]
+        crud.create_cgmlst_allele_profiles(self.session, self.scheme, profiles, self.runs, cluster_thresholds=self.thresholds)
+
+    def _codes(self):
+        codes = cluster_codes.get_cluster_codes(self.session, self.sample_ids)
+        return {sample_id: cluster_codes.format_cluster_code(code) for sample_id, code in codes.items()}
+
+    def test_codes_are_assigned_incrementally(self):
+        self._load({'SAM001': '1111', 'SAM003': '2222'})
+        self.assertEqual(self._codes(), {'SAM001': '1.1.1', 'SAM003': '1.2.2'})
+
+        self._load({'SAM002': '1112'})
+        self.assertEqual(self._codes(), {'SAM001': '1.1.1', 'SAM002': '1.1.3', 'SAM003': '1.2.2'})
+
+    def test_linking_library_merges_clusters(self):
+        self._load({'SAM001': '1111', 'SAM003': '2222'})
+        self._load({'SAM004': '1122'})
+
+        self.assertEqual(self._codes(), {'SAM001': '1.1.1', 'SAM003': '1.1.2', 'SAM004': '1.1.3'})
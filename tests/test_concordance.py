@@ -0,0 +1,91 @@
+import unittest
+
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+import tb_db.concordance as concordance
+import tb_db.crud as crud
+import tb_db.models as models
+
+from helpers import make_library
+
+connection_uri = "sqlite:///:memory:"
+
+
+class TestComputeConcordance(unittest.TestCase):
+
+    def test_identical_clusterings(self):
+        result = concordance.compute_concordance(['S1', 'S2', 'S3'], ['A', 'A', 'B'], ['X', 'X', 'Y'])
+
+        self.assertEqual(result['adjusted_rand_index'], 1.0)
+        self.assertEqual(result['wallace_miru_cgmlst'], 1.0)
+        self.assertEqual(result['wallace_cgmlst_miru'], 1.0)
+        self.assertEqual(result['discordant_samples'], [])
+
+    def test_single_sample(self):
+        result = concordance.compute_concordance(['S1'], ['A'], ['X'])
+
+        self.assertEqual(result['num_samples'], 1)
+        self.assertIsNone(result['adjusted_rand_index'])
+        self.assertIsNone(result['wallace_miru_cgmlst'])
+        self.assertIsNone(result['wallace_cgmlst_miru'])
+        self.assertEqual(result['discordant_samples'], [])
+
+    def test_nested_clusterings(self):
+        result = concordance.compute_concordance(['S1', 'S2', 'S3', 'S4'], ['A', 'A', 'A', 'B'], ['X', 'X', 'Y', 'Z'])
+
+        self.assertEqual(result['contingency'], [
+            {'miru_cluster_id': 'A', 'cgmlst_cluster_id': 'X', 'num_samples': 2},
+            {'miru_cluster_id': 'A', 'cgmlst_cluster_id': 'Y', 'num_samples': 1},
+            {'miru_cluster_id': 'B', 'cgmlst_cluster_id': 'Z', 'num_samples': 1},
+        ])
+        # 3 pairs share a MIRU cluster, 1 pair a cgMLST cluster, and 1 pair both.
+        self.assertAlmostEqual(result['wallace_miru_cgmlst'], 1 / 3)
+        self.assertEqual(result['wallace_cgmlst_miru'], 1.0)
+        expected_pairs = 3 * 1 / 6
+        self.assertAlmostEqual(result['adjusted_rand_index'], (1 - expected_pairs) / (2 - expected_pairs))
+        self.assertEqual([row['sample_id'] for row in result['discordant_samples']], ['S1', 'S2', 'S3'])
+        self.assertEqual(result['discordant_samples'][2]['num_miru_only'], 2)
+        self.assertEqual(result['discordant_samples'][2]['num_cgmlst_only'], 0)
+
+
+class TestGetConcordance(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        self.sample_ids = ['SAM001', 'SAM002', 'SAM003']
+        libraries = []
+        for sample_id in self.sample_ids:
+            crud.create_sample(self.session, {'sample_id': sample_id, 'accession': 'ACC' + sample_id, 'collection_date': None})
+            libraries.append(make_library(sample_id))
+        crud.create_libraries(self.session, libraries)
+        self.runs = {sample_id: 'TESTABC' for sample_id in self.sample_ids}
+        for sample_id in self.sample_ids:
+            crud.create_miru_profile(self.session, sample_id, {'cluster': 'MIRU01', 'miru_pattern': '2'})
+        clusters = [
+            {'sample_id': 'SAM001', 'cluster': 'BC300'},
+            {'sample_id': 'SAM002', 'cluster': 'BC300'},
+            {'sample_id': 'SAM003', 'cluster': 'BC301'},
+        ]
+        crud.add_samples_to_cgmlst_clusters(self.session, clusters, self.runs)
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_get_concordance_follows_changes(self):
+        result = concordance.get_concordance(self.session)
+
+        self.assertEqual(result['num_samples'], 3)
+        self.assertEqual([row['sample_id'] for row in result['discordant_samples']], ['SAM001', 'SAM002', 'SAM003'])
+        self.assertIs(concordance.get_concordance(self.session), result)
+
+        crud.delete_samples(self.session, ['SAM003'])
+        result = concordance.get_concordance(self.session)
+
+        self.assertEqual(result['num_samples'], 2)
+        self.assertEqual(result['discordant_samples'], [])
+        self.assertEqual(result['adjusted_rand_index'], 1.0)
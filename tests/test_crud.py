@@ -12,8 +12,12 @@ import alembic.config
 
 import tb_db.models as models
 import tb_db.crud as crud
+import tb_db.db as db
+import tb_db.parsers as parsers
 import tb_db.utils as utils
 
+from helpers import make_library
+
 from hypothesis import settings, Phase, Verbosity, given, note, strategies as st
 from hypothesis.stateful import rule, precondition, RuleBasedStateMachine, Bundle
 
@@ -179,7 +183,429 @@ class TestCrudSample(unittest.TestCase):
         for deleted_sample_record in deleted_sample_records:
             self.assertEqual(sample_id, deleted_sample_record.sample_id)
 
+
+class TestCrudSpecies(unittest.TestCase):
+
+    def setUp(self):
+        alembic.command.upgrade(alembic_cfg, 'head')
+
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        libraries = [make_library(sample_id) for sample_id in ['SAM001', 'SAM002']]
+        self.libraries = crud.create_libraries(self.session, libraries)
+        self.runs = {'SAM001': 'TESTABC', 'SAM002': 'TESTABC'}
+
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+
+    def test_create_species_multiple_samples(self):
+        species_path = os.path.join(os.path.dirname(__file__), 'data', 'species_01.csv')
+        species = parsers.parse_species(species_path)
+
+        created_species = crud.create_species(self.session, species, self.runs)
+
+        self.assertEqual(len(created_species), 8)
+        library_ids = set([speci.library_id for speci in created_species])
+        self.assertEqual(library_ids, set([library.id for library in self.libraries]))
+
+
+    def test_create_species_replaces_existing(self):
+        species = [
+            {'sample_id': 'SAM001', 'taxonomy_level': 'S', 'name': 'Mycobacterium tuberculosis',
+             'ncbi_taxonomy_id': 1773, 'fraction_total_reads': 0.9, 'num_assigned_reads': 900},
+            {'sample_id': 'SAM001', 'taxonomy_level': 'S', 'name': 'Mycobacterium bovis',
+             'ncbi_taxonomy_id': 1765, 'fraction_total_reads': 0.1, 'num_assigned_reads': 100},
+        ]
+        crud.create_species(self.session, species, self.runs)
+        created_species = crud.create_species(self.session, species[:1], self.runs)
+
+        self.assertEqual(len(created_species), 1)
+        self.assertEqual(self.session.query(models.TbSpecies).count(), 1)
+
+
+    def test_create_species_skips_sample_without_library(self):
+        species = [
+            {'sample_id': 'SAM003', 'taxonomy_level': 'S', 'name': 'Mycobacterium tuberculosis',
+             'ncbi_taxonomy_id': 1773, 'fraction_total_reads': 0.9, 'num_assigned_reads': 900},
+        ]
+        created_species = crud.create_species(self.session, species, {'SAM003': 'TESTABC'})
+
+        self.assertEqual(created_species, [])
+
+
+class TestCrudLibrary(unittest.TestCase):
+
+    def setUp(self):
+        alembic.command.upgrade(alembic_cfg, 'head')
+
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        self.library = make_library('SAM001')
+
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+
+    def test_create_libraries_skips_duplicates(self):
+        created_libraries = crud.create_libraries(self.session, [self.library, dict(self.library)])
+        self.assertEqual(len(created_libraries), 1)
+        self.assertIsNotNone(created_libraries[0].qc_hash)
+
+        created_libraries = crud.create_libraries(self.session, [self.library])
+        self.assertEqual(created_libraries, [])
+
+
+    def test_create_libraries_changed_qc(self):
+        crud.create_libraries(self.session, [self.library])
+        changed_library = dict(self.library, percent_gc=65.5)
+        other_sample_library = dict(self.library, sample_id='SAM002', sample_name='SAM002')
+
+        created_libraries = crud.create_libraries(self.session, [changed_library, other_sample_library])
+
+        self.assertEqual(len(created_libraries), 2)
+        self.assertEqual(self.session.query(models.Library).count(), 3)
+        self.assertIsNotNone(crud.get_sample(self.session, 'SAM002'))
+
+
+    def test_create_libraries_backfills_qc_hash(self):
+        crud.create_libraries(self.session, [self.library])
+        self.session.query(models.Library).update({'qc_hash': None})
+        self.session.commit()
+
+        created_libraries = crud.create_libraries(self.session, [self.library])
+
+        self.assertEqual(created_libraries, [])
+        self.assertIsNotNone(self.session.query(models.Library).one().qc_hash)
+
+
+class TestCrudComplex(unittest.TestCase):
+
+    def setUp(self):
+        alembic.command.upgrade(alembic_cfg, 'head')
+
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        libraries = [make_library(sample_id) for sample_id in ['SAM001', 'SAM002']]
+        crud.create_libraries(self.session, libraries)
+        self.runs = {'SAM001': 'TESTABC', 'SAM002': 'TESTABC', 'SAM003': 'TESTABC'}
+
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+
+    def _complex(self, sample_id, flag):
+        return {
+            'sample_id': sample_id,
+            'mtbc_prop': 0.9,
+            'ntm_prop': 0.05,
+            'nonmycobacterium_prop': 0.05,
+            'unclassified_prop': 0,
+            'complex': 'MTBC',
+            'reason': '',
+            'flag': flag,
+        }
+
+
+    def test_create_complexes_outcomes(self):
+        crud.create_complexes(self.session, [self._complex('SAM001', 'PASS')], self.runs)
+
+        complexes = [
+            self._complex('SAM001', 'WARN'),
+            self._complex('SAM002', 'PASS'),
+            self._complex('SAM003', 'PASS'),
+        ]
+        outcomes = crud.create_complexes(self.session, complexes, self.runs)
+
+        self.assertEqual([outcome['outcome'] for outcome in outcomes], ['updated', 'created', 'no_library'])
+        db_complexes = self.session.query(models.TbComplex).order_by(models.TbComplex.id).all()
+        self.assertEqual([db_complex.flag for db_complex in db_complexes], ['WARN', 'PASS'])
+
+
+class TestCrudCgmlstAlleleProfile(unittest.TestCase):
+
+    def setUp(self):
+        alembic.command.upgrade(alembic_cfg, 'head')
+
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        libraries = [make_library(sample_id) for sample_id in ['SAM001', 'SAM002']]
+        crud.create_libraries(self.session, libraries)
+        self.runs = {'SAM001': 'TESTABC', 'SAM002': 'TESTABC', 'SAM003': 'TESTABC'}
+        self.scheme = {'name':'Ridom cgMLST.org','version':'2.1','num_loci':2891}
+
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+
+    def test_create_cgmlst_allele_profiles_writes_only_changes(self):
+        profiles = [
+            {'sample_id': 'SAM001', 'profile': {'Rv0001': '1', 'Rv0002': '-'}, 'percent_called': 50.0},
+            {'sample_id': 'SAM002', 'profile': {'Rv0001': '1', 'Rv0002': '2'}, 'percent_called': 100.0},
+            {'sample_id': 'SAM003', 'profile': {'Rv0001': '1', 'Rv0002': '2'}, 'percent_called': 100.0},
+        ]
+        counts = {}
+        created_profiles = crud.create_cgmlst_allele_profiles(self.session, self.scheme, profiles, self.runs, counts=counts)
+        self.assertEqual(len(created_profiles), 2)
+        self.assertEqual(counts, {'new': 2, 'updated': 0, 'unchanged': 0, 'skipped': 1})
+
+        profiles[0]['profile']['Rv0002'] = '3'
+        profiles[0]['percent_called'] = 100.0
+        created_profiles = crud.create_cgmlst_allele_profiles(self.session, self.scheme, profiles, self.runs, counts=counts)
+        self.assertEqual(created_profiles, [])
+        self.assertEqual(counts, {'new': 0, 'updated': 1, 'unchanged': 1, 'skipped': 1})
+
+        db_profiles = self.session.query(models.CgmlstAlleleProfile).order_by(models.CgmlstAlleleProfile.id).all()
+        self.assertEqual(json.loads(db_profiles[0].profile), {'Rv0001': '1', 'Rv0002': '3'})
+        self.assertEqual(db_profiles[0].profile_hash, crud.cgmlst_allele_profile_hash(profiles[0]))
+
+
+class TestCrudDeleteSamples(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = db.create_engine_from_config({'connection_uri': connection_uri})
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        libraries = [make_library(sample_id) for sample_id in ['SAM001', 'SAM002']]
+        crud.create_libraries(self.session, libraries)
+        runs = {'SAM001': 'TESTABC', 'SAM002': 'TESTABC'}
+        scheme = {'name':'Ridom cgMLST.org','version':'2.1','num_loci':2891}
+        profiles = [
+            {'sample_id': sample_id, 'profile': {'Rv0001': '1'}, 'percent_called': 100.0}
+            for sample_id in ['SAM001', 'SAM002']
+        ]
+        crud.create_cgmlst_allele_profiles(self.session, scheme, profiles, runs)
+        clusters = [{'sample_id': sample_id, 'cluster': 'BC300'} for sample_id in ['SAM001', 'SAM002']]
+        crud.add_samples_to_cgmlst_clusters(self.session, clusters, runs)
+
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+
+    def test_delete_samples(self):
+        deleted_counts = crud.delete_samples(self.session, ['SAM001', 'SAM999'])
+
+        self.assertEqual(deleted_counts['sample'], 1)
+        self.assertEqual(deleted_counts['library'], 1)
+        self.assertEqual(deleted_counts['cgmlst_allele_profile'], 1)
+        self.assertEqual(deleted_counts['association_table_cgmlst'], 1)
+        self.assertIsNone(crud.get_sample(self.session, 'SAM001'))
+        self.assertEqual(self.session.query(models.Library).count(), 1)
+        self.assertEqual(self.session.query(models.CgmlstAlleleProfile).count(), 1)
+        self.assertEqual(crud.get_cgmlst_cluster_by_sample_id(self.session, 'SAM002'), ['BC300'])
+
+
+    def test_orm_delete_cascades_in_database(self):
+        sample = crud.get_sample(self.session, 'SAM001')
+        self.session.delete(sample)
+        self.session.commit()
+
+        self.assertEqual(self.session.query(models.Library).count(), 1)
+        self.assertEqual(self.session.query(models.CgmlstAlleleProfile).count(), 1)
+
         
+class TestCrudClusterSummaries(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        for sample_id, collection_date in [('SAM001', datetime.date(2020, 1, 1)), ('SAM002', datetime.date(2021, 6, 1)), ('SAM003', None)]:
+            crud.create_sample(self.session, {'sample_id': sample_id, 'accession': 'ACC' + sample_id, 'collection_date': collection_date})
+        libraries = [make_library(sample_id) for sample_id in ['SAM001', 'SAM002', 'SAM003']]
+        crud.create_libraries(self.session, libraries)
+        self.runs = {'SAM001': 'TESTABC', 'SAM002': 'TESTABC', 'SAM003': 'TESTABC'}
+
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+
+    def test_cluster_summaries_follow_membership(self):
+        clusters = [
+            {'sample_id': 'SAM001', 'cluster': 'BC300'},
+            {'sample_id': 'SAM002', 'cluster': 'BC300'},
+            {'sample_id': 'SAM003', 'cluster': 'BC301'},
+        ]
+        crud.add_samples_to_cgmlst_clusters(self.session, clusters, self.runs)
+
+        summaries = crud.get_cluster_summaries(self.session, crud.CLUSTER_TYPE_CGMLST)
+        self.assertEqual([summary.cluster_id for summary in summaries], ['BC300', 'BC301'])
+        self.assertEqual(summaries[0].num_samples, 2)
+        self.assertEqual(summaries[0].sample_ids, ['SAM001', 'SAM002'])
+        self.assertEqual(summaries[0].first_collection_date, datetime.date(2020, 1, 1))
+        self.assertEqual(summaries[0].last_collection_date, datetime.date(2021, 6, 1))
+        self.assertIsNone(summaries[1].first_collection_date)
+
+        crud.delete_samples(self.session, ['SAM002', 'SAM003'])
+
+        summaries = crud.get_cluster_summaries(self.session)
+        self.assertEqual([(summary.cluster_id, summary.sample_ids) for summary in summaries], [('BC300', ['SAM001'])])
+
+
+    def test_refresh_all_cluster_summaries(self):
+        crud.create_miru_profile(self.session, 'SAM001', {'cluster': 'CLUST001', 'miru_pattern': '2'})
+        self.session.query(models.ClusterSummary).delete()
+        self.session.commit()
+
+        self.assertEqual(crud.refresh_cluster_summaries(self.session, crud.CLUSTER_TYPE_MIRU), 1)
+
+        summary = crud.get_cluster_summaries(self.session, crud.CLUSTER_TYPE_MIRU, ['CLUST001'])[0]
+        self.assertEqual(summary.sample_ids, ['SAM001'])
+
+
+    def test_miru_profiles_without_cluster(self):
+        miru_profiles_by_sample_id = {
+            'SAM001': {'cluster': 'CLUST001', 'miru_pattern': '2', 'accession': None, 'collection_date': None},
+            'SAM002': {'cluster': None, 'miru_pattern': '3', 'accession': None, 'collection_date': None},
+        }
+        crud.create_miru_profiles(self.session, miru_profiles_by_sample_id)
+
+        summaries = crud.get_cluster_summaries(self.session, crud.CLUSTER_TYPE_MIRU)
+        self.assertEqual([(summary.cluster_id, summary.sample_ids) for summary in summaries], [('CLUST001', ['SAM001'])])
+
+
+class TestCrudCgmlstClusterSnapshots(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        self.sample_ids = ['SAM001', 'SAM002', 'SAM003', 'SAM004', 'SAM005']
+        libraries = [make_library(sample_id) for sample_id in self.sample_ids]
+        crud.create_libraries(self.session, libraries)
+        self.runs = {sample_id: 'TESTABC' for sample_id in self.sample_ids}
+
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+
+    def _snapshot(self, snapshot, clusters):
+        rows = [{'sample_id': sample_id, 'cluster': cluster} for sample_id, cluster in clusters.items()]
+        return crud.create_cgmlst_cluster_snapshot(self.session, snapshot, rows, self.runs)
+
+
+    def test_snapshot_replaces_current_clusters(self):
+        counts = self._snapshot('2023-01', {'SAM001': 'BC1', 'SAM002': 'BC1', 'SAM999': 'BC1'})
+        self.assertEqual(counts, {'assigned': 2, 'skipped': 1})
+        self.assertEqual(crud.get_cgmlst_cluster_by_sample_id(self.session, 'SAM001'), ['BC1'])
+
+        self._snapshot('2023-02', {'SAM001': 'BC2', 'SAM002': 'BC1'})
+
+        self.assertEqual(crud.get_cgmlst_cluster_by_sample_id(self.session, 'SAM001'), ['BC2'])
+        summaries = crud.get_cluster_summaries(self.session, crud.CLUSTER_TYPE_CGMLST)
+        self.assertEqual([(summary.cluster_id, summary.sample_ids) for summary in summaries], [('BC1', ['SAM002']), ('BC2', ['SAM001'])])
+        snapshots = crud.get_cgmlst_cluster_snapshots(self.session)
+        self.assertEqual([(snapshot['snapshot'], snapshot['num_samples']) for snapshot in snapshots], [('2023-01', 2), ('2023-02', 2)])
+
+
+    def test_diff_snapshots(self):
+        self._snapshot('2023-01', {'SAM001': 'BC1', 'SAM002': 'BC1', 'SAM003': 'BC2', 'SAM004': 'BC3'})
+        self._snapshot('2023-02', {'SAM001': 'BC1', 'SAM002': 'BC4', 'SAM003': 'BC1', 'SAM005': 'BC5'})
+
+        diff = crud.diff_cgmlst_cluster_snapshots(self.session, '2023-01', '2023-02')
+
+        self.assertEqual(diff['new_clusters'], ['BC5'])
+        self.assertEqual(diff['dissolved_clusters'], ['BC3'])
+        self.assertEqual(diff['merged_clusters'], {'BC1': ['BC1', 'BC2']})
+        self.assertEqual(diff['split_clusters'], {'BC1': ['BC1', 'BC4']})
+        self.assertEqual(diff['moved_samples'], [
+            {'sample_id': 'SAM002', 'old_cluster_id': 'BC1', 'new_cluster_id': 'BC4'},
+            {'sample_id': 'SAM003', 'old_cluster_id': 'BC2', 'new_cluster_id': 'BC1'},
+        ])
+        self.assertEqual(diff['added_samples'], ['SAM005'])
+        self.assertEqual(diff['removed_samples'], ['SAM004'])
+
+
+class TestCrudResistanceMatrix(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        collection_dates = {
+            'SAM001': datetime.date(2022, 1, 15),
+            'SAM002': datetime.date(2022, 2, 1),
+            'SAM003': datetime.date(2022, 7, 1),
+            'SAM004': None,
+        }
+        libraries = []
+        for sample_id, collection_date in collection_dates.items():
+            crud.create_sample(self.session, {'sample_id': sample_id, 'accession': 'ACC' + sample_id, 'collection_date': collection_date})
+            libraries.append(make_library(sample_id))
+        crud.create_libraries(self.session, libraries)
+        runs = {sample_id: 'TESTABC' for sample_id in collection_dates}
+
+        dr_variants = {
+            'SAM001': [('rpoB', 'c.1349C>T', ['rifampicin']), ('katG', 'c.944G>C', ['isoniazid'])],
+            'SAM002': [('rpoB', 'c.1333C>G', ['rifampicin']), ('rpoB', 'c.1349C>T', ['rifampicin'])],
+            'SAM003': [],
+            'SAM004': [('katG', 'c.944G>C', ['isoniazid'])],
+        }
+        for sample_id, variants in dr_variants.items():
+            amr_report = {
+                'id': sample_id,
+                'timestamp': datetime.date(2022, 8, 1),
+                'drtype': 'Sensitive' if not variants else 'RR-TB',
+                'qc': {'median_coverage': 50},
+                'db_version': {'name': 'tbdb'},
+                'dr_variants': [
+                    {'gene': gene, 'nucleotide_change': change, 'freq': 1.0, 'drugs': [{'drug': drug} for drug in drugs]}
+                    for gene, change, drugs in variants
+                ],
+            }
+            crud.create_amr_summary(self.session, amr_report, runs)
+
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+
+    def test_get_resistance_matrix(self):
+        resistance_matrix = crud.get_resistance_matrix(self.session)
+
+        self.assertEqual(resistance_matrix['sample_ids'], ['SAM001', 'SAM002', 'SAM003', 'SAM004'])
+        self.assertEqual(resistance_matrix['drugs'], ['isoniazid', 'rifampicin'])
+        self.assertEqual(resistance_matrix['matrix'].tolist(), [[1, 1], [0, 2], [0, 0], [1, 0]])
+
+        resistance_matrix = crud.get_resistance_matrix(self.session, sample_ids=['SAM002', 'SAM004'], date_range=(datetime.date(2022, 2, 1), None))
+        self.assertEqual(resistance_matrix['sample_ids'], ['SAM002'])
+        self.assertEqual(resistance_matrix['drugs'], ['rifampicin'])
+
+
+    def test_resistance_prevalence_by_quarter(self):
+        prevalence = crud.resistance_prevalence_by_quarter(crud.get_resistance_matrix(self.session))
+
+        self.assertEqual([(row['quarter'], row['drug'], row['num_samples'], row['num_resistant']) for row in prevalence], [
+            ('2022Q1', 'isoniazid', 2, 1),
+            ('2022Q1', 'rifampicin', 2, 2),
+            ('2022Q3', 'isoniazid', 1, 0),
+            ('2022Q3', 'rifampicin', 1, 0),
+        ])
+        self.assertEqual(prevalence[0]['prevalence'], 0.5)
+
+
 class SampleCrudMachine(RuleBasedStateMachine):
     def __init__(self):
         super(SampleCrudMachine, self).__init__()
@@ -0,0 +1,42 @@
+import unittest
+
+import tb_db.db as db
+
+
+class TestEngineOptions(unittest.TestCase):
+
+    def test_sqlite_uses_defaults(self):
+        options = db._engine_options({'connection_uri': 'sqlite:///:memory:'})
+
+        self.assertEqual(options, {})
+
+    def test_postgresql_pool_and_executemany(self):
+        config = {
+            'connection_uri': 'postgresql://tb:tb@localhost/tb',
+            'pool': {'size': 2},
+            'statement_timeout_ms': 60000,
+        }
+        options = db._engine_options(config)
+
+        self.assertEqual(options['pool_size'], 2)
+        self.assertEqual(options['max_overflow'], db.DEFAULT_MAX_OVERFLOW)
+        self.assertTrue(options['pool_pre_ping'])
+        self.assertEqual(options['executemany_mode'], 'values_plus_batch')
+        self.assertEqual(options['connect_args'], {'options': '-c statement_timeout=60000'})
+
+    def test_postgresql_pgbouncer(self):
+        config = {
+            'connection_uri': 'postgresql+psycopg2://tb:tb@localhost:6432/tb',
+            'pgbouncer': True,
+            'statement_timeout_ms': 60000,
+        }
+        options = db._engine_options(config)
+
+        self.assertNotIn('pool_size', options)
+        self.assertNotIn('connect_args', options)
+        self.assertEqual(options['poolclass'].__name__, 'NullPool')
+
+    def test_get_engine_is_shared(self):
+        config = {'connection_uri': 'sqlite:///:memory:'}
+
+        self.assertIs(db.get_engine(config), db.get_engine(dict(config)))
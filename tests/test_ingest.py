@@ -0,0 +1,90 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+import tb_db.models as models
+import tb_db.crud as crud
+import tb_db.ingest as ingest
+import tb_db.parsers as parsers
+
+connection_uri = "sqlite:///:memory:"
+
+test_data_path = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class TestIngestRun(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.samples_path = os.path.join(self.tmp_dir, 'samples.csv')
+        shutil.copy(os.path.join(test_data_path, 'samples_01.csv'), self.samples_path)
+
+    def tearDown(self):
+        self.session.close()
+        shutil.rmtree(self.tmp_dir)
+
+    def load_samples(self, force=False):
+        with ingest.ingest_run(self.session, 'load_samples', self.samples_path, force=force) as run:
+            if run.unchanged:
+                return None
+            samples = run.changed_rows(parsers.parse_samples(self.samples_path))
+            crud.create_samples(self.session, samples)
+
+        return samples
+
+    def test_unchanged_input_is_skipped(self):
+        loaded = self.load_samples()
+        self.assertEqual(len(loaded), len(parsers.parse_samples(self.samples_path)))
+
+        self.assertIsNone(self.load_samples())
+
+        ingest_runs = self.session.query(models.IngestRun).order_by(models.IngestRun.id).all()
+        self.assertEqual([r.outcome for r in ingest_runs], ['success', 'unchanged'])
+        self.assertEqual(ingest_runs[0].num_rows_processed, len(loaded))
+        self.assertEqual(ingest_runs[1].num_rows_processed, 0)
+
+        self.assertEqual(len(self.load_samples(force=True)), len(loaded))
+
+    def test_changed_input_loads_only_new_rows(self):
+        self.load_samples()
+        with open(self.samples_path, 'a') as f:
+            f.write('SAM999,2022-06-01\n')
+
+        loaded = self.load_samples()
+
+        self.assertEqual([sample['sample_id'] for sample in loaded], ['SAM999'])
+        self.assertIsNotNone(crud.get_sample(self.session, 'SAM999'))
+        latest_run = crud.get_latest_ingest_run(self.session, 'load_samples')
+        self.assertEqual(latest_run.num_rows_processed, 1)
+        self.assertEqual(latest_run.content_hash, ingest.utils.file_content_hash(self.samples_path))
+
+    def test_deleted_samples_are_reloaded(self):
+        loaded = self.load_samples()
+        crud.delete_samples(self.session, [loaded[0]['sample_id']])
+
+        reloaded = self.load_samples()
+
+        self.assertEqual(len(reloaded), len(loaded))
+        self.assertIsNotNone(crud.get_sample(self.session, loaded[0]['sample_id']))
+        ingest_runs = self.session.query(models.IngestRun).order_by(models.IngestRun.id).all()
+        self.assertEqual([r.outcome for r in ingest_runs], ['invalidated', 'success'])
+
+    def test_failed_run_is_recorded_and_not_skipped(self):
+        with self.assertRaises(ValueError):
+            with ingest.ingest_run(self.session, 'load_samples', self.samples_path):
+                raise ValueError('bad input')
+
+        failed_run = crud.get_latest_ingest_run(self.session, 'load_samples', outcome='failed')
+        self.assertEqual(failed_run.message, 'bad input')
+        self.assertIsNotNone(self.load_samples())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+
+import numpy as np
+
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+import tb_db.crud as crud
+import tb_db.distance as distance
+import tb_db.locus_qc as locus_qc
+import tb_db.models as models
+
+from helpers import make_library
+
+connection_uri = "sqlite:///:memory:"
+
+
+class TestLocusQc(unittest.TestCase):
+
+    def test_compute_locus_qc(self):
+        profiles = np.array([
+            [1, 1, 0],
+            [1, 2, 0],
+            [1, 3, 5],
+            [1, 1, 0],
+        ], dtype=np.int32)
+
+        qc = locus_qc.compute_locus_qc(profiles, ['Rv0001', 'Rv0002', 'Rv0003'], [10, 11, 12, 13])
+
+        np.testing.assert_allclose(qc['call_rate'], [1.0, 1.0, 0.25])
+        np.testing.assert_array_equal(qc['num_alleles'], [1, 3, 1])
+        np.testing.assert_allclose(qc['diversity'], [0.0, 5 / 6, 0.0])
+        np.testing.assert_allclose(qc['new_allele_rate'], [0.25, 0.75, 1.0])
+        np.testing.assert_allclose(qc['missingness'], [1 / 3, 1 / 3, 0.0, 1 / 3])
+        self.assertEqual(locus_qc.poor_loci(qc), ['Rv0003'])
+
+    def test_locus_mask(self):
+        profiles = np.array([[1, 1], [1, 2]], dtype=np.int32)
+
+        distances = distance.pairwise_distances(profiles, locus_mask=[True, False])
+
+        np.testing.assert_array_equal(distances, [[0, 0], [0, 0]])
+
+
+class TestStoredLocusQc(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        libraries = [make_library(sample_id) for sample_id in ['SAM001', 'SAM002']]
+        crud.create_libraries(self.session, libraries)
+        self.runs = {'SAM001': 'TESTABC', 'SAM002': 'TESTABC'}
+        self.scheme = {'name':'Ridom cgMLST.org','version':'2.1','num_loci':2891}
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_get_locus_qc_is_cached_until_profiles_change(self):
+        profiles = [{'sample_id': 'SAM001', 'profile': {'Rv0001': '1', 'Rv0002': '-'}, 'percent_called': 50.0}]
+        crud.create_cgmlst_allele_profiles(self.session, self.scheme, profiles, self.runs)
+        scheme_id = self.session.query(models.CgmlstScheme).one().id
+
+        qc = locus_qc.get_locus_qc(self.session, scheme_id)
+        self.assertIs(locus_qc.get_locus_qc(self.session, scheme_id), qc)
+        np.testing.assert_allclose(qc['call_rate'], [1.0, 0.0])
+
+        profiles = [{'sample_id': 'SAM002', 'profile': {'Rv0001': '2', 'Rv0002': '1'}, 'percent_called': 100.0}]
+        crud.create_cgmlst_allele_profiles(self.session, self.scheme, profiles, self.runs)
+
+        qc = locus_qc.get_locus_qc(self.session, scheme_id)
+        np.testing.assert_allclose(qc['call_rate'], [1.0, 0.5])
+        np.testing.assert_array_equal(qc['num_alleles'], [2, 1])
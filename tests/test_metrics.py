@@ -0,0 +1,48 @@
+import json
+import os
+import tempfile
+import unittest
+
+import tb_db.metrics as metrics
+
+
+class TestLoaderRun(unittest.TestCase):
+
+    def test_loader_run_writes_prometheus_and_json(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            textfile_path = os.path.join(tmp_dir, 'load_samples.prom')
+            report_path = os.path.join(tmp_dir, 'load_samples.json')
+            input_path = os.path.join(os.path.dirname(__file__), 'data', 'samples_01.csv')
+
+            with metrics.loader_run('load_samples', textfile_path, report_path) as run_metrics:
+                run_metrics.add_input(input_path)
+                with run_metrics.stage('parse'):
+                    run_metrics.inc('rows_parsed', 8)
+                with run_metrics.stage('write'):
+                    run_metrics.inc('rows_written', 4)
+
+            with open(textfile_path) as f:
+                text = f.read()
+            with open(report_path) as f:
+                report = json.load(f)
+
+        self.assertIn('tb_db_loader_rows_parsed{loader="load_samples"} 8.0', text)
+        self.assertIn('tb_db_loader_stage_duration_seconds{loader="load_samples",stage="write"}', text)
+        self.assertIn('tb_db_loader_success{loader="load_samples"} 1.0', text)
+        self.assertEqual(report['metrics']['bytes_read'], os.path.getsize(input_path))
+        self.assertEqual(report['metrics']['rows_written'], 4)
+        self.assertGreater(report['metrics']['peak_rss_bytes'], 0)
+        self.assertIn('rows_parsed_per_second', report['metrics'])
+
+
+    def test_loader_run_records_failure(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            report_path = os.path.join(tmp_dir, 'report.json')
+            with self.assertRaises(ValueError):
+                with metrics.loader_run('load_samples', json_report=report_path):
+                    raise ValueError()
+
+            with open(report_path) as f:
+                report = json.load(f)
+
+        self.assertEqual(report['metrics']['success'], 0)
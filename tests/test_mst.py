@@ -0,0 +1,116 @@
+import json
+import unittest
+import unittest.mock
+
+import numpy as np
+
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+import tb_db.crud as crud
+import tb_db.distance as distance
+import tb_db.models as models
+import tb_db.mst as mst
+
+from helpers import make_library
+
+connection_uri = "sqlite:///:memory:"
+
+
+class TestDistance(unittest.TestCase):
+
+    def test_pairwise_distances_ignore_missing(self):
+        profiles = np.array([
+            [1, 2, 3, 4],
+            [1, 2, 5, 0],
+            [0, 0, 0, 0],
+        ], dtype=np.int32)
+
+        distances = distance.pairwise_distances(profiles)
+        np.testing.assert_array_equal(distances, [[0, 1, 0], [1, 0, 0], [0, 0, 0]])
+
+        scaled = distance.pairwise_distances(profiles, scale_missing=True)
+        self.assertAlmostEqual(scaled[0, 1], 4 / 3)
+        self.assertTrue(np.isnan(scaled[0, 2]))
+
+    def test_pairwise_distances_in_locus_chunks(self):
+        rng = np.random.default_rng(0)
+        profiles = rng.integers(0, 4, size=(20, 30)).astype(np.int32)
+        other_profiles = rng.integers(0, 4, size=(7, 30)).astype(np.int32)
+        called = (profiles != 0)[:, None, :] & (other_profiles != 0)[None, :, :]
+        expected = np.count_nonzero(called & (profiles[:, None, :] != other_profiles[None, :, :]), axis=2)
+
+        with unittest.mock.patch.object(distance, 'MAX_BLOCK_ELEMENTS', 100):
+            self.assertGreater(len(distance._locus_chunks(np.concatenate([profiles, other_profiles]), 100 // 27)), 1)
+            np.testing.assert_array_equal(distance.pairwise_distances(profiles, other_profiles), expected)
+        np.testing.assert_array_equal(distance.pairwise_distances(profiles, other_profiles), expected)
+        np.testing.assert_array_equal(distance.pairwise_distances(profiles)[:7, :7], distance.pairwise_distances(profiles[:7], profiles[:7]))
+
+
+class TestMinimumSpanningTree(unittest.TestCase):
+
+    def test_minimum_spanning_tree(self):
+        distances = np.array([
+            [0, 2, 7, 9],
+            [2, 0, 3, 8],
+            [7, 3, 0, 1],
+            [9, 8, 1, 0],
+        ])
+
+        edges = mst.minimum_spanning_tree(distances)
+
+        self.assertEqual([(parent, child, int(d)) for parent, child, d in edges], [(0, 1, 2), (1, 2, 3), (2, 3, 1)])
+
+    def test_minimum_spanning_tree_disconnected_node(self):
+        distances = np.array([
+            [0, 1, np.nan],
+            [1, 0, np.nan],
+            [np.nan, np.nan, 0],
+        ])
+
+        edges = mst.minimum_spanning_tree(distances)
+
+        self.assertEqual([(parent, child) for parent, child, d in edges], [(0, 1), (0, 2)])
+        self.assertEqual(edges[0][2], 1)
+        self.assertTrue(np.isnan(edges[1][2]))
+
+    def test_formats(self):
+        sample_ids = ['SAM001', 'SAM002', 'SAM 3']
+        edges = [('SAM001', 'SAM002', 2), ('SAM001', 'SAM 3', 0)]
+
+        self.assertEqual(mst.to_newick(sample_ids, edges), "(SAM002:2,'SAM 3':0)SAM001;")
+        self.assertIn('<edge source="SAM001" target="SAM002">', mst.to_graphml(sample_ids, edges))
+        self.assertEqual(json.loads(mst.to_json(sample_ids, edges))['edges'][0], {'source': 'SAM001', 'target': 'SAM002', 'distance': 2})
+
+
+class TestClusterMst(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        sample_ids = ['SAM001', 'SAM002', 'SAM003']
+        libraries = [make_library(sample_id) for sample_id in sample_ids]
+        crud.create_libraries(self.session, libraries)
+        runs = {sample_id: 'TESTABC' for sample_id in sample_ids}
+        scheme = {'name':'Ridom cgMLST.org','version':'2.1','num_loci':2891}
+        profiles = [
+            {'sample_id': 'SAM001', 'profile': {'Rv0001': '1', 'Rv0002': '1', 'Rv0003': '1'}, 'percent_called': 100.0},
+            {'sample_id': 'SAM002', 'profile': {'Rv0001': '1', 'Rv0002': '2', 'Rv0003': '-'}, 'percent_called': 66.7},
+            {'sample_id': 'SAM003', 'profile': {'Rv0001': '2', 'Rv0002': '2', 'Rv0003': '2'}, 'percent_called': 100.0},
+        ]
+        crud.create_cgmlst_allele_profiles(self.session, scheme, profiles, runs)
+        clusters = [{'sample_id': sample_id, 'cluster': 'BC300'} for sample_id in sample_ids]
+        crud.add_samples_to_cgmlst_clusters(self.session, clusters, runs)
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_build_cluster_mst(self):
+        sample_ids, edges = mst.build_cluster_mst(self.session, 'BC300')
+
+        self.assertEqual(sample_ids, ['SAM001', 'SAM002', 'SAM003'])
+        self.assertEqual(edges, [('SAM001', 'SAM002', 1), ('SAM002', 'SAM003', 1)])
+        self.assertEqual(mst.to_newick(sample_ids, edges), '((SAM003:1)SAM002:1)SAM001;')
@@ -0,0 +1,201 @@
+import bz2
+import datetime
+import gzip
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import tb_db.crud as crud
+import tb_db.parsers as parsers
+import tb_db.records as records
+import tb_db.utils as utils
+
+test_data_path = os.path.join(os.path.dirname(__file__), 'data')
+
+
+class TestParseSpecies(unittest.TestCase):
+
+    def test_parse_species_keeps_top_n_per_sample(self):
+        species = parsers.parse_species(os.path.join(test_data_path, 'species_01.csv'))
+
+        sample_ids = [speci['sample_id'] for speci in species]
+        self.assertEqual(sample_ids.count('SAM001'), 5)
+        self.assertEqual(sample_ids.count('SAM002'), 3)
+        self.assertEqual(species[0]['name'], 'Mycobacterium tuberculosis')
+        self.assertNotIn('Homo sapiens', [speci['name'] for speci in species if speci['sample_id'] == 'SAM001'])
+
+    def test_iter_species_top_n(self):
+        species = list(parsers.iter_species(os.path.join(test_data_path, 'species_01.csv'), top_n=1))
+
+        self.assertEqual([speci['sample_id'] for speci in species], ['SAM001', 'SAM002'])
+
+
+class TestParsedRecords(unittest.TestCase):
+
+    def test_parse_samples_returns_typed_records(self):
+        samples = parsers.parse_samples(os.path.join(test_data_path, 'samples_01.csv'))
+
+        self.assertIsInstance(samples[0], records.SampleRecord)
+        self.assertEqual(samples[0].sample_id, 'S001')
+        self.assertEqual(samples[0]['collection_date'], datetime.date(2010, 3, 21))
+        self.assertFalse(hasattr(samples[0], '__dict__'))
+
+    def test_parse_miru_converts_collection_date(self):
+        miru_by_sample_id = parsers.parse_miru(os.path.join(test_data_path, 'miru_01.csv'))
+
+        miru = miru_by_sample_id['S001']
+        self.assertEqual(miru.collection_date, datetime.date(2009, 10, 2))
+        self.assertEqual(miru.quarter_tested, '2010-Q1')
+        self.assertEqual(miru.get('vntr_locus_position_154'), '2')
+        self.assertIsNone(miru.get('not_a_field'))
+
+    def test_parse_miru_12_loci(self):
+        miru_by_sample_id = parsers.parse_miru(os.path.join(test_data_path, 'miru_02.csv'))
+
+        miru = miru_by_sample_id['S002']
+        self.assertIs(miru.vntr_locus_position_424, records.ABSENT)
+        self.assertNotIn('vntr_locus_position_424', miru)
+        self.assertEqual(len([key for key in miru.keys() if key.startswith('vntr_locus')]), 12)
+        self.assertIsNone(miru_by_sample_id['S003']['cluster'])
+        percent_called, profile_by_position = crud.miru_vntr_summary(miru)
+        self.assertAlmostEqual(percent_called, 11 / 12 * 100.0)
+        self.assertEqual(len(profile_by_position), 12)
+        self.assertEqual(profile_by_position[960], '-')
+        self.assertNotIn(None, profile_by_position.values())
+
+        parallel = list(parsers._iter_records(os.path.join(test_data_path, 'miru_02.csv'), parsers._miru_record, processes=2, chunk_size=64))
+        self.assertEqual(parallel, list(miru_by_sample_id.values()))
+        self.assertIs(parallel[0].vntr_locus_position_424, records.ABSENT)
+
+    def test_records_hash_like_dicts(self):
+        sample = records.SampleRecord(sample_id='S001', collection_date=datetime.date(2010, 3, 21))
+
+        self.assertEqual(utils.content_hash(sample), utils.content_hash({'sample_id': 'S001', 'collection_date': datetime.date(2010, 3, 21)}))
+        with self.assertRaises(KeyError):
+            sample['accession']
+
+    def test_records_from_dicts(self):
+        miru = {'cluster': 'CLUST001', 'miru_pattern': '2', 'vntr_locus_position_154': '3'}
+        [record] = records.as_records([miru], records.MiruRecord)
+
+        self.assertIs(record.sample_id, records.ABSENT)
+        self.assertEqual(record.as_dict(), miru)
+        self.assertEqual(utils.content_hash(record), utils.content_hash(miru))
+        self.assertEqual(crud.miru_vntr_summary(record), crud.miru_vntr_summary(miru))
+        with self.assertRaises(KeyError):
+            records.SampleRecord.from_dict({'sample_id': 'S001'})
+
+
+class TestParallelParsing(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cgmlst_path = os.path.join(self.temp_dir.name, 'cgmlst.csv')
+        with open(self.cgmlst_path, 'w') as f:
+            f.write('sample_id,Rv0001,Rv0002,Rv0003\n')
+            for i in range(200):
+                f.write('S{:05d},{},{},-\n'.format(i, i % 7, i % 3))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_chunk_ranges_align_to_lines(self):
+        header, ranges = parsers._chunk_ranges(self.cgmlst_path, chunk_size=100)
+
+        self.assertEqual(header, b'sample_id,Rv0001,Rv0002,Rv0003\n')
+        self.assertGreater(len(ranges), 1)
+        with open(self.cgmlst_path, 'rb') as f:
+            data = f.read()
+        self.assertEqual(ranges[0][0], len(header))
+        self.assertEqual(ranges[-1][1], len(data))
+        for (start, end), (next_start, next_end) in zip(ranges, ranges[1:]):
+            self.assertEqual(end, next_start)
+            self.assertEqual(data[end - 1:end], b'\n')
+
+    def test_parallel_parse_matches_serial(self):
+        serial = parsers.parse_cgmlst(self.cgmlst_path)
+        parallel = list(parsers._iter_records(self.cgmlst_path, parsers._cgmlst_record, processes=2, chunk_size=256))
+
+        self.assertEqual([record.sample_id for record in parallel], list(serial))
+        self.assertEqual(parallel, list(serial.values()))
+
+    def test_parallel_parse_reports_first_bad_row(self):
+        with open(self.cgmlst_path, 'r') as f:
+            lines = f.readlines()
+        # Line 121 is bad, and so is the last line.
+        lines.insert(120, 'S88888,x\n')
+        lines.append('S99999\n')
+        with open(self.cgmlst_path, 'w') as f:
+            f.writelines(lines)
+
+        with self.assertRaises(parsers.ParseError) as parallel_error:
+            list(parsers._iter_records(self.cgmlst_path, _rv0001_allele, processes=2, chunk_size=128))
+        with self.assertRaises(parsers.ParseError) as serial_error:
+            list(parsers._iter_records(self.cgmlst_path, _rv0001_allele))
+        self.assertEqual(parallel_error.exception.line_number, 121)
+        self.assertEqual(str(parallel_error.exception), str(serial_error.exception))
+
+    def test_parallel_parse_quoted_line_breaks(self):
+        with open(self.cgmlst_path, 'r') as f:
+            lines = f.readlines()
+        # A quoted field with line breaks on lines 101-121, longer than a range.
+        lines[100] = 'S00099,1,"{}",-\n'.format('\n'.join(['note'] * 21))
+        lines.append('S99999\n')
+        with open(self.cgmlst_path, 'w') as f:
+            f.writelines(lines)
+
+        serial = list(parsers._iter_records(self.cgmlst_path, dict))
+        with self.assertLogs(level='WARNING'):
+            parallel = list(parsers._iter_records(self.cgmlst_path, dict, processes=2, chunk_size=64))
+        self.assertEqual(parallel, serial)
+        self.assertEqual(len(parallel), 201)
+        self.assertEqual(parallel[99]['Rv0002'].count('\n'), 20)
+
+        with self.assertRaises(parsers.ParseError) as parallel_error:
+            list(parsers._iter_records(self.cgmlst_path, _rv0001_allele, processes=2, chunk_size=64))
+        with self.assertRaises(parsers.ParseError) as serial_error:
+            list(parsers._iter_records(self.cgmlst_path, _rv0001_allele))
+        self.assertEqual(parallel_error.exception.line_number, 222)
+        self.assertEqual(str(parallel_error.exception), str(serial_error.exception))
+
+
+def _rv0001_allele(row):
+    return int(row['Rv0001'])
+
+
+class TestCompressedInputs(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.TemporaryDirectory()
+        self.cgmlst_path = os.path.join(test_data_path, 'cgmlst_01.csv')
+        with open(self.cgmlst_path, 'rb') as f:
+            self.cgmlst_data = f.read()
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def _compressed_copy(self, extension, compress):
+        path = os.path.join(self.temp_dir.name, 'cgmlst_01.csv.' + extension)
+        with open(path, 'wb') as f:
+            f.write(compress(self.cgmlst_data))
+        return path
+
+    def test_parse_compressed_cgmlst(self):
+        expected = parsers.parse_cgmlst(self.cgmlst_path)
+        compressors = {'gz': gzip.compress, 'bz2': bz2.compress}
+        if parsers.zstandard is not None:
+            compressors['zst'] = parsers.zstandard.ZstdCompressor().compress
+
+        for extension, compress in compressors.items():
+            path = self._compressed_copy(extension, compress)
+            self.assertEqual(parsers.parse_cgmlst(path), expected, extension)
+            # Compressed inputs can't be split into byte ranges, so they are parsed serially.
+            self.assertEqual(parsers.parse_cgmlst(path, processes=2), expected, extension)
+
+    def test_zst_without_zstandard(self):
+        path = self._compressed_copy('zst', lambda data: data)
+
+        with unittest.mock.patch.object(parsers, 'zstandard', None):
+            with self.assertRaises(ImportError):
+                parsers.parse_cgmlst(path)
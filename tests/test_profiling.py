@@ -0,0 +1,45 @@
+import unittest
+
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+import tb_db.models as models
+import tb_db.crud as crud
+import tb_db.profiling as profiling
+
+connection_uri = "sqlite:///:memory:"
+
+
+class TestProfileQueries(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+
+    def tearDown(self):
+        models.Base.metadata.drop_all(self.engine)
+
+
+    def test_profile_queries_records_crud_calls(self):
+        original_create_samples = crud.create_samples
+        samples = [{'sample_id': 'SAM001', 'collection_date': None}, {'sample_id': 'SAM002', 'collection_date': None}]
+
+        with profiling.profile_queries(self.engine) as profiler:
+            crud.create_samples(self.session, samples)
+            crud.get_sample(self.session, 'SAM001')
+
+        stats_by_name = {stats['name']: stats for stats in profiler.summary()}
+        self.assertEqual(stats_by_name['crud.create_samples']['calls'], 1)
+        self.assertEqual(stats_by_name['crud.create_samples']['commits'], 1)
+        self.assertGreaterEqual(stats_by_name['crud.create_samples']['statements'], 2)
+        self.assertEqual(stats_by_name['crud.get_sample']['statements'], 1)
+        self.assertIn('crud.create_samples', profiler.format_summary())
+        self.assertIs(crud.create_samples, original_create_samples)
+
+
+    def test_profile_queries_disabled(self):
+        with profiling.profile_queries(self.engine, enabled=False) as profiler:
+            self.assertIsNone(profiler)
+            self.assertFalse(hasattr(crud.create_samples, '__wrapped_by_profiler__'))
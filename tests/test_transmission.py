@@ -0,0 +1,60 @@
+import datetime
+import unittest
+import unittest.mock
+
+from sqlalchemy.orm import Session
+from sqlalchemy import create_engine
+
+import tb_db.crud as crud
+import tb_db.models as models
+import tb_db.transmission as transmission
+
+from helpers import make_library
+
+connection_uri = "sqlite:///:memory:"
+
+
+class TestTransmissionLinks(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = create_engine(connection_uri)
+        self.session = Session(self.engine)
+        models.Base.metadata.create_all(self.engine)
+
+        samples = {
+            'SAM001': (datetime.date(2022, 1, 1), '1111'),
+            'SAM002': (datetime.date(2022, 3, 1), '1112'),
+            'SAM003': (datetime.date(2023, 6, 1), '1111'),
+            'SAM004': (datetime.date(2022, 2, 1), '2222'),
+            'SAM005': (None, '1111'),
+        }
+        libraries = []
+        profiles = []
+        for sample_id, (collection_date, alleles) in samples.items():
+            crud.create_sample(self.session, {'sample_id': sample_id, 'accession': 'ACC' + sample_id, 'collection_date': collection_date})
+            libraries.append(make_library(sample_id))
+            profiles.append({'sample_id': sample_id, 'profile': dict(zip(['Rv0001', 'Rv0002', 'Rv0003', 'Rv0004'], alleles)), 'percent_called': 100.0})
+        crud.create_libraries(self.session, libraries)
+        runs = {sample_id: 'TESTABC' for sample_id in samples}
+        scheme = {'name':'Ridom cgMLST.org','version':'2.1','num_loci':2891}
+        crud.create_cgmlst_allele_profiles(self.session, scheme, profiles, runs)
+
+    def tearDown(self):
+        self.session.close()
+        models.Base.metadata.drop_all(self.engine)
+
+    def test_find_transmission_links(self):
+        links = transmission.find_transmission_links(self.session, max_distance=1, max_days=365)
+
+        self.assertEqual(links, [
+            {'sample_id': 'SAM001', 'linked_sample_id': 'SAM002', 'distance': 1, 'days_apart': 59},
+        ])
+
+    def test_sample_subset_and_window(self):
+        links = transmission.find_transmission_links(self.session, max_distance=1, max_days=1000, sample_ids=['SAM001', 'SAM003'])
+
+        self.assertEqual(links, [
+            {'sample_id': 'SAM001', 'linked_sample_id': 'SAM003', 'distance': 0, 'days_apart': 516},
+        ])
+        with unittest.mock.patch.object(transmission.distance, 'LOOKUP_BATCH_SIZE', 1):
+            self.assertEqual(transmission.find_transmission_links(self.session, max_distance=1, max_days=1000, sample_ids=['SAM003', 'SAM001', 'SAM005']), links)